@@ -0,0 +1,207 @@
+"""生成基准测试用的合成数据：随机小基因组、带富集峰的ChIP-seq reads和样品表。
+
+reads按块用numpy生成并流式写出，可以从1万条扩展到1亿条而不占用大量内存。read名中记录了
+其在基因组上的真实位置（如 ``@SRR0000001.1 chr2:12345:+``），工具替身据此输出比对结果。
+"""
+import argparse
+import json
+import os
+import shutil
+import gzip
+import subprocess
+
+import numpy as np
+
+complement = np.frombuffer(b'TGCA', dtype=np.uint8)  # 以ACGT编码0-3索引，得到互补碱基
+bases = np.frombuffer(b'ACGT', dtype=np.uint8)
+
+
+def args(parser, argv=None):
+    parser.add_argument('out', type=str, help='输出目录')
+    parser.add_argument('--reads', type=int, default=10000, help='每个样品的read（双端为read对）数')
+    parser.add_argument('--marks', type=str, default='H3K27me3,H3K4me3', help='处理组名称，逗号分隔')
+    parser.add_argument('--reps', type=int, default=2, help='每个处理组和对照的重复数')
+    parser.add_argument('--layout', type=str, default='paired', choices=['paired', 'single'])
+    parser.add_argument('--source', type=str, default='sra', choices=['sra', 'fastq'],
+                        help='sra为生成工具替身可读取的.sra替代文件；fastq为直接放入.fastq.gz（真实工具模式使用）')
+    parser.add_argument('--genome-size', type=int, default=2000000, help='基因组总长度（bp）')
+    parser.add_argument('--chromosomes', type=int, default=4, help='染色体数')
+    parser.add_argument('--read-length', type=int, default=50)
+    parser.add_argument('--fragment', type=int, default=200, help='平均片段长度')
+    parser.add_argument('--peaks', type=int, default=200, help='处理组的富集峰数')
+    parser.add_argument('--enrichment', type=float, default=0.2, help='处理组落在富集峰内的read比例')
+    parser.add_argument('--error-rate', type=float, default=0.005, help='测序错误率')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args(argv)
+
+
+# 写出压缩文件：有pigz时用pigz多线程压缩，否则用gzip模块
+class Compressed:
+    def __init__(self, path):
+        self.proc = None
+        if shutil.which('pigz'):
+            self.file = open(path, 'wb')
+            self.proc = subprocess.Popen(['pigz', '-1', '-c'], stdin=subprocess.PIPE, stdout=self.file)
+            self.stream = self.proc.stdin
+        else:
+            self.stream = gzip.open(path, 'wb', compresslevel=1)
+
+    def write(self, data):
+        self.stream.write(data)
+
+    def close(self):
+        self.stream.close()
+        if self.proc is not None:
+            self.proc.wait()
+            self.file.close()
+
+
+# 样品设计：每个重复一个input对照，以及每个处理组一个样品
+def design(argument):
+    samples = []
+    number = 1
+    for rep in range(argument.reps):
+        for treatment in ['input'] + [mark for mark in argument.marks.split(',') if mark]:
+            samples.append({'sample_name': f'SRR{number:07d}', 'treatment': treatment, 'rep': str(rep)})
+            number += 1
+    return samples
+
+
+def make_genome(argument, rng):
+    lengths = np.full(argument.chromosomes, argument.genome_size // argument.chromosomes)
+    lengths[:argument.chromosomes // 2] += argument.genome_size // (argument.chromosomes * 4)  # 长短不一
+    names = [f'chr{n + 1}' for n in range(argument.chromosomes)]
+    codes = [rng.integers(0, 4, size=int(length), dtype=np.uint8) for length in lengths]
+    return names, codes
+
+
+def write_genome(path, names, codes):
+    with open(path, 'wb') as f:
+        for name, code in zip(names, codes):
+            f.write(f'>{name}\n'.encode())
+            seq = bases[code].tobytes()
+            for start in range(0, len(seq), 60):
+                f.write(seq[start:start + 60] + b'\n')
+
+
+# 生成一块read：返回(染色体序号, 片段起点, 链)数组，处理组有一部分片段落在富集峰内
+def sample_fragments(n, argument, rng, lengths, peaks, treated):
+    chrom = rng.choice(len(lengths), size=n, p=lengths / lengths.sum())
+    usable = lengths[chrom] - argument.fragment * 2
+    start = (rng.random(n) * usable).astype(np.int64)
+    if treated and len(peaks[0]):
+        enriched = rng.random(n) < argument.enrichment
+        picked = rng.integers(0, len(peaks[0]), size=int(enriched.sum()))
+        chrom[enriched] = peaks[0][picked]
+        start[enriched] = np.maximum(0, peaks[1][picked] + rng.integers(-300, 300, size=len(picked)))
+        start = np.minimum(start, lengths[chrom] - argument.fragment * 2)
+    strand = rng.random(n) < 0.5
+    return chrom, start, strand
+
+
+# 取出一组read的序列（反向链取反向互补），加入测序错误
+def read_sequences(codes, chrom, start, reverse, argument, rng):
+    length = argument.read_length
+    seqs = np.empty((len(chrom), length), dtype=np.uint8)
+    offsets = np.arange(length)
+    for c in np.unique(chrom):
+        rows = np.nonzero(chrom == c)[0]
+        seqs[rows] = codes[c][start[rows, None] + offsets]
+    out = bases[seqs]
+    out[reverse] = complement[seqs[reverse][:, ::-1]]
+    errors = rng.random(out.shape) < argument.error_rate
+    out[errors] = bases[rng.integers(0, 4, size=int(errors.sum()))]
+    return out
+
+
+def quality_lines(n, length, rng):
+    # 质量值集中在Q30-Q40，3'端略低
+    qual = np.clip(rng.normal(36, 3, size=(n, length)) - np.linspace(0, 6, length), 2, 41).astype(np.uint8) + 33
+    return qual
+
+
+# 生成一块FASTQ记录（每条一个bytes），mate为None（单端）、1或2
+def fastq_records(acc, first, names, chrom, pos, strand, seqs, quals, mate):
+    suffix = f'/{mate}' if mate else ''
+    return [f'@{acc}.{first + n} {names[chrom[n]]}:{pos[n]}:{"-" if strand[n] else "+"}{suffix}\n'.encode()
+            + seqs[n].tobytes() + b'\n+\n' + quals[n].tobytes() + b'\n' for n in range(len(chrom))]
+
+
+def write_sample(directory, sample, treated, argument, names, codes, peaks, seed):
+    rng = np.random.default_rng(seed)
+    acc = sample['sample_name']
+    os.makedirs(directory, exist_ok=True)
+    lengths = np.array([len(code) for code in codes])
+    paired = argument.layout == 'paired'
+    if argument.source == 'sra':
+        # .sra替代文件：双端时两条mate依次交错写入同一个压缩FASTQ
+        outputs = [Compressed(os.path.join(directory, f'{acc}.sra'))]
+    elif paired:
+        outputs = [Compressed(os.path.join(directory, f'{acc}_{mate}.fastq.gz')) for mate in (1, 2)]
+    else:
+        outputs = [Compressed(os.path.join(directory, f'{acc}.fastq.gz'))]
+    chunk = 100000
+    length = argument.read_length
+    for first in range(1, argument.reads + 1, chunk):
+        n = min(chunk, argument.reads + 1 - first)
+        chrom, start, strand = sample_fragments(n, argument, rng, lengths, peaks, treated)
+        fragment = np.clip(rng.normal(argument.fragment, argument.fragment / 10, size=n).astype(np.int64),
+                           length, argument.fragment * 2)
+        pos1 = np.where(strand, start + fragment - length, start)
+        seq1 = read_sequences(codes, chrom, pos1, strand, argument, rng)
+        records1 = fastq_records(acc, first, names, chrom, pos1, strand, seq1, quality_lines(n, length, rng),
+                                 1 if paired else None)
+        if not paired:
+            outputs[0].write(b''.join(records1))
+            continue
+        pos2 = np.where(strand, start, start + fragment - length)
+        seq2 = read_sequences(codes, chrom, pos2, ~strand, argument, rng)
+        records2 = fastq_records(acc, first, names, chrom, pos2, ~strand, seq2, quality_lines(n, length, rng), 2)
+        if argument.source == 'sra':
+            outputs[0].write(b''.join(record for pair in zip(records1, records2) for record in pair))
+        else:
+            outputs[0].write(b''.join(records1))
+            outputs[1].write(b''.join(records2))
+    for output in outputs:
+        output.close()
+
+
+# 生成全部数据，参数与已有数据相同时直接复用；返回清单
+def generate(argument):
+    manifest_path = os.path.join(argument.out, 'manifest.json')
+    params = {key: value for key, value in vars(argument).items() if key != 'out'}
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest['params'] == params:
+            return manifest
+    except (OSError, ValueError, KeyError):
+        pass
+    if os.path.isdir(argument.out):
+        shutil.rmtree(argument.out)
+    os.makedirs(argument.out)
+    rng = np.random.default_rng(argument.seed)
+    names, codes = make_genome(argument, rng)
+    write_genome(os.path.join(argument.out, 'genome.fa'), names, codes)
+    lengths = np.array([len(code) for code in codes])
+    peak_chrom = rng.choice(len(lengths), size=argument.peaks, p=lengths / lengths.sum())
+    peak_pos = (rng.random(argument.peaks) * (lengths[peak_chrom] - 4 * argument.fragment)).astype(np.int64)
+    samples = design(argument)
+    for n, sample in enumerate(samples):
+        write_sample(os.path.join(argument.out, sample['sample_name']), sample, sample['treatment'] != 'input',
+                     argument, names, codes, (peak_chrom, peak_pos), argument.seed * 1000 + n)
+    with open(os.path.join(argument.out, 'Sample list.csv'), 'w', encoding="utf-8") as f:
+        f.write('sample_name,treatment,rep\n')
+        for sample in samples:
+            f.write(f"{sample['sample_name']},{sample['treatment']},{sample['rep']}\n")
+    manifest = {'params': params, 'samples': samples, 'genome': 'genome.fa',
+                'chromosomes': dict(zip(names, lengths.tolist()))}
+    with open(manifest_path, 'w', encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+if __name__ == '__main__':
+    arguments = args(argparse.ArgumentParser(description="Generate synthetic ChIP-seq data for benchmarks."))
+    result = generate(arguments)
+    print(f"{len(result['samples'])} samples with {arguments.reads} reads each are in {arguments.out}.")
@@ -0,0 +1,250 @@
+"""运行chip.py的基准测试并报告各步骤的耗时和调度开销。
+
+默认使用合成数据和shims/chip_shim.py中的工具替身，不需要网络和生物信息学工具，可在CI中运行；
+--real-tools时使用PATH中的真实工具（合成数据改为直接提供.fastq.gz）。每次重复在新的运行目录中进行，
+结果取各次重复的中位数。开销为步骤耗时中不属于任何外部命令的部分，即chip.py自身的调度、检查和文件处理时间。
+
+示例：
+    python benchmarks/run.py --reads 10000 --repeat 3 --output bench.json
+    python benchmarks/run.py --reads 1000000 --baseline bench.json --tolerance 0.2
+    python benchmarks/run.py --reads 10000 -- --front-end dump --qc fastqc
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+import generate  # noqa: E402
+from shims import chip_shim  # noqa: E402
+
+chip = os.path.join(os.path.dirname(here), 'chip.py')
+
+
+def args(parser):
+    parser.add_argument('--reads', type=int, default=10000, help='每个样品的read数，可从1万到1亿')
+    parser.add_argument('--layout', type=str, default='paired', choices=['paired', 'single'])
+    parser.add_argument('--reps', type=int, default=2, help='每个处理组和对照的重复数')
+    parser.add_argument('--marks', type=str, default='H3K27me3,H3K4me3', help='处理组名称，逗号分隔')
+    parser.add_argument('--genome-size', type=int, default=2000000, help='合成基因组的总长度（bp）')
+    parser.add_argument('--data', type=str, default=None, help='合成数据目录，参数相同时复用，默认在系统临时目录下')
+    parser.add_argument('--workdir', type=str, default=None, help='运行目录的上级目录，默认新建临时目录')
+    parser.add_argument('-t', type=int, default=None, help='传给chip.py的总线程数')
+    parser.add_argument('-j', type=int, default=2, help='传给chip.py的同时分析的样品数')
+    parser.add_argument('--repeat', type=int, default=1, help='重复运行的次数，结果取中位数')
+    parser.add_argument('--cached-rerun', action='store_true', help='每次运行后在同一目录再运行一次，测量全部命中缓存时的耗时')
+    parser.add_argument('--time-scale', type=float, default=1.0,
+                        help='工具替身模拟耗时的倍数，0为不模拟耗时（只测chip.py自身开销）')
+    parser.add_argument('--real-tools', action='store_true', help='使用PATH中的真实工具代替替身')
+    parser.add_argument('--output', type=str, default=None, help='把结果写入JSON文件，可作为以后的--baseline')
+    parser.add_argument('--baseline', type=str, default=None, help='与之前的结果比较，耗时增加超过--tolerance时返回非零值')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的耗时增加比例')
+    parser.add_argument('--min-delta', type=float, default=0.5, help='小于此秒数的耗时差异不视为退步')
+    parser.add_argument('--keep', action='store_true', help='保留运行目录')
+    argument, extra = parser.parse_known_args()
+    argument.extra = [arg for arg in extra if arg != '--']
+    return argument
+
+
+# 把合成数据链接到运行目录，不能硬链接时复制
+def link_tree(src, dst):
+    os.makedirs(dst, exist_ok=True)
+    for name in os.listdir(src):
+        if name == 'manifest.json':
+            continue
+        source, target = os.path.join(src, name), os.path.join(dst, name)
+        if os.path.isdir(source):
+            link_tree(source, target)
+            continue
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
+
+
+# 建立替身目录：每个工具名都是指向chip_shim.py的链接，替身按调用名区分工具
+def shim_bin(directory):
+    os.makedirs(directory, exist_ok=True)
+    shim = os.path.join(here, 'shims', 'chip_shim.py')
+    os.chmod(shim, 0o755)
+    for tool in chip_shim.tools:
+        os.symlink(shim, os.path.join(directory, tool))
+    return directory
+
+
+# 求若干时间区间的并集长度
+def union_length(spans):
+    total, end = 0.0, None
+    for start, stop in sorted(spans):
+        if end is None or start > end:
+            total += stop - start
+            end = stop
+        elif stop > end:
+            total += stop - end
+            end = stop
+    return total
+
+
+# 由run_metrics.json计算各步骤的耗时、外部命令耗时和开销；同类步骤（如各组合的callpeak）合并统计
+def analyse(report, begin, finish):
+    commands = {}
+    for record in report['records']:
+        if record['kind'] == 'command' and record['start'] != '':
+            commands.setdefault((record['sample'], record['stage']), []).append((record['start'], record['end']))
+    stages = {}
+    for record in report['records']:
+        if record['kind'] != 'stage':
+            continue
+        stat = stages.setdefault(record['stage'].split(':')[0],
+                                 {'count': 0, 'cached': 0, 'failed': 0, 'wall_sec': 0.0, 'command_sec': 0.0,
+                                  'overhead_sec': 0.0, 'cpu_sec': 0.0, 'output_bytes': 0})
+        stat['count'] += 1
+        if record['status'] == 'cached':
+            stat['cached'] += 1
+            continue
+        stat['failed'] += record['status'] == 'failed'
+        spans = commands.get((record['sample'], record['stage']), [])
+        busy = union_length(spans)
+        stat['wall_sec'] += record['wall_sec']
+        stat['command_sec'] += busy
+        stat['overhead_sec'] += max(0.0, record['wall_sec'] - busy)
+        stat['cpu_sec'] += (record['user_sec'] or 0) + (record['sys_sec'] or 0)
+        stat['output_bytes'] += record['output_bytes'] or 0
+    all_spans = [span for spans in commands.values() for span in spans]
+    first = min((start for start, _ in all_spans), default=finish)
+    last = max((end for _, end in all_spans), default=begin)
+    wall = finish - begin
+    return {'wall_sec': wall, 'startup_sec': max(0.0, first - begin), 'shutdown_sec': max(0.0, finish - last),
+            'command_sec': union_length(all_spans), 'overhead_sec': wall - union_length(all_spans),
+            'stages': stages}
+
+
+# 在运行目录中运行一次chip.py，返回耗时分析；chip.py的输出写入log_name
+def run_chip(directory, argument, env, log_name):
+    cmd = [sys.executable, chip, '-k', 'puman', '-s', 'Sample list.csv', '-r', 'genome.fa', '-j', str(argument.j),
+           '-n', 'bench', '--scratch', os.path.join(directory, 'scratch'), '--status-interval', '1']
+    if argument.t:
+        cmd += ['-t', str(argument.t)]
+    cmd += argument.extra
+    log = os.path.join(directory, log_name)
+    begin = time.time()
+    with open(log, 'w', encoding="utf-8") as f:
+        proc = subprocess.run(cmd, cwd=directory, env=env, stdout=f, stderr=subprocess.STDOUT)
+    finish = time.time()
+    if proc.returncode != 0:
+        with open(log, encoding="utf-8") as f:
+            sys.stderr.write(''.join(f.readlines()[-30:]))
+        raise SystemExit(f"chip.py exited with {proc.returncode}, see {log}.")
+    with open(os.path.join(directory, 'result', 'bench', 'run_metrics.json'), encoding="utf-8") as f:
+        report = json.load(f)
+    failed = [r['stage'] for r in report['records'] if r['kind'] == 'stage' and r['status'] == 'failed']
+    if failed:
+        raise SystemExit(f"Stages {', '.join(failed)} failed, see {log}.")
+    return analyse(report, begin, finish)
+
+
+# 各次重复的中位数
+def median_result(results):
+    merged = {key: statistics.median(r[key] for r in results) for key in results[0] if key != 'stages'}
+    merged['stages'] = {}
+    for name in results[0]['stages']:
+        stats = [r['stages'][name] for r in results if name in r['stages']]
+        merged['stages'][name] = {key: statistics.median(s[key] for s in stats) for key in stats[0]}
+    return merged
+
+
+def print_result(result):
+    print(f"{'stage':<12}{'count':>6}{'wall(s)':>10}{'commands(s)':>13}{'overhead(s)':>13}{'cpu(s)':>9}"
+          f"{'output(MB)':>12}")
+    for name, stat in result['stages'].items():
+        print(f"{name:<12}{stat['count']:>6.0f}{stat['wall_sec']:>10.2f}{stat['command_sec']:>13.2f}"
+              f"{stat['overhead_sec']:>13.2f}{stat['cpu_sec']:>9.2f}{stat['output_bytes'] / 1e6:>12.1f}")
+    print(f"Total {result['wall_sec']:.2f} sec: commands {result['command_sec']:.2f} sec, overhead "
+          f"{result['overhead_sec']:.2f} sec (startup {result['startup_sec']:.2f} sec, shutdown "
+          f"{result['shutdown_sec']:.2f} sec).")
+    if 'cached_wall_sec' in result:
+        print(f"Cached rerun: {result['cached_wall_sec']:.2f} sec.")
+
+
+# 与基准结果比较总耗时、各步骤耗时和开销，返回退步的项目
+def compare(result, baseline, tolerance, min_delta):
+    pairs = [('total', 'wall_sec', result, baseline['result'])]
+    if 'cached_wall_sec' in result and 'cached_wall_sec' in baseline['result']:
+        pairs.append(('total', 'cached_wall_sec', result, baseline['result']))
+    for name, stat in result['stages'].items():
+        if name in baseline['result']['stages']:
+            pairs += [(name, key, stat, baseline['result']['stages'][name]) for key in ('wall_sec', 'overhead_sec')]
+    regressions = []
+    for name, key, new, old in pairs:
+        if new[key] - old[key] > max(min_delta, old[key] * tolerance):
+            regressions.append(f"{name} {key}: {old[key]:.2f} -> {new[key]:.2f} sec")
+    return regressions
+
+
+def main():
+    argument = args(argparse.ArgumentParser(description="Benchmark chip.py on synthetic data."))
+    source = 'fastq' if argument.real_tools else 'sra'
+    data = argument.data or os.path.join(tempfile.gettempdir(), 'chip_helper_bench',
+                                         f'{argument.reads}_{argument.layout}_{source}')
+    gen_args = generate.args(argparse.ArgumentParser(), [
+        data, '--reads', str(argument.reads), '--marks', argument.marks, '--reps', str(argument.reps),
+        '--layout', argument.layout, '--source', source, '--genome-size', str(argument.genome_size)])
+    start = time.time()
+    manifest = generate.generate(gen_args)
+    print(f"Synthetic data ({len(manifest['samples'])} samples x {argument.reads} reads) is ready in {data}. "
+          f"Used: {time.time() - start:.1f} sec.")
+    workdir = argument.workdir or tempfile.mkdtemp(prefix='chip_helper_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    env = dict(os.environ)
+    bin_dir = None
+    if not argument.real_tools:
+        bin_dir = shim_bin(os.path.join(workdir, 'bin'))
+        env['PATH'] = bin_dir + os.pathsep + env.get('PATH', '')
+        env['CHIP_SHIM_TIME_SCALE'] = str(argument.time_scale)
+    results = []
+    try:
+        for n in range(argument.repeat):
+            directory = os.path.join(workdir, f'run{n + 1}')
+            link_tree(data, directory)
+            env['CHIP_SHIM_STATE'] = os.path.join(directory, 'shim_state')
+            result = run_chip(directory, argument, env, 'chip.out')
+            if argument.cached_rerun:
+                result['cached_wall_sec'] = run_chip(directory, argument, env, 'chip_cached.out')['wall_sec']
+            print(f"Run {n + 1}/{argument.repeat}: {result['wall_sec']:.2f} sec.")
+            results.append(result)
+    finally:
+        if not argument.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+        else:
+            print(f"Run directories are kept in {workdir}.")
+    result = median_result(results)
+    print_result(result)
+    report = {'reads': argument.reads, 'layout': argument.layout, 'samples': len(manifest['samples']),
+              'real_tools': argument.real_tools, 'time_scale': argument.time_scale, 'repeat': argument.repeat,
+              'chip_args': argument.extra, 'result': result, 'runs': results}
+    if argument.output:
+        with open(argument.output, 'w', encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+    if argument.baseline:
+        with open(argument.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        changed = [key for key in ('reads', 'layout', 'samples', 'real_tools', 'time_scale', 'chip_args')
+                   if baseline.get(key) != report[key]]
+        if changed:
+            print(f"! The baseline was run with different {', '.join(changed)}, the comparison may be meaningless. !")
+        regressions = compare(result, baseline, argument.tolerance, argument.min_delta)
+        for regression in regressions:
+            print(f"! Regression: {regression} !")
+        if regressions:
+            sys.exit(1)
+        print("No regression against the baseline.")
+
+
+if __name__ == '__main__':
+    main()
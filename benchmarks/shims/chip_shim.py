@@ -0,0 +1,579 @@
+#!/usr/bin/env python3
+"""基准测试用的工具替身：按调用名（argv[0]）模仿fastq-dump、fasterq-dump、vdb-dump、fastp、bwa、samtools、
+macs2、bamCoverage、bedGraphToBigWig、bedtools和fastqc的命令行、输出文件和运行时间。
+
+替身真正读写数据，输出量与输入的read数成比例：.bam为gzip压缩的SAM文本，.bai和.bw为简化的文本格式。
+运行时间按"处理量 / (速率 × 线程数) × CHIP_SHIM_TIME_SCALE"模拟，处理过程中分批等待，管道中的各个替身
+因此与真实工具一样互相重叠。速率可由CHIP_SHIM_RATES（JSON）覆盖，bwa shm的状态保存在CHIP_SHIM_STATE目录中。
+"""
+import collections
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+
+# 各工具每线程每秒处理的量（read数；bwa index为碱基数，bwa shm为载入索引的字节数，bedGraph相关为行数）
+rates = {'fastq-dump': 250000, 'fasterq-dump': 500000, 'fastp': 300000, 'fastqc': 400000,
+         'bwa index': 1500000, 'bwa shm': 1 << 30, 'bwa mem': 10000,
+         'samtools view': 2000000, 'samtools sort': 1000000, 'samtools fixmate': 1500000,
+         'samtools markdup': 1000000, 'samtools index': 5000000,
+         'macs2 filterdup': 400000, 'macs2 callpeak': 150000, 'macs2 bdgcmp': 1000000,
+         'bamCoverage': 1000000, 'bedGraphToBigWig': 2000000, 'bedtools': 2000000}
+rates.update(json.loads(os.environ.get('CHIP_SHIM_RATES', '{}')))
+time_scale = float(os.environ.get('CHIP_SHIM_TIME_SCALE', '1'))
+state_dir = os.environ.get('CHIP_SHIM_STATE', os.path.join(tempfile.gettempdir(), 'chip_shim'))
+versions = {'fastq-dump': 'fastq-dump : 3.0.3', 'fasterq-dump': 'fasterq-dump : 3.0.3',
+            'vdb-dump': 'vdb-dump : 3.0.3', 'fastp': 'fastp 0.23.4', 'samtools': 'samtools 1.17\nUsing htslib 1.17',
+            'macs2': 'macs2 2.2.9.1', 'bamCoverage': 'bamCoverage 3.5.1', 'fastqc': 'FastQC v0.12.1',
+            'bedtools': 'bedtools v2.31.0'}
+
+
+# 按模拟速率控制进度：每处理一批调用一次tick，处理得比模拟快时等待
+class Pacer:
+    def __init__(self, name, threads=1):
+        self.rate = rates[name] * max(1, threads)
+        self.start = time.time()
+        self.done = 0
+
+    def tick(self, units):
+        self.done += units
+        delay = self.start + self.done / self.rate * time_scale - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+# 解析命令行：flags为带值的选项，其余为位置参数；返回(选项字典, 位置参数列表)
+def parse(argv, flags):
+    options, positional = {}, []
+    k = 0
+    while k < len(argv):
+        if argv[k] in flags and k + 1 < len(argv):
+            options[argv[k]] = argv[k + 1]
+            k += 2
+        else:
+            if argv[k] == '-' or not argv[k].startswith('-'):
+                positional.append(argv[k])
+            else:
+                options[argv[k]] = True
+            k += 1
+    return options, positional
+
+
+# 打开输入：'-'为标准输入，按文件头判断是否gzip压缩
+def open_in(path):
+    stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+    if stream.peek(2)[:2] == b'\x1f\x8b':
+        return gzip.GzipFile(fileobj=stream)
+    return stream
+
+
+# 打开输出：None或'-'为标准输出；压缩格式（.bam、.gz）用最快的gzip等级
+def open_out(path, compressed):
+    stream = sys.stdout.buffer if path in (None, '-') else open(path, 'wb')
+    return gzip.GzipFile(fileobj=stream, mode='wb', compresslevel=1) if compressed else stream
+
+
+def fastq_records(stream):
+    while True:
+        record = [stream.readline() for _ in range(4)]
+        if not record[0]:
+            return
+        yield record
+
+
+# .sra替代文件中的记录是否为交错的双端read
+def interleaved(path):
+    with open_in(path) as f:
+        names = [record[0].split()[-1] for _, record in zip(range(2), fastq_records(f))]
+    return len(names) == 2 and names[0].endswith(b'/1') and names[1].endswith(b'/2')
+
+
+def sra_path(source):
+    if os.path.isfile(source):
+        return source
+    return os.path.join(source, f'{source}.sra')
+
+
+def fastq_dump(argv):
+    options, positional = parse(argv, {'-O'})
+    acc = positional[-1]
+    out = options.get('-O', '.')
+    src = sra_path(acc) if os.path.isfile(sra_path(acc)) else os.path.join(out, f'{acc}.sra')
+    paired = interleaved(src)
+    outputs = [open(os.path.join(out, f'{acc}_{mate}.fastq'), 'wb') for mate in (1, 2)] if paired \
+        else [open(os.path.join(out, f'{acc}.fastq'), 'wb')]
+    pacer = Pacer('fastq-dump')
+    spots = 0
+    with open_in(src) as f:
+        for n, record in enumerate(fastq_records(f)):
+            outputs[n % len(outputs)].write(b''.join(record))
+            if n % len(outputs) == len(outputs) - 1:
+                spots += 1
+                if spots % 10000 == 0:
+                    pacer.tick(10000)
+    pacer.tick(spots % 10000)
+    for output in outputs:
+        output.close()
+    print(f"Read {spots} spots for {acc}\nWritten {spots} spots for {acc}", file=sys.stderr)
+
+
+def fasterq_dump(argv):
+    options, positional = parse(argv, {'--threads', '-e', '-t', '-O', '-o'})
+    assert '--stdout' in options, 'the shim only supports --stdout'
+    pacer = Pacer('fasterq-dump', int(options.get('--threads', options.get('-e', 6))))
+    spots = 0
+    out = sys.stdout.buffer
+    with open_in(sra_path(positional[-1])) as f:
+        for n, record in enumerate(fastq_records(f)):
+            out.write(b''.join(record))
+            spots += 1
+            if spots % 10000 == 0:
+                pacer.tick(10000)
+    pacer.tick(spots % 10000)
+    out.flush()
+    print(f"spots read      : {spots}\nreads read      : {spots}\nreads written   : {spots}", file=sys.stderr)
+
+
+def vdb_dump(argv):
+    _, positional = parse(argv, {'-C', '-R'})
+    types = ['SRA_READ_TYPE_BIOLOGICAL'] * (2 if interleaved(sra_path(positional[-1])) else 1)
+    print(f"READ_TYPE: {', '.join(types)}")
+
+
+low_quality = bytes(range(33, 33 + 15))  # 低于Q15的质量字符
+high_quality = bytes(range(33 + 30, 127))  # 不低于Q30的质量字符
+
+
+# 去接头：低于Q15的碱基超过40%的read（双端时整对）被过滤，其余原样输出
+def fastp(argv):
+    options, _ = parse(argv, {'-i', '-I', '-o', '-O', '-w', '-j', '-h', '-z', '--thread'})
+    pacer = Pacer('fastp', int(options.get('-w', options.get('--thread', 3))))
+    if '--stdin' in options:
+        source = open_in('-')
+        mates = 2 if '--interleaved_in' in options else 1
+        records = fastq_records(source)
+    else:
+        sources = [open_in(options[flag]) for flag in ('-i', '-I') if flag in options]
+        mates = len(sources)
+        records = (record for group in zip(*[fastq_records(s) for s in sources]) for record in group)
+    outputs = [open_out(options[flag], options[flag].endswith('.gz')) for flag in ('-o', '-O')[:mates]]
+    stats = {'before_filtering': collections.Counter(), 'after_filtering': collections.Counter()}
+    group = []
+    for record in records:
+        group.append(record)
+        if len(group) < mates:
+            continue
+        passed = all(len(record[3]) - len(record[3].translate(None, low_quality)) <= 0.4 * len(record[3])
+                     for record in group)
+        for record in group:
+            seq = record[1].rstrip()
+            for key in ('before_filtering',) + (('after_filtering',) if passed else ()):
+                stats[key]['total_reads'] += 1
+                stats[key]['total_bases'] += len(seq)
+                stats[key]['q30_bases'] += len(record[3]) - len(record[3].translate(None, high_quality))
+                stats[key]['gc_bases'] += seq.count(b'G') + seq.count(b'C')
+        if passed:
+            for output, record in zip(outputs, group):
+                output.write(b''.join(record))
+        group = []
+        if stats['before_filtering']['total_reads'] % 20000 == 0:
+            pacer.tick(20000)
+    pacer.tick(stats['before_filtering']['total_reads'] % 20000)
+    for output in outputs:
+        output.close()
+    summary = {}
+    for key, counter in stats.items():
+        bases = max(1, counter['total_bases'])
+        summary[key] = {'total_reads': counter['total_reads'], 'total_bases': counter['total_bases'],
+                        'q20_bases': counter['q30_bases'], 'q30_bases': counter['q30_bases'],
+                        'q20_rate': round(counter['q30_bases'] / bases, 6),
+                        'q30_rate': round(counter['q30_bases'] / bases, 6),
+                        'read1_mean_length': counter['total_bases'] // max(1, counter['total_reads']),
+                        'gc_content': round(counter['gc_bases'] / bases, 6)}
+    if '-j' in options:
+        with open(options['-j'], 'w', encoding="utf-8") as f:
+            json.dump({'summary': summary}, f, indent=1)
+    if '-h' in options:
+        with open(options['-h'], 'w', encoding="utf-8") as f:
+            f.write(f"<html><body><pre>{json.dumps(summary, indent=1)}</pre></body></html>\n")
+    print(f"Read1 before filtering:\ntotal reads: {summary['before_filtering']['total_reads']}", file=sys.stderr)
+
+
+def fastqc(argv):
+    options, positional = parse(argv, {'-t', '-o', '--threads'})
+    pacer = Pacer('fastqc', min(len(positional), int(options.get('-t', options.get('--threads', 1)))))
+    for path in positional:
+        reads = 0
+        with open_in(path) as f:
+            for _ in fastq_records(f):
+                reads += 1
+        pacer.tick(reads)
+        name = os.path.basename(path).split('.fastq')[0].split('.fq')[0]
+        directory = options.get('-o', os.path.dirname(path))
+        with open(os.path.join(directory, f'{name}_fastqc.html'), 'w', encoding="utf-8") as f:
+            f.write(f"<html><body>{name}: {reads} reads</body></html>\n")
+        with open(os.path.join(directory, f'{name}_fastqc.zip'), 'wb') as f:
+            f.write(gzip.compress(str(reads).encode()))
+        print(f"Analysis complete for {os.path.basename(path)}", file=sys.stderr)
+
+
+# 读取FASTA的染色体名称和长度
+def fasta_lengths(path):
+    lengths = {}
+    name = None
+    with open_in(path) as f:
+        for line in f:
+            if line.startswith(b'>'):
+                name = line[1:].split()[0].decode()
+                lengths[name] = 0
+            elif name is not None:
+                lengths[name] += len(line.strip())
+    return lengths
+
+
+def shm_state():
+    os.makedirs(state_dir, exist_ok=True)
+    return os.path.join(state_dir, 'bwa_shm')
+
+
+def index_size(prefix):
+    return sum(os.path.getsize(f'{prefix}.{ext}') for ext in ('bwt', 'pac', 'sa'))
+
+
+# 索引是否已由bwa shm载入共享内存
+def index_shared(prefix):
+    try:
+        with open(shm_state(), encoding="utf-8") as f:
+            return any(line.split('\t')[0] == os.path.basename(prefix) for line in f)
+    except OSError:
+        return False
+
+
+# bwa index写出与真实索引大小相近的文件；.ann中记录染色体名称和长度，比对时输出@SQ
+def bwa_index(argv):
+    options, positional = parse(argv, {'-p', '-a', '-b'})
+    lengths = fasta_lengths(positional[-1])
+    prefix = options.get('-p', positional[-1])
+    total = sum(lengths.values())
+    pacer = Pacer('bwa index')
+    for ext, size in (('bwt', total // 4 + 1), ('pac', total // 4 + 1), ('sa', total // 8 + 1), ('amb', 1)):
+        with open(f'{prefix}.{ext}', 'wb') as f:
+            f.write(b'\0' * size)
+    pacer.tick(total)
+    with open(f'{prefix}.ann', 'w', encoding="utf-8") as f:
+        for name, length in lengths.items():
+            f.write(f"{name}\t{length}\n")
+    print(f"[main] Real time: {time.time() - pacer.start:.3f} sec", file=sys.stderr)
+
+
+def bwa_shm(argv):
+    state = shm_state()
+    if argv[:1] == ['-l']:
+        if os.path.exists(state):
+            with open(state, encoding="utf-8") as f:
+                print(f.read(), end='')
+    elif argv[:1] == ['-d']:
+        if os.path.exists(state):
+            os.remove(state)
+    else:
+        Pacer('bwa shm').tick(index_size(argv[-1]))
+        with open(state, 'w', encoding="utf-8") as f:
+            f.write(f"{os.path.basename(argv[-1])}\t{index_size(argv[-1])}\n")
+
+
+# 比对：read名中记录的位置即比对位置，双端时两条read设置配对信息
+def bwa_mem(argv):
+    options, positional = parse(argv, {'-t', '-R', '-k', '-w', '-T'})
+    prefix, inputs = positional[0], positional[1:]
+    threads = int(options.get('-t', 1))
+    pacer = Pacer('bwa mem', threads)
+    if not index_shared(prefix):
+        # 索引不在共享内存中时每次比对都要从磁盘读入
+        Pacer('bwa shm').tick(index_size(prefix))
+    group = options.get('-R', '').replace('\\t', '\t')
+    rg = next((field[3:] for field in group.split('\t') if field.startswith('ID:')), None)
+    out = sys.stdout.buffer
+    with open(f'{prefix}.ann', encoding="utf-8") as f:
+        for line in f:
+            name, length = line.split()
+            out.write(f"@SQ\tSN:{name}\tLN:{length}\n".encode())
+    if group:
+        out.write(group.encode() + b'\n')
+    out.write(b"@PG\tID:bwa\tPN:bwa\tVN:0.7.17-r1188\n")
+    sources = [open_in(path) for path in inputs]
+    paired = len(sources) == 2
+    tag = f"\tRG:Z:{rg}".encode() if rg else b''
+    batch = 10000 * threads
+    reads = 0
+    for group_records in zip(*[fastq_records(s) for s in sources]):
+        fields = []
+        for record in group_records:
+            name, where = record[0][1:].split()[:2]
+            chrom, pos, strand = where.split(b'/')[0].split(b':')
+            fields.append((name, chrom, int(pos) + 1, strand == b'-', record[1].rstrip(), record[3].rstrip()))
+        for mate, (name, chrom, pos, reverse, seq, qual) in enumerate(fields):
+            flag = 16 if reverse else 0
+            mate_chrom, mate_pos, tlen = b'*', 0, 0
+            if paired:
+                other = fields[1 - mate]
+                flag |= 1 | 2 | (32 if other[3] else 0) | (64 if mate == 0 else 128)
+                mate_chrom, mate_pos = b'=', other[2]
+                tlen = (max(pos, other[2]) + len(seq) - min(pos, other[2])) * (1 if pos <= other[2] else -1)
+            out.write(b'\t'.join([name, str(flag).encode(), chrom, str(pos).encode(), b'60',
+                                  f"{len(seq)}M".encode(), mate_chrom, str(mate_pos).encode(), str(tlen).encode(),
+                                  seq, qual]) + tag + b'\n')
+            reads += 1
+        if reads % batch < len(fields):
+            pacer.tick(batch)
+            print(f"[M::mem_process_seqs] Processed {batch} reads in {batch / rates['bwa mem']:.3f} CPU sec, "
+                  f"{time.time() - pacer.start:.3f} real sec", file=sys.stderr, flush=True)
+    rest = reads % batch
+    if rest:
+        pacer.tick(rest)
+        print(f"[M::mem_process_seqs] Processed {rest} reads in {rest / rates['bwa mem']:.3f} CPU sec",
+              file=sys.stderr, flush=True)
+    out.flush()
+
+
+# samtools的view、sort、fixmate、markdup：逐行复制记录并按各自速率计时；排序不改变输出的数据量，替身不重新排序
+def samtools_copy(sub, argv):
+    # fixmate的-m不带值，sort的-m为每线程内存
+    flags = {'-@', '-T', '-o', '-O', '--threads'} | ({'-m'} if sub == 'sort' else set())
+    options, positional = parse(argv, flags)
+    threads = int(options.get('-@', options.get('--threads', 0))) + 1
+    if sub in ('fixmate', 'markdup'):
+        source, target = positional[0], positional[1]
+    else:
+        source, target = (positional[0] if positional else '-'), options.get('-o')
+    pacer = Pacer(f'samtools {sub}', threads)
+    compressed = sub != 'view' or '-b' in options or '-bS' in argv
+    reads = 0
+    with open_in(source) as f, open_out(target, compressed) as out:
+        for line in f:
+            out.write(line)
+            if not line.startswith(b'@'):
+                reads += 1
+                if reads % 50000 == 0:
+                    pacer.tick(50000)
+    pacer.tick(reads % 50000)
+
+
+# .bai替身：记录各染色体的长度和比对上的read数，供idxstats读取
+def samtools_index(argv):
+    options, positional = parse(argv, {'-@', '-o'})
+    pacer = Pacer('samtools index', int(options.get('-@', 0)) + 1)
+    lengths, mapped = {}, collections.Counter()
+    with open_in(positional[0]) as f:
+        for line in f:
+            if line.startswith(b'@SQ'):
+                tags = dict(field.split(b':', 1) for field in line.rstrip().split(b'\t')[1:])
+                lengths[tags[b'SN'].decode()] = int(tags[b'LN'])
+            elif not line.startswith(b'@'):
+                mapped[line.split(b'\t', 3)[2].decode()] += 1
+    pacer.tick(sum(mapped.values()))
+    with open(options.get('-o', positional[0] + '.bai'), 'w', encoding="utf-8") as f:
+        json.dump({name: [length, mapped[name]] for name, length in lengths.items()}, f)
+
+
+def samtools_idxstats(argv):
+    with open(argv[-1] + '.bai', encoding="utf-8") as f:
+        stats = json.load(f)
+    for name, (length, mapped) in stats.items():
+        print(f"{name}\t{length}\t{mapped}\t0")
+    print("*\t0\t0\t0")
+
+
+# 读取BAM中的比对记录，返回(染色体, 起点(0起), 终点, 是否反向)；双端只取第一条read
+def alignments(path):
+    with open_in(path) as f:
+        for line in f:
+            if line.startswith(b'@'):
+                continue
+            fields = line.split(b'\t', 10)
+            flag = int(fields[1])
+            if flag & 128:
+                continue
+            start = int(fields[3]) - 1
+            yield fields[2].decode(), start, start + len(fields[9]), bool(flag & 16)
+
+
+def macs2_filterdup(argv):
+    options, _ = parse(argv, {'-i', '-f', '-g', '--keep-dup', '-o', '--outdir'})
+    pacer = Pacer('macs2 filterdup')
+    seen = set()
+    total = kept = 0
+    # 与macs2相同，-o stdout时输出到标准输出
+    with open_out('-' if options['-o'] == 'stdout' else options['-o'], False) as out:
+        for chrom, start, end, reverse in alignments(options['-i']):
+            total += 1
+            key = (chrom, end if reverse else start, reverse)
+            if key in seen:
+                continue
+            seen.add(key)
+            kept += 1
+            out.write(f"{chrom}\t{start}\t{end}\t.\t.\t{'-' if reverse else '+'}\n".encode())
+    pacer.tick(total)
+    print(f"INFO  @ tags after filtering in alignment file: {kept}\nINFO  @ Redundant rate of alignment file: "
+          f"{1 - kept / max(1, total):.2f}", file=sys.stderr)
+
+
+def bed_bins(path, size):
+    counts = collections.Counter()
+    with open_in(path) as f:
+        for line in f:
+            chrom, start = line.decode().split('\t', 2)[:2]
+            counts[(chrom, int(start) // size)] += 1
+    return counts
+
+
+# 峰识别：以1kb窗口计数，处理组相对于按测序深度缩放的对照富集3倍以上且至少5条read的窗口为峰
+def macs2_callpeak(argv):
+    options, _ = parse(argv, {'-t', '-c', '-f', '-g', '--keep-dup', '--outdir', '-n', '-q', '-p'})
+    outdir, name = options.get('--outdir', '.'), options.get('-n', 'NA')
+    os.makedirs(outdir, exist_ok=True)
+    size = 1000
+    treat, control = bed_bins(options['-t'], size), bed_bins(options['-c'], size)
+    pacer = Pacer('macs2 callpeak')
+    depth_t, depth_c = sum(treat.values()), sum(control.values())
+    ratio = depth_t / max(1, depth_c)
+    scale = 1e6 / max(1, depth_t) if '--SPMR' in options else 1
+    peaks = []
+    for (chrom, bin_), count in sorted(treat.items()):
+        expected = max(1.0, control[(chrom, bin_)] * ratio)
+        if count >= 5 and count / expected >= 3:
+            peaks.append((chrom, bin_ * size, bin_ * size + size, count, count / expected))
+    prefix = os.path.join(outdir, name)
+    with open(f'{prefix}_peaks.narrowPeak', 'w', encoding="utf-8") as f:
+        for n, (chrom, start, end, count, fold) in enumerate(peaks, 1):
+            f.write(f"{chrom}\t{start}\t{end}\t{name}_peak_{n}\t{int(fold * 10)}\t.\t{fold:.5f}\t{count:.5f}\t"
+                    f"{count:.5f}\t{size // 2}\n")
+    with open(f'{prefix}_peaks.xls', 'w', encoding="utf-8") as f:
+        f.write(f"# This file is generated by the benchmark shim of MACS version 2.2.9.1\n# d = 200\n"
+                f"# total tags in treatment: {depth_t}\n# total tags in control: {depth_c}\n"
+                "chr\tstart\tend\tlength\tabs_summit\tpileup\t-log10(pvalue)\tfold_enrichment\t-log10(qvalue)\tname\n")
+        for n, (chrom, start, end, count, fold) in enumerate(peaks, 1):
+            f.write(f"{chrom}\t{start + 1}\t{end}\t{size}\t{start + size // 2}\t{count}\t{fold:.5f}\t{fold:.5f}\t"
+                    f"{fold:.5f}\t{name}_peak_{n}\n")
+    with open(f'{prefix}_summits.bed', 'w', encoding="utf-8") as f:
+        for n, (chrom, start, end, count, fold) in enumerate(peaks, 1):
+            f.write(f"{chrom}\t{start + size // 2}\t{start + size // 2 + 1}\t{name}_peak_{n}\t{fold:.5f}\n")
+    if '-B' in options or '--bdg' in options:
+        bins = sorted(set(treat) | set(control))
+        with open(f'{prefix}_treat_pileup.bdg', 'w', encoding="utf-8") as f:
+            for chrom, bin_ in bins:
+                f.write(f"{chrom}\t{bin_ * size}\t{bin_ * size + size}\t{treat[(chrom, bin_)] * scale:.5f}\n")
+        with open(f'{prefix}_control_lambda.bdg', 'w', encoding="utf-8") as f:
+            for chrom, bin_ in bins:
+                f.write(f"{chrom}\t{bin_ * size}\t{bin_ * size + size}\t"
+                        f"{max(1.0, control[(chrom, bin_)] * ratio) * scale:.5f}\n")
+    pacer.tick(depth_t + depth_c)
+    print(f"INFO  @ #3 Call peaks...\nINFO  @ Done! {len(peaks)} peaks", file=sys.stderr)
+
+
+def macs2_bdgcmp(argv):
+    options, _ = parse(argv, {'-t', '-c', '-m', '-o', '-p'})
+    pacer = Pacer('macs2 bdgcmp')
+    lines = 0
+    with open(options['-t'], encoding="utf-8") as t, open(options['-c'], encoding="utf-8") as c, \
+            open(options['-o'], 'w', encoding="utf-8") as out:
+        for treat, control in zip(t, c):
+            chrom, start, end, value = treat.split()
+            fold = (float(value) + 1) / (float(control.split()[3]) + 1)
+            out.write(f"{chrom}\t{start}\t{end}\t{fold:.5f}\n")
+            lines += 1
+    pacer.tick(lines)
+
+
+def bam_coverage(argv):
+    options, _ = parse(argv, {'-b', '-o', '-p', '-r', '-bs', '-of', '-bl', '--scaleFactor', '--normalizeUsing',
+                              '--effectiveGenomeSize', '--binSize', '--outFileFormat', '--region'})
+    size = int(options.get('-bs', options.get('--binSize', 50)))
+    region = options.get('-r', options.get('--region'))
+    scale = float(options.get('--scaleFactor', 1))
+    pacer = Pacer('bamCoverage', int(options.get('-p', 1)))
+    counts = collections.Counter()
+    reads = 0
+    for chrom, start, end, _ in alignments(options['-b']):
+        reads += 1
+        if region is None or chrom == region:
+            for bin_ in range(start // size, (end - 1) // size + 1):
+                counts[(chrom, bin_)] += 1
+    if options.get('--normalizeUsing') in ('CPM', 'BPM', 'RPKM'):
+        scale = 1e6 / max(1, reads)
+    bedgraph = options.get('-of', options.get('--outFileFormat', 'bigwig')) == 'bedgraph'
+    with open_out(options['-o'], not bedgraph) as out:
+        for (chrom, bin_), count in sorted(counts.items()):
+            out.write(f"{chrom}\t{bin_ * size}\t{bin_ * size + size}\t{count * scale:.5g}\n".encode())
+    pacer.tick(reads)
+
+
+def bedgraph_to_bigwig(argv):
+    if len(argv) < 3:
+        print("bedGraphToBigWig v 4 - Convert a bedGraph file to bigWig format.", file=sys.stderr)
+        sys.exit(255)
+    for path in argv[:2]:
+        if not os.path.exists(path):
+            print(f"Couldn't open {path}", file=sys.stderr)
+            sys.exit(255)
+    pacer = Pacer('bedGraphToBigWig')
+    lines = 0
+    with open(argv[0], 'rb') as f, open_out(argv[2], True) as out:
+        for line in f:
+            out.write(line)
+            lines += 1
+    pacer.tick(lines)
+
+
+# bedtools subtract：去除与-b中区间重叠的行
+def bedtools(argv):
+    options, _ = parse(argv[1:], {'-a', '-b'})
+    regions = collections.defaultdict(list)
+    with open(options['-b'], encoding="utf-8") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) >= 3:
+                regions[fields[0]].append((int(fields[1]), int(fields[2])))
+    pacer = Pacer('bedtools')
+    lines = 0
+    with open_in(options['-a']) as f:
+        for line in f:
+            chrom, start, end = line.decode().split('\t', 3)[:3]
+            lines += 1
+            if not any(s < int(end) and int(start) < e for s, e in regions.get(chrom, ())):
+                sys.stdout.buffer.write(line)
+    pacer.tick(lines)
+
+
+def main():
+    tool = os.path.basename(sys.argv[0])
+    argv = sys.argv[1:]
+    if tool == 'bwa' and not argv:
+        print("\nProgram: bwa (alignment via Burrows-Wheeler transformation)\nVersion: 0.7.17-r1188\n",
+              file=sys.stderr)
+        sys.exit(1)
+    if argv[:1] in (['--version'], ['-v'], ['-V']) and tool in versions:
+        print(versions[tool])
+        return
+    if tool == 'bwa':
+        {'index': bwa_index, 'shm': bwa_shm, 'mem': bwa_mem}[argv[0]](argv[1:])
+    elif tool == 'samtools':
+        if argv[0] in ('view', 'sort', 'fixmate', 'markdup'):
+            samtools_copy(argv[0], argv[1:])
+        else:
+            {'index': samtools_index, 'idxstats': samtools_idxstats}[argv[0]](argv[1:])
+    elif tool == 'macs2':
+        {'filterdup': macs2_filterdup, 'callpeak': macs2_callpeak, 'bdgcmp': macs2_bdgcmp}[argv[0]](argv[1:])
+    else:
+        {'fastq-dump': fastq_dump, 'fasterq-dump': fasterq_dump, 'vdb-dump': vdb_dump, 'fastp': fastp,
+         'fastqc': fastqc, 'bamCoverage': bam_coverage, 'bedGraphToBigWig': bedgraph_to_bigwig,
+         'bedtools': bedtools}[tool](argv)
+
+
+# 替身支持的工具名，run.py据此建立指向本文件的链接
+tools = ['fastq-dump', 'fasterq-dump', 'vdb-dump', 'fastp', 'fastqc', 'bwa', 'samtools', 'macs2', 'bamCoverage',
+         'bedGraphToBigWig', 'bedtools']
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+"""ChIP-seq分析流程：样品表检查、去接头、QC、比对、.bw文件和call peak。
+
+命令行入口为chip.py（chip_helper.cli.main）。在其他Python程序中使用时：
+
+    from chip_helper import Pipeline
+    plan = Pipeline('/data/project1', s='Sample list.csv', r='/ref/hg38', j=2).dry_run()
+    result = Pipeline('/data/project1', s='Sample list.csv', r='/ref/hg38', j=2).run()
+
+各模块在第一次使用时才导入，import chip_helper本身不加载任何子模块。
+"""
+
+# 公开的名称及其所在的模块，按需导入
+_exports = {
+    'Pipeline': 'pipeline', 'Sample': 'pipeline', 'PipelineError': 'pipeline', 'Stage': 'stages',
+    'SampleRegistry': 'registry', 'StageCache': 'cache', 'ResourcePlanner': 'resources',
+    'ReferenceManager': 'reference', 'main': 'cli',
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+    value = getattr(importlib.import_module(f'{__name__}.{_exports[name]}'), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,161 @@
+"""步骤缓存：根据参数、输入文件指纹和工具版本判断哪些步骤需要重新运行。"""
+import datetime
+import fcntl
+import hashlib
+import json
+import os
+import subprocess
+import threading
+
+
+# 用于记录各步骤缓存信息的类：键值不变且输出完整时跳过该步骤，中断的步骤不会留下记录
+# shared为True时该文件由多个进程（如--queue的各个worker）同时更新，保存时合并其他进程的记录
+class StageCache:
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.shared = shared
+        self.lock = threading.Lock()
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+        self.data.setdefault('stages', {})
+
+    def get(self, name):
+        return self.data['stages'].get(name)
+
+    def is_fresh(self, stage, key):
+        entry = self.get(stage.name)
+        if entry is None or entry['key'] != key:
+            return False
+        for f in stage.outputs:
+            current = file_fingerprint(f)
+            if current is None and f in stage.temporary:
+                continue
+            if current is None or entry['outputs'].get(f) != current:
+                return False
+        return True
+
+    def record(self, stage, key):
+        with self.lock:
+            self.data['stages'][stage.name] = {
+                'key': key,
+                'outputs': {f: file_fingerprint(f) for f in stage.outputs},
+                'tools': {tool: tool_version(tool) for tool in stage.tools},
+                'time': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            self.save(stage.name)
+
+    def forget(self, name):
+        with self.lock:
+            if self.data['stages'].pop(name, None) is not None:
+                self.save(name)
+
+    def set(self, field, value):
+        with self.lock:
+            if self.data.get(field) != value:
+                self.data[field] = value
+                self.save()
+
+    # 保存缓存，name为本次改动的步骤
+    def save(self, name=None):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        if not self.shared:
+            self.write(self.data)
+            return
+        # 在锁文件上加排他锁，重新读取文件后只改动本进程更新的记录，不覆盖其他进程的记录
+        with open(self.path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    current = json.load(f)
+            except (OSError, ValueError):
+                current = {}
+            current.setdefault('stages', {})
+            if name is not None:
+                if name in self.data['stages']:
+                    current['stages'][name] = self.data['stages'][name]
+                else:
+                    current['stages'].pop(name, None)
+            current.update({field: value for field, value in self.data.items() if field != 'stages'})
+            self.data = current
+            self.write(current)
+
+    def write(self, data):
+        with open(self.path + '.tmp', 'w', encoding="utf-8") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(self.path + '.tmp', self.path)
+
+
+# 计算文件指纹：文件大小加首尾各1 MiB内容的哈希，不读取整个文件，文件不存在时返回None
+def file_fingerprint(path, block=1 << 20):
+    try:
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            head = f.read(block)
+            tail = b''
+            if size > block:
+                f.seek(max(block, size - block))
+                tail = f.read(block)
+    except OSError:
+        return None
+    h = hashlib.sha256()
+    h.update(str(size).encode())
+    h.update(head)
+    h.update(tail)
+    return h.hexdigest()
+
+
+# 各工具查询版本的命令，bwa没有--version参数，版本号在用法说明中
+version_cmds = {'bwa': 'bwa', 'fastq-dump': 'fastq-dump --version', 'samtools': 'samtools --version',
+                'bedGraphToBigWig': 'bedGraphToBigWig'}
+tool_versions = {}
+tool_version_lock = threading.Lock()
+
+
+# 查询工具版本，同一进程中每个工具在同一PATH下只查询一次
+def tool_version(tool):
+    key = (tool, os.environ.get('PATH', ''))
+    with tool_version_lock:
+        if key not in tool_versions:
+            cmd = version_cmds.get(tool, f'{tool} --version')
+            try:
+                out = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                     timeout=60).stdout
+            except (OSError, subprocess.SubprocessError):
+                out = ''
+            lines = [line.strip() for line in out.splitlines() if any(c.isdigit() for c in line)]
+            version = next((line for line in lines if line.lower().startswith('version')),
+                           lines[0] if lines else 'unknown')
+            tool_versions[key] = version
+        return tool_versions[key]
+
+
+# 计算各步骤的缓存键值并确定需要运行的步骤
+# 上游步骤生成的输入以上游键值代替文件指纹，因此上游重跑得到相同结果时下游不会失效
+# probe为False时（预演）不启动任何进程，工具版本取上次运行记录的版本
+def plan_stages(stages, cache, probe=True):
+    producers = {}
+    keys = {}
+    for stage in stages:
+        tokens = [keys[producers[f]] if f in producers else file_fingerprint(f) for f in stage.inputs]
+        if probe:
+            versions = {tool: tool_version(tool) for tool in stage.tools}
+        else:
+            recorded = (cache.get(stage.name) or {}).get('tools', {})
+            versions = {tool: recorded.get(tool, 'unknown') for tool in stage.tools}
+        payload = json.dumps({'name': stage.name, 'params': stage.params, 'inputs': tokens,
+                              'sources': stage.sources, 'outputs': stage.outputs,
+                              'tools': versions}, sort_keys=True)
+        keys[stage.name] = hashlib.sha256(payload.encode()).hexdigest()
+        for f in stage.outputs:
+            producers[f] = stage.name
+    to_run = {stage.name for stage in stages if not cache.is_fresh(stage, keys[stage.name])}
+    # 需要运行的步骤若缺少已被删除的中间文件，其上游步骤也必须重新运行
+    for stage in reversed(stages):
+        if stage.name in to_run:
+            for f in stage.inputs:
+                if f in producers and not os.path.exists(f):
+                    to_run.add(producers[f])
+    return keys, to_run
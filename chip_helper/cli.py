@@ -0,0 +1,127 @@
+"""chip.py命令行入口：解析参数、检查密钥，再运行或预演分析。
+
+为了让--help和--dry-run尽快返回，模块顶层只导入argparse和tempfile，分析所需的模块在解析参数后才导入。
+"""
+import argparse
+import tempfile
+
+
+
+# 程序运行参数配置函数
+def args(parser, argv=None):
+    parser.add_argument('-r', type=str, default="../../hg38", help='参考基因组位置')
+    parser.add_argument('--ref-fasta', type=str, default=None,
+                        help='-r的bwa索引不完整时用于建立索引的参考基因组FASTA，默认为-r本身')
+    parser.add_argument('--ref-shm', type=str, default='auto', choices=['auto', 'on', 'off'],
+                        help='是否把bwa索引载入共享内存供所有样品共用：auto为有多个样品时使用')
+    parser.add_argument('-t', type=int, default=None, help='您选择的总线程数，由同时运行的样品平分，默认为可用的核数')
+    parser.add_argument('-j', type=int, default="1", help='同时分析的样品数')
+    parser.add_argument('-s', type=str, default="./Sample list.csv", help='样品表的位置')
+    parser.add_argument('-l', action='store_true', help='是否生成日志')
+    parser.add_argument('-sra', type=str, default="/root/SRA_Toolkit/sratoolkit.3.0.7-centos_linux64/bin/",
+                        help='SRA toolkit bin目录的位置')
+    parser.add_argument('--cores', type=int, default=None, help='可用的核数，默认自动检测（考虑容器的CPU配额）')
+    parser.add_argument('--mem', type=str, default=None, help='可用的内存，如64G，默认自动检测（考虑容器的内存上限）')
+    parser.add_argument('--tmpdir', type=str, default=None, help='排序临时文件的目录，默认为各样品的目录')
+    parser.add_argument('--resources', type=str, default=None,
+                        help='按步骤覆盖资源规划的JSON文件，如{"align": {"threads": 12, "sort_mem": "2G"}}')
+    parser.add_argument('--tracks', type=str, default='bamcoverage', choices=['bamcoverage', 'pileup'],
+                        help='.bw轨迹的生成方式：bamcoverage为每个样品按染色体并行扫描.bam；pileup为由call peak的'
+                             'pileup转换，不再扫描.bam')
+    parser.add_argument('--bin-size', type=int, default=50, help='bamcoverage模式下.bw的分箱大小（bp）')
+    parser.add_argument('--normalize', type=str, default='none', choices=['none', 'CPM', 'RPKM', 'BPM', 'RPGC'],
+                        help='.bw的标准化方式；pileup模式只支持CPM（macs2 --SPMR）')
+    parser.add_argument('--blacklist', type=str, default=None, help='生成.bw时去除的黑名单区域（BED）')
+    parser.add_argument('--fe-tracks', action='store_true', help='为每个组合生成富集倍数（FE）.bw文件')
+    parser.add_argument('--peak-jobs', type=int, default=2, help='同时call peak的组合数')
+    parser.add_argument('-q', type=str, default="0.01", help='call peak时的置信区间（须小于0.05）')
+    parser.add_argument('-n', type=str, default='chip-seq_program', help='本次运行的程序名')
+    parser.add_argument('--align-mode', type=str, default='stream', choices=['stream', 'legacy'],
+                        help='比对方式：stream为bwa输出直接管道排序，legacy为依次生成.sam、.bam、.sort.bam')
+    parser.add_argument('--markdup', action='store_true', help='stream模式下在排序前后加入fixmate和markdup标记重复')
+    parser.add_argument('--front-end', type=str, default='auto', choices=['auto', 'stream', 'dump'],
+                        help='原始reads的获取方式：stream为fasterq-dump多线程输出经管道直接去接头，原始reads不落地；'
+                             'dump为fastq-dump先生成.fastq文件；auto为找到fasterq-dump时使用stream')
+    parser.add_argument('--scratch', type=str, default=tempfile.gettempdir(),
+                        help='fasterq-dump临时文件的目录，应为节点本地磁盘，默认为系统临时目录')
+    parser.add_argument('--fq-codec', type=str, default='gzip', choices=['gzip', 'none'],
+                        help='中间.fastq文件的压缩格式，none为不压缩')
+    parser.add_argument('--fq-level', type=int, default=4, help='.fastq文件的压缩级别（1-9），级别越高文件越小、CPU消耗越多')
+    parser.add_argument('--intermediates', type=str, default='delete', choices=['delete', 'compress', 'keep'],
+                        help='中间文件（原始和去接头后的.fastq、legacy模式的.sam和.bam）的处理方式：delete为最后一个用到它的'
+                             '步骤成功后删除；compress为压缩保存未压缩的中间文件；keep为全部保留')
+    parser.add_argument('--disk-budget', type=str, default=None,
+                        help='同时分析的样品预计占用的磁盘空间上限，如500G；超过时等其他样品完成后再开始新的样品。'
+                             '无论是否设置，预计占用超过磁盘剩余空间时都会等待')
+    parser.add_argument('--qc', type=str, default='builtin', choices=['builtin', 'fastqc'],
+                        help='质量控制方式：builtin在去接头时同步统计，不再重新读取文件；fastqc为去接头后运行fastqc')
+    parser.add_argument('--echo-rate', type=int, default=20, help='每个样品每秒最多回显到控制台的工具输出行数，0为不回显（日志中仍完整记录）')
+    parser.add_argument('--tail', type=int, default=50, help='命令失败时报告的最后输出行数')
+    parser.add_argument('--status-interval', type=float, default=10,
+                        help='写出进度状态文件（status.json和Prometheus文本文件）的间隔秒数')
+    parser.add_argument('--metrics-dir', type=str, default=None,
+                        help='Prometheus文本文件的目录（node exporter的textfile collector目录），默认为结果目录')
+    parser.add_argument('--stall-after', type=float, default=600, help='步骤超过多少秒没有任何进展时标记为停滞')
+    parser.add_argument('--progress', action='store_true', help='在终端显示单行进度（仅当输出到终端时）')
+    parser.add_argument('--skip-invalid', action='store_true', help='样品表有错误时跳过有问题的样品和组合继续分析，默认直接停止')
+    parser.add_argument('--queue', type=str, default=None,
+                        help='共享文件系统上的任务队列目录：多个chip.py进程（可以在不同节点上）从中认领样品和call peak组合，'
+                             '最后由一个进程把结果汇总到./result/<n>/')
+    parser.add_argument('--lease', type=float, default=300,
+                        help='--queue任务的租约秒数，认领任务的进程超过这么久没有心跳时，任务由其他进程重新认领')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='只检查样品表和资源配置，列出各样品和组合将要运行和可以跳过的步骤，不运行任何命令')
+    parser.add_argument('-k', type=str, help='chip.py的密钥', required=True)
+    argument = parser.parse_args(argv)
+    return argument
+
+
+
+# 命令行主程序，返回退出码
+def main(argv=None):
+    import datetime
+    import hashlib
+    import time
+    formatted_datetime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # 获得当前时间戳
+    # 加载程序参数
+    parser = argparse.ArgumentParser(description="This is a chip-seq analysis helper. The program's key is 'puman', "
+                                                 "and please enter the key to ensure the program running normally."
+                                                 "This program can be used for free, but commercial charging is "
+                                                 "prohibited")
+    arguments = args(parser, argv)
+    from .pipeline import Pipeline, PipelineError
+    pipeline = Pipeline(argument=arguments)
+    # 创建日志文件，预演时不写入
+    main_log = pipeline.open_log(dry=arguments.dry_run)
+    try:
+        main_log.write(formatted_datetime + '')
+        main_log.write('Program is beginning')
+        print("--------------------------------------------------\n")
+        print("\033[1m" + "Welcome use the program designed by zhuerding\n" + "\033[0m")
+        print("--------------------------------------------------\n")
+        # 检测密码
+        # psw = input("Please input your access key")
+        hashed_psw = hashlib.sha256(arguments.k.encode()).hexdigest()  # 对密钥进行哈希加密
+        if hashed_psw == "b5f0a3bc3ee3ca246a764cbf3274a3c3a1a5fa64a35354a7bb90dfd564e2f0f3":
+            print("Access\n")
+            main_log.write("Identity authentication passed\n")
+        else:
+            main_log.write("Identity authentication passed\n")
+            print('Identity authentication failed. Program will be stopped in 5 seconds.')
+            main_log.write("Identity authentication failed.\n")
+            formatted_stop_datetime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            main_log.write("\n--------------------------------------------------\n")
+            main_log.write(f"Program stopped in {formatted_stop_datetime}\n")
+            main_log.write("unsuccessfully.Reason for closure is identity authentication failed\n")
+            time.sleep(5)
+            return 0
+        try:
+            if arguments.dry_run:
+                pipeline.dry_run()
+            else:
+                pipeline.run()
+        except PipelineError:
+            return 1
+        return 0
+    finally:
+        pipeline.close_log()
@@ -0,0 +1,112 @@
+"""控制台输出和日志。"""
+import sys
+import threading
+import time
+
+
+
+# 控制台输出锁，多个线程同时输出时保证每行完整
+console_lock = threading.Lock()
+
+
+# 终端单行进度的当前内容，输出其他内容时先清除该行，输出后重新显示
+console_status = ''
+
+
+# 向控制台输出一行
+def echo(msg):
+    with console_lock:
+        if console_status:
+            sys.stdout.write('\r\033[K' + msg + '\n' + console_status)
+        else:
+            sys.stdout.write(msg + '\n')
+        sys.stdout.flush()
+
+
+# 改写终端的单行进度
+def status_line(text):
+    global console_status
+    with console_lock:
+        sys.stdout.write('\r\033[K' + text)
+        sys.stdout.flush()
+        console_status = text
+
+
+# 用于写入日志的类：日志文件只打开一次并带缓冲写入；工具输出回显到控制台时按每秒行数限速
+# 并发运行时每个样品写入各自的日志文件，避免输出互相穿插
+class LogWriter:
+    def __init__(self, argument, sample, path=None, prefix=None, mode='a'):
+        self.argument = argument
+        self.sample = sample
+        self.lock = threading.Lock()
+        self.path = path or f"./{sample}/{argument.n}.log"
+        self.prefix = argument.j > 1 if prefix is None else prefix
+        self.file = open(self.path, mode, encoding="utf-8", buffering=1 << 16) if argument.l is True else None
+        self.progress = None  # 该日志对应的正在运行的步骤的进度，由该步骤的命令更新
+        self.group = None  # 该日志的命令所属的JobGroup，结束该组时只终止这些命令
+        self.tokens = float(argument.echo_rate)
+        self.last_refill = time.time()
+        self.suppressed = 0
+
+    def echo(self, msg):
+        # 并发运行时为每行输出加上样品名前缀
+        if self.prefix:
+            echo(f"[{self.sample}] {msg}")
+        else:
+            echo(msg)
+
+    def write(self, msg):
+        if self.file is not None:
+            with self.lock:
+                self.file.write(msg)
+
+    # 写入一行工具输出：全部写入日志，控制台回显超出限速的行只计数
+    def tool_line(self, text):
+        self.write(text + '\n')
+        rate = self.argument.echo_rate
+        if rate <= 0:
+            self.suppressed += 1
+            return
+        now = time.time()
+        self.tokens = min(float(rate), self.tokens + (now - self.last_refill) * rate)
+        self.last_refill = now
+        if self.tokens < 1:
+            self.suppressed += 1
+            return
+        self.tokens -= 1
+        if self.suppressed:
+            self.echo(f"... {self.suppressed} lines of tool output are not shown, see the log for details.")
+            self.suppressed = 0
+        self.echo(text)
+
+    def flush(self):
+        if self.suppressed and self.argument.echo_rate > 0:
+            self.echo(f"... {self.suppressed} lines of tool output are not shown, see the log for details.")
+        self.suppressed = 0
+        if self.file is not None:
+            with self.lock:
+                self.file.flush()
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            with self.lock:
+                self.file.close()
+                self.file = None
+
+
+# 以易读的方式表示数量、字节数和时间，用于单行进度显示
+def human(value, unit=''):
+    for suffix in ('', 'k', 'M', 'G', 'T'):
+        if abs(value) < 1000 or suffix == 'T':
+            return f"{value:.0f}{suffix}{unit}" if suffix == '' else f"{value:.1f}{suffix}{unit}"
+        value /= 1000
+
+
+def human_time(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
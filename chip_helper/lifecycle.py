@@ -0,0 +1,202 @@
+"""中间文件的生命周期和磁盘空间预算。
+
+每个样品的中间文件（步骤的temporary输出）在用到它的最后一个步骤成功后删除或压缩；按输入大小估算样品分析时
+占用磁盘的峰值，只在预计占用放得下--disk-budget和磁盘剩余空间时才开始分析新的样品。
+"""
+import os
+import statistics
+import threading
+
+from .console import human
+from .runner import run_cmd
+from .stages import compress_cmd
+from .utils import files_size
+
+# 各类文件相对于压缩的原始reads的估计大小，按后缀依次匹配；排序时的临时文件另按.sort.bam的大小计
+size_ratios = (
+    ('.bai', 0.0), ('.bam', 0.8), ('.sam', 4.0), ('.fastq.gz', 1.0), ('.fq.gz', 1.0), ('.fastq', 4.0),
+    ('.fq', 4.0), ('.bw', 0.05),
+)
+compress_ratio = 0.25  # 压缩后的大小
+
+
+def plain(f):
+    return f.endswith(('.sam', '.fastq', '.fq'))
+
+
+# 原始reads的压缩大小，未压缩的.fastq按压缩后的大小计
+def reads_size(files):
+    return sum(files_size([f]) * (compress_ratio if plain(f) else 1) for f in files)
+
+
+# 中间文件不再需要时的处理方式：keep全部保留；compress压缩未压缩的文件，已压缩的保留；delete删除
+def release_action(f, mode):
+    if mode == 'delete':
+        return 'remove'
+    if mode == 'compress' and plain(f):
+        return 'compress'
+    return 'keep'
+
+
+def estimate_size(f, input_bytes):
+    ratio = next((ratio for suffix, ratio in size_ratios if f.endswith(suffix)), 0.0)
+    return int(ratio * input_bytes)
+
+
+# 按步骤顺序模拟中间文件的产生和删除，估算一个样品占用磁盘的峰值
+def estimate_footprint(stages, input_bytes, mode):
+    lifecycle = Lifecycle(mode)
+    lifecycle.plan(stages)
+    sizes = {}
+    peak = 0
+    for stage in stages:
+        for f in stage.outputs:
+            sizes[f] = estimate_size(f, input_bytes)
+        sort_tmp = sum(sizes[f] for f in stage.outputs if f.endswith('.sort.bam'))
+        peak = max(peak, sum(sizes.values()) + sort_tmp)
+        lifecycle.done.add(stage.name)
+        for f in lifecycle.releasable():
+            lifecycle.released.add(f)
+            action = release_action(f, mode)
+            if action == 'compress':
+                sizes[f] = int(sizes[f] * compress_ratio)
+            elif action == 'remove':
+                sizes.pop(f, None)
+    return peak
+
+
+# 一个样品的中间文件：记录每个中间文件由哪些步骤使用，最后一个步骤完成后删除，compress时压缩保存，keep时保留
+# compress时按--fq-level用样品的threads个线程压缩（有pigz时）
+class Lifecycle:
+    def __init__(self, mode, argument=None, threads=1):
+        self.mode = mode
+        self.argument = argument
+        self.threads = threads
+        self.stages = []
+        self.consumers = {}
+        self.outputs = []
+        self.done = set()
+        self.released = set()
+        self.ran = False  # 是否有步骤实际运行，只有实际运行的样品才用于校准估算
+        self.peak = 0
+        self.freed = 0
+
+    # 登记样品的全部步骤；单双端要等.fastq转换出来才能确定时，确定后重新登记
+    def plan(self, stages):
+        self.stages = stages
+        self.consumers = {}
+        for stage in stages:
+            for f in stage.temporary:
+                # 没有其他步骤读取的中间文件（如legacy模式的.sam）由生成它的步骤自己用完
+                self.consumers[f] = {other.name for other in stages if f in other.inputs} or {stage.name}
+        self.outputs = [f for stage in stages for f in stage.outputs]
+
+    # 用到的步骤都已完成、可以删除或压缩的中间文件
+    def releasable(self):
+        return [f for f, consumers in self.consumers.items() if consumers <= self.done and f not in self.released]
+
+    # 压缩保存的位置：样品目录下的intermediates/，不会被当作原始reads或去接头后的.fastq
+    @staticmethod
+    def archive(f):
+        return os.path.join(os.path.dirname(f), 'intermediates', os.path.basename(f) + '.gz')
+
+    # 当前占用的磁盘空间
+    def current(self):
+        return files_size(self.outputs + [self.archive(f) for f in self.consumers])
+
+    # 一个步骤完成（运行成功或未变化而跳过）后处理不再需要的中间文件，返回(文件, 释放的字节数, 处理方式)
+    def finish(self, stage, slog, ran=True):
+        self.done.add(stage.name)
+        self.ran = self.ran or ran
+        self.peak = max(self.peak, self.current())
+        handled = []
+        for f in self.releasable():
+            self.released.add(f)
+            action = release_action(f, self.mode)
+            if action == 'keep' or not os.path.exists(f):
+                continue
+            size = files_size([f])
+            if action == 'compress':
+                archive = self.archive(f)
+                os.makedirs(os.path.dirname(archive), exist_ok=True)
+                job = run_cmd(f"{compress_cmd([], self.argument, self.threads)} -c < {f} > {archive}", slog)
+                if job.returncode != 0:
+                    slog.write(f"! Compressing {f} failed, it is kept. !\n")
+                    continue
+                os.remove(f)
+                size -= files_size([archive])
+                handled.append((f, size, f'compressed to {archive}'))
+            else:
+                os.remove(f)
+                handled.append((f, size, 'removed'))
+            self.freed += size
+            slog.write(f"{f} is {handled[-1][2]}, {human(size, 'B')} is freed.\n")
+        return handled
+
+
+# 磁盘空间预算：按估算的峰值占用决定是否开始分析下一个样品，样品完成后按实际峰值校准估算
+class DiskBudget:
+    wait_interval = 30  # 等待空间时重新检查磁盘剩余空间的间隔秒数
+
+    def __init__(self, budget, mode, path='.'):
+        self.budget = budget  # 同时分析的样品预计占用的上限（字节），None为只按磁盘剩余空间限制
+        self.mode = mode
+        self.path = path
+        self.cond = threading.Condition()
+        self.running = {}  # 样品名: (预计峰值, 模型估算, Lifecycle)
+        self.waiting = 0  # 正在等待磁盘空间的样品数
+        self.inputs = []  # 已知的各样品原始reads大小，用于估算大小未知（直接下载）的样品
+        self.scale = 1.0  # 实际峰值与估算的比例，由已完成的样品校准
+
+    def free(self):
+        try:
+            stat = os.statvfs(self.path)
+        except OSError:
+            return None
+        return stat.f_bavail * stat.f_frsize
+
+    # 按模型估算一个样品的峰值占用；原始reads大小未知时按其他样品的中位数估算
+    def estimate(self, stages, input_bytes):
+        with self.cond:
+            if input_bytes:
+                self.inputs.append(input_bytes)
+            elif self.inputs:
+                input_bytes = statistics.median(self.inputs)
+            return estimate_footprint(stages, input_bytes, self.mode)
+
+    def fits(self, need):
+        if self.budget is not None and sum(n for n, _, _ in self.running.values()) + need > self.budget:
+            return False
+        free = self.free()
+        # 正在分析的样品还会继续占用的空间要从剩余空间中预留
+        growth = sum(max(0, n - lifecycle.current()) for n, _, lifecycle in self.running.values())
+        return free is None or need + growth <= free
+
+    # 等到预计占用（模型估算经已完成的样品校准）放得下时登记该样品，返回预计占用；
+    # 没有其他样品在分析时直接开始，避免估算偏大时永远无法开始
+    def acquire(self, sample, model, lifecycle, slog):
+        with self.cond:
+            need = int(model * self.scale)
+            size = human(need, 'B')
+            if self.running and not self.fits(need):
+                slog.echo(f"{sample} needs about {size} of disk, waiting for running samples to free space.")
+                slog.write(f"{sample} needs about {size} of disk, waiting for disk space.\n")
+                self.waiting += 1
+                try:
+                    while self.running and not self.fits(need):
+                        self.cond.wait(self.wait_interval)
+                finally:
+                    self.waiting -= 1
+            if not self.running and not self.fits(need):
+                slog.echo(f"! {sample} needs about {size} of disk, more than the disk budget or free space. !")
+                slog.write(f"! {sample} needs about {size} of disk, more than the disk budget or free space. !\n")
+            self.running[sample] = (need, model, lifecycle)
+            return need
+
+    def release(self, sample):
+        with self.cond:
+            _, model, lifecycle = self.running.pop(sample, (0, 0, None))
+            if lifecycle is not None and lifecycle.ran and model and lifecycle.peak:
+                # 按最近完成的样品的实际峰值校准之后的估算（实际峰值在步骤之间测量，不含排序临时文件）
+                self.scale = max(lifecycle.peak / model, 0.5)
+            self.cond.notify_all()
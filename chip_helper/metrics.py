@@ -0,0 +1,58 @@
+"""每条命令和每个步骤的资源消耗记录。"""
+import csv
+import json
+import os
+import threading
+import time
+
+
+# 用于记录每条命令和每个步骤资源消耗的类，运行结束后写出JSON和CSV报告
+class RunMetrics:
+    fields = ['kind', 'sample', 'stage', 'command', 'status', 'wall_sec', 'user_sec', 'sys_sec', 'cpu_util',
+              'max_rss_mb', 'input_bytes', 'output_bytes', 'uncompressed_bytes', 'bytes_saved', 'bytes_freed',
+              'estimated_bytes', 'threads', 'start', 'end']
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = []
+
+    def add(self, **record):
+        wall = record.get('wall_sec') or 0
+        if wall and 'user_sec' in record:
+            record['cpu_util'] = round((record['user_sec'] + record['sys_sec']) / wall, 3)
+        with self.lock:
+            self.records.append({field: record.get(field, '') for field in self.fields})
+
+    def add_command(self, sample, stage, job):
+        self.add(kind='command', sample=sample, stage=stage.name, command=job.cmd,
+                 status=job.returncode, wall_sec=round(job.wall, 3), user_sec=round(job.usage.ru_utime, 3),
+                 sys_sec=round(job.usage.ru_stime, 3), max_rss_mb=round(job.usage.ru_maxrss / 1024, 1),
+                 threads=stage.threads, start=round(job.start_time, 3), end=round(job.start_time + job.wall, 3))
+
+    # 压缩中间文件节省的总字节数
+    def bytes_saved(self):
+        with self.lock:
+            return sum(record['bytes_saved'] for record in self.records if record['bytes_saved'] != '')
+
+    # 删除或压缩中间文件释放的总字节数
+    def bytes_freed(self):
+        with self.lock:
+            return sum(record['bytes_freed'] for record in self.records if record['bytes_freed'] != '')
+
+    def write(self, directory, argument, start_time, resources=None):
+        os.makedirs(directory, exist_ok=True)
+        bytes_saved = self.bytes_saved()
+        bytes_freed = self.bytes_freed()
+        with self.lock:
+            records = list(self.records)
+        report = {'name': argument.n, 'start': round(start_time, 3), 'end': round(time.time(), 3),
+                  'threads': argument.t, 'jobs': argument.j, 'fq_codec': argument.fq_codec,
+                  'fq_level': argument.fq_level, 'bytes_saved': bytes_saved, 'bytes_freed': bytes_freed,
+                  'intermediates': argument.intermediates, 'resources': resources,
+                  'records': records}
+        with open(os.path.join(directory, 'run_metrics.json'), 'w', encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+        with open(os.path.join(directory, 'run_metrics.csv'), 'w', encoding="utf-8", newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=self.fields)
+            writer.writeheader()
+            writer.writerows(records)
@@ -0,0 +1,140 @@
+"""call peak：filterdup去重后的样品供各组合共用，各组合在有限的并发数下同时call peak。"""
+import concurrent.futures
+import os
+import shutil
+import threading
+import time
+
+from .console import LogWriter, echo
+from .stages import Stage, pileup_tracks
+
+
+# call peak引擎：每个样品（尤其是被多个处理组共用的input对照）只用macs2 filterdup解析、去重一次，
+# 得到的BED供所有用到它的组合使用，callpeak不再每次重新读取.bam；各组合在有限的并发数下同时运行
+class PeakEngine:
+    def __init__(self, pipeline, peak_cache):
+        self.pipeline = pipeline
+        self.argument = pipeline.argument
+        self.peak_cache = peak_cache
+        self.directory = f'./result/{self.argument.n}/'
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.argument.peak_jobs))
+        self.lock = threading.Lock()
+        self.sample_locks = {}
+        self.prepared = {}  # 样品名: filterdup是否成功
+
+    def submit(self, contrast):
+        return self.pool.submit(self.call_peak, contrast)
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+    # filterdup的BED每条read一行，深度测序的文库可达数GB，压缩保存，macs2 callpeak可以直接读取
+    def filterdup_path(self, sample):
+        return f'{self.directory}filterdup/{sample}.bed.gz'
+
+    def filterdup_stage(self, sample):
+        bed = self.filterdup_path(sample)
+        compress = 'pigz -p 2 -1 -c' if shutil.which('pigz') else 'gzip -1 -c'
+        # 与callpeak默认的--keep-dup 1相同：同一位置同一方向只保留一条read
+        return Stage(f'filterdup:{sample}', "Filtering duplicates……", f"Begin to filter duplicates of {sample}.",
+                     [f'macs2 filterdup -i ./{sample}/{sample}.sort.bam -f BAM -g hs --keep-dup 1 -o stdout '
+                      f'| {compress} > {bed}'],
+                     f"Duplicates of {sample} are filtered. {bed} is created.",
+                     inputs=[f'./{sample}/{sample}.sort.bam'], outputs=[bed],
+                     params={'g': 'hs', 'keep_dup': 1}, tools=['macs2'],
+                     cleanup=[f'{self.directory}filterdup/{sample}.bed'])  # 之前版本未压缩的BED
+
+    # 对一个样品运行filterdup，多个组合同时需要时只有第一个运行，其余等待其结果；被结束（group）时不记录结果
+    def filterdup(self, sample, group=None):
+        with self.lock:
+            sample_lock = self.sample_locks.setdefault(sample, threading.Lock())
+        with sample_lock:
+            if sample in self.prepared:
+                return self.prepared[sample]
+            os.makedirs(os.path.dirname(self.filterdup_path(sample)), exist_ok=True)
+            slog = LogWriter(self.argument, sample, f'{self.directory}filterdup/{sample}.log', prefix=True)
+            slog.group = group
+            try:
+                success = self.pipeline.execute_stages([self.filterdup_stage(sample)], self.peak_cache, slog)
+            finally:
+                slog.close()
+            if group is None or not group.cancelled.is_set():
+                self.prepared[sample] = success
+            return success
+
+    def callpeak_stage(self, contrast, outdir, name):
+        test, ctrl, label = contrast['test'], contrast['ctrl'], contrast['label']
+        # 输入已经去重，callpeak保留全部read；pileup轨迹按CPM标准化时让macs2输出每百万read的信号
+        spmr = self.argument.tracks == 'pileup' and self.argument.normalize == 'CPM'
+        cmd = f'macs2 callpeak -t {self.filterdup_path(test)} -c {self.filterdup_path(ctrl)} -f BED ' \
+              f'--keep-dup all -g hs --outdir {outdir} -n {name} -B -q {self.argument.q}' + (' --SPMR' if spmr else '')
+        params = {'q': self.argument.q, 'g': 'hs', 'format': 'BED'}
+        if spmr:
+            params['spmr'] = True
+        return Stage(f'callpeak:{label}', "Calling peak……", f"Calling peak of {label}.",
+                     [cmd], f"{name}_{contrast['rep']} process is complete! Relative files are in {outdir}.",
+                     inputs=[self.filterdup_path(test), self.filterdup_path(ctrl)],
+                     outputs=[f'{outdir}{name}{suffix}' for suffix in
+                              ('_peaks.narrowPeak', '_peaks.xls', '_summits.bed', '_treat_pileup.bdg',
+                               '_control_lambda.bdg')],
+                     params=params, tools=['macs2'])
+
+    # 由callpeak -B输出的pileup生成.bw文件：pileup模式下转换处理组pileup和对照lambda，--fe-tracks时加上富集倍数
+    def track_stages(self, contrast, outdir, name):
+        prefix = f'{outdir}{name}'
+        bdgs = []
+        if self.argument.tracks == 'pileup':
+            bdgs += [(f'{prefix}_treat_pileup.bdg', f'{prefix}_treat_pileup.bw'),
+                     (f'{prefix}_control_lambda.bdg', f'{prefix}_control_lambda.bw')]
+        fe = None
+        if self.argument.fe_tracks:
+            fe = (f'{prefix}_treat_pileup.bdg', f'{prefix}_control_lambda.bdg', f'{prefix}_FE.bdg')
+            bdgs.append((f'{prefix}_FE.bdg', f'{prefix}_FE.bw'))
+        if not bdgs:
+            return []
+        test = contrast['test']
+        return [Stage(f'tracks:{contrast["label"]}', "Creating tracks……", f"Begin to create .bw files of {name}.",
+                      [pileup_tracks(f'./{test}/{test}.sort.bam', bdgs, fe, self.argument)],
+                      f".bw files of {name} are created.",
+                      inputs=[f'{prefix}_treat_pileup.bdg', f'{prefix}_control_lambda.bdg'] +
+                             ([self.argument.blacklist] if self.argument.blacklist else []),
+                      outputs=[bw for _, bw in bdgs] + ([fe[2]] if fe else []),
+                      params={'tracks': self.argument.tracks, 'fe': self.argument.fe_tracks},
+                      tools=['macs2', 'bedGraphToBigWig'], threads=len(bdgs))]
+
+    # 一个组合的输出目录和文件名前缀
+    def output_of(self, contrast):
+        name = f"{contrast['treatment']}_vs_input"
+        return f"{self.directory}{name}/{contrast['label']}/", name
+
+    # 一个组合在filterdup之后的步骤：call peak，以及由pileup生成的.bw文件
+    def contrast_stages(self, contrast):
+        outdir, name = self.output_of(contrast)
+        return [self.callpeak_stage(contrast, outdir, name)] + self.track_stages(contrast, outdir, name)
+
+    # 对一组实验组/对照组进行call peak，返回是否成功以及开始、结束时间；filtered为True时两个样品已经filterdup，
+    # group为该组合命令所属的JobGroup
+    def call_peak(self, contrast, filtered=False, group=None):
+        start_time = time.time()
+        test, ctrl, label = contrast['test'], contrast['ctrl'], contrast['label']
+        outdir, name = self.output_of(contrast)
+        os.makedirs(outdir, exist_ok=True)
+        log_path = f'{outdir}callpeak.log'
+        peak_log = LogWriter(self.argument, label, log_path, prefix=True)
+        peak_log.group = group
+        try:
+            peak_log.echo(f"Begin to analyse {label} group. Test group name is {test}. Ctrl group name is {ctrl}.")
+            self.pipeline.log.write(f'\nBegin to analyse {label} group.\n')
+            self.pipeline.log.write(f"Test group name is {test}. Ctrl group name is {ctrl}.\n")
+            success = filtered or (self.filterdup(ctrl) and self.filterdup(test))
+            if success:
+                stages = self.contrast_stages(contrast)
+                success = self.pipeline.execute_stages(stages, self.peak_cache, peak_log)
+        finally:
+            peak_log.close()
+        if success:
+            self.pipeline.log.write(f"{label} group is completed. Relative files are in {outdir}.\n")
+        else:
+            echo(f"! {label} group is failed. See {log_path} and {self.directory}filterdup/ for details. !")
+            self.pipeline.log.write(f"! {label} group is failed. !\n")
+        return success, start_time, time.time()
@@ -0,0 +1,769 @@
+"""一个ChIP-seq项目的一次分析（Pipeline）及其中的单个样品（Sample）。
+
+同一个Python进程可以依次运行或预演多个项目，每个Pipeline有自己的日志、资源规划、参考基因组和资源报告。
+样品表、参考基因组等相对路径均相对于项目目录。
+"""
+import argparse
+import collections
+import concurrent.futures
+import contextlib
+import copy
+import glob
+import importlib.util
+import json
+import os
+import shutil
+import signal
+import threading
+import time
+
+from .cache import StageCache, plan_stages
+from .console import LogWriter, echo, human
+from .lifecycle import DiskBudget, Lifecycle, reads_size
+from .metrics import RunMetrics
+from .peaks import PeakEngine
+from .reference import ReferenceManager
+from .registry import SampleRegistry, get_fastq_files, get_srr_dirs
+from .resources import ResourcePlanner
+from .runner import run_cmd, stopped, terminate_jobs
+from .stages import Stage, detect_layout, dump_stage, fastq_names, sample_stages, sra_layout
+from .telemetry import Telemetry
+from .utils import files_size, overlap_time, parse_size
+from .workqueue import WorkQueue, plan_tasks, worker_name
+
+__all__ = ['Pipeline', 'PipelineError', 'Sample', 'Stage']
+
+
+# 无法继续分析时（样品表有错误、索引无法建立、资源配置无效）抛出的异常，信息已输出并写入日志
+class PipelineError(Exception):
+    pass
+
+
+# 在项目目录中运行，结束后回到原来的目录
+@contextlib.contextmanager
+def workdir(directory):
+    previous = os.getcwd()
+    os.chdir(directory)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+# 命令行参数的默认值，Pipeline的关键字参数按参数名（如ref_fasta、peak_jobs）覆盖
+def default_options():
+    from .cli import args
+    return args(argparse.ArgumentParser(), ['-k', ''])
+
+
+# 单个样品：转换.fastq、去接头、QC、比对、排序建索引、生成.bw文件，已完成且未变化的步骤跳过
+class Sample:
+    def __init__(self, pipeline, name):
+        self.pipeline = pipeline
+        self.name = name
+        info = pipeline.registry.samples[name]
+        self.treatment = info['treatment']
+        self.rep = info['rep']
+        self.group = info['group']
+        self.path = f'./{name}/'
+
+    def __repr__(self):
+        return f'Sample({self.name!r}, group={self.group!r})'
+
+    # 判断单双端和原始reads的来源；来源为None时单双端未知，需要先转换.fastq再判断。
+    # probe为False时不读取SRA元数据（不运行vdb-dump），目录下没有.fastq文件也没有缓存记录时单双端未知
+    def source(self, cache, probe=True):
+        argument = self.pipeline.argument
+        layout = detect_layout(self.name, cache)
+        raw, _ = fastq_names(self.name, layout or 'single', argument)
+        user_fastq = layout is not None and all(os.path.exists(f) for f in raw) and cache.get('dump') is None
+        from_metadata = False
+        if layout is None and probe:
+            # 目录下没有.fastq文件也没有缓存记录：由SRA元数据判断单双端
+            layout = sra_layout(self.name)
+            from_metadata = layout is not None
+        if not user_fastq and layout is not None and argument.front_end == 'stream':
+            return layout, 'stream', from_metadata
+        if layout is None:
+            return None, None, False
+        raw, _ = fastq_names(self.name, layout, argument)
+        with_dump = cache.get('dump') is not None or not all(os.path.exists(f) for f in raw)
+        return layout, 'dump' if with_dump else 'fastq', from_metadata
+
+    # 原始reads（.sra或用户提供的.fastq）的大小，用于估算磁盘占用
+    def input_bytes(self, stages):
+        produced = {f for stage in stages for f in stage.outputs}
+        return reads_size(sorted({f for stage in stages for f in stage.inputs
+                                  if f.startswith(self.path) and f not in produced}))
+
+    # 估算该样品分析时占用磁盘的峰值，全部步骤都可以跳过时为0；单双端未知时按双端估算
+    def footprint(self, cache, layout, source, probe=True):
+        stages = sample_stages(self.pipeline, self.name, layout or 'paired', source or 'dump')
+        _, to_run = plan_stages(stages, cache, probe=probe)
+        if not to_run:
+            return 0
+        return self.pipeline.disk.estimate(stages, self.input_bytes(stages))
+
+    # 分析该样品，返回是否成功；group为该样品命令所属的JobGroup（队列任务），被结束时不再开始之后的步骤
+    def analyse(self, threads, group=None):
+        slog = LogWriter(self.pipeline.argument, self.name)
+        slog.group = group
+        try:
+            return self.analyse_stages(threads, slog)
+        finally:
+            slog.close()
+
+    def analyse_stages(self, threads, slog):
+        pipeline, i = self.pipeline, self.name
+        slog.echo(f"{i} is being analysed with {threads} threads")
+        pipeline.log.write(f"{i} is being analysed with {threads} threads\n")
+        slog.write("--------------------------------------------------\n")
+        slog.write(f"{i} is being analysed with {threads} threads\n")
+        cache = StageCache(f'{self.path}.chip_cache.json')
+        layout, source, from_metadata = self.source(cache)
+        if from_metadata:
+            slog.write(f"{i} is {layout}-end according to the SRA metadata.\n")
+        # 预计占用放得下磁盘预算和剩余空间时才开始，中间文件在最后一个用到它的步骤完成后删除
+        lifecycle = Lifecycle(pipeline.argument.intermediates, pipeline.argument, threads)
+        need = pipeline.disk.acquire(i, self.footprint(cache, layout, source), lifecycle, slog)
+        try:
+            return self.run_stages(cache, layout, source, lifecycle, slog)
+        finally:
+            pipeline.disk.release(i)
+            pipeline.metrics.add(kind='disk', sample=i, status=pipeline.argument.intermediates,
+                                 input_bytes=self.input_bytes(lifecycle.stages), output_bytes=lifecycle.peak,
+                                 bytes_freed=lifecycle.freed, estimated_bytes=need)
+            if lifecycle.freed:
+                slog.write(f"Intermediate files of {i} freed {human(lifecycle.freed, 'B')}, "
+                           f"the peak disk footprint is {human(lifecycle.peak, 'B')}.\n")
+
+    def run_stages(self, cache, layout, source, lifecycle, slog):
+        pipeline, i = self.pipeline, self.name
+        if source is None:
+            # 元数据也无法读取：先转换.fastq再按生成的文件判断单双端
+            if not pipeline.run_stage(dump_stage(pipeline, i, []), slog):
+                return False
+            layout = detect_layout(i, cache)
+            if layout is None:
+                slog.echo(f"! No .fastq file of {i} is created. !")
+                slog.write(f"! No .fastq file of {i} is created. !\n")
+                return False
+            stages = sample_stages(pipeline, i, layout, 'dump')
+            keys, _ = plan_stages(stages, cache)
+            cache.record(stages[0], keys['dump'])
+        else:
+            stages = sample_stages(pipeline, i, layout, source)
+        lifecycle.plan(stages)
+        if layout == 'single' and len(get_fastq_files(self.path)) > 2:
+            slog.echo("! The number of .fastq files are error. Begin to the next sample. !")
+            pipeline.log.write(f"! {i} analysing is failed. Begin to the next sample. !\n")
+            return False
+        cache.set('layout', layout)
+        return pipeline.execute_stages(stages, cache, slog, lifecycle)
+
+    # 预演：返回单双端、reads来源和各步骤是否需要运行，不运行任何步骤，也不写入任何文件
+    def dry_run(self):
+        cache = StageCache(f'{self.path}.chip_cache.json')
+        layout, source, _ = self.source(cache, probe=False)
+        plan = {'layout': layout, 'source': source or 'dump', 'stages': {},
+                'rebuilt': [f'{self.path}{self.name}.sort.bam'], 'disk': self.footprint(cache, layout, source, False)}
+        if source is None and self.pipeline.argument.front_end == 'stream':
+            # 单双端在分析时由SRA元数据判断，之前没有分析过，各步骤都要运行
+            plan['source'] = 'stream'
+            stages = sample_stages(self.pipeline, self.name, 'paired', 'stream')
+            plan['stages'] = {stage.name: 'run' for stage in stages}
+            return plan
+        if source is None:
+            # 单双端要等.fastq转换出来才能确定，之后的步骤无法预先列出
+            plan['stages']['dump'] = 'run'
+            return plan
+        stages = sample_stages(self.pipeline, self.name, layout, source)
+        _, to_run = plan_stages(stages, cache, probe=False)
+        plan['stages'] = {stage.name: 'run' if stage.name in to_run else 'cached' for stage in stages}
+        # 将要重新生成的文件，call peak据此判断filterdup是否需要重新运行
+        plan['rebuilt'] = [f for stage in stages if stage.name in to_run for f in stage.outputs]
+        return plan
+
+
+# 一个项目的一次分析：读取并检查样品表，按资源规划并行分析各样品，两个样品完成后立即call peak，最后汇总QC和资源报告
+class Pipeline:
+    def __init__(self, directory='.', argument=None, **options):
+        self.directory = os.path.abspath(directory)
+        self.options = copy.copy(argument) if argument is not None else default_options()
+        for key, value in options.items():
+            if not hasattr(self.options, key):
+                raise TypeError(f"Pipeline got an unknown option {key!r}")
+            setattr(self.options, key, value)
+        self.argument = self.options
+        self.log = None
+        self.registry = None
+        self.reference = None
+        self.planner = None
+        self.telemetry = None
+        self.metrics = None
+        self.disk = None
+        self.futures = {}
+
+    def __repr__(self):
+        return f'Pipeline({self.directory!r}, n={self.options.n!r})'
+
+    # 创建项目的主日志；dry为True时不写入文件，避免覆盖上次运行的日志
+    def open_log(self, dry=False):
+        if self.log is None:
+            argument = self.options
+            if dry:
+                argument = copy.copy(argument)
+                argument.l = False
+            path = os.path.join(self.directory, f"{argument.n}.log")
+            if argument.queue:
+                # 各worker的日志写入队列目录中自己的目录，不互相覆盖
+                path = os.path.join(self.directory, argument.queue, 'workers', worker_name(), f"{argument.n}.log")
+                if argument.l:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.log = LogWriter(argument, argument.n, path, prefix=False, mode='w')
+        return self.log
+
+    def close_log(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+    # 输出并记录一条消息
+    def report(self, msg):
+        print(msg)
+        self.log.write(msg + "\n")
+
+    # 确定本次运行的参数：自动选择获取reads的方式，把SRA toolkit加入PATH
+    def settle(self):
+        argument = copy.copy(self.options)
+        paths = os.environ.get("PATH", "").split(os.pathsep)
+        if argument.sra not in paths:
+            os.environ["PATH"] += os.pathsep + argument.sra
+        if argument.front_end == 'auto':
+            argument.front_end = 'stream' if shutil.which('fasterq-dump') else 'dump'
+        # pileup轨迹需要bedGraphToBigWig，去除黑名单区域还需要bedtools，缺少时改由bamCoverage生成.bw
+        if argument.tracks == 'pileup' and (not shutil.which('bedGraphToBigWig') or
+                                            (argument.blacklist and not shutil.which('bedtools'))):
+            argument.tracks = 'bamcoverage'
+        # 同步QC需要numpy，缺少时改用fastqc
+        if argument.qc == 'builtin' and importlib.util.find_spec('numpy') is None:
+            argument.qc = 'fastqc'
+        self.argument = argument
+        return argument
+
+    # 读取并检查样品表，返回有效样品名；样品表有错误且没有--skip-invalid时抛出PipelineError
+    def load_samples(self):
+        start_time = time.time()
+        self.log.write("reading and verifying sample list……\n")
+        self.registry = SampleRegistry(self.argument.s, set(get_srr_dirs()))
+        name_list = tuple(self.registry.valid_samples())
+        used_time = time.time() - start_time
+        print("\n--------------------------------------------------\n")
+        print(f"\nReading is completed! Used:{used_time} sec. Start to analyse.")
+        print(f"Effective Task List is {','.join(name_list)}.")
+        self.log.write("--------------------------------------------------\n")
+        self.log.write(f"Reading is completed! Used:{used_time} sec. Start to analyse.\n")
+        self.log.write(f"Effective Task List is {','.join(name_list)}.\n")
+        for warning in self.registry.warnings:
+            self.report(f"! {warning} !")
+        for error in self.registry.errors:
+            self.report(f"! {error} !")
+        if self.registry.errors and not self.argument.skip_invalid:
+            print(f"\n! {len(self.registry.errors)} errors are found in the sample list. "
+                  f"Please fix them or use --skip-invalid. !")
+            self.log.write(f"{len(self.registry.errors)} errors are found in the sample list. Program stopped.\n")
+            raise PipelineError(f"{len(self.registry.errors)} errors are found in the sample list.")
+        return name_list
+
+    def make_planner(self, create=True):
+        try:
+            self.planner = ResourcePlanner(self.argument, self.reference.shared, create)
+        except (OSError, ValueError) as e:
+            print(f"! Resource config is invalid: {e} !")
+            self.log.write(f"! Resource config is invalid: {e} Program stopped. !\n")
+            raise PipelineError(f"Resource config is invalid: {e}")
+        return self.planner
+
+    # 磁盘空间预算：限制同时分析的样品预计占用的磁盘空间
+    def make_budget(self):
+        try:
+            budget = parse_size(self.argument.disk_budget) if self.argument.disk_budget else None
+        except ValueError:
+            print(f"! --disk-budget {self.argument.disk_budget} is invalid, use a size such as 500G. !")
+            self.log.write(f"! --disk-budget {self.argument.disk_budget} is invalid. Program stopped. !\n")
+            raise PipelineError(f"--disk-budget {self.argument.disk_budget} is invalid")
+        self.disk = DiskBudget(budget, self.argument.intermediates)
+        return self.disk
+
+    # 运行一个步骤的全部命令，任一命令失败即返回False
+    def run_stage(self, stage, slog):
+        for pattern in stage.cleanup:
+            for f in glob.glob(pattern):
+                os.remove(f)
+        start_time = time.time()
+        slog.echo(f"\n{stage.begin_msg}")
+        slog.write(f"\n{stage.begin_msg}\n")
+        slog.progress = self.telemetry.begin(slog.sample, stage)
+        try:
+            return self.run_stage_cmds(stage, slog, start_time)
+        finally:
+            self.telemetry.end(slog.progress)
+            slog.progress = None
+
+    def run_stage_cmds(self, stage, slog, start_time):
+        usage = {'user_sec': 0.0, 'sys_sec': 0.0, 'max_rss_mb': 0.0}
+        input_bytes = files_size(stage.inputs)
+        for cmd in stage.cmds:
+            # 命令可以是shell字符串，也可以是运行若干命令并返回这些CmdJob的函数
+            jobs = cmd(slog) if callable(cmd) else [run_cmd(cmd, slog)]
+            for job in jobs:
+                self.metrics.add_command(slog.sample, stage, job)
+                usage['user_sec'] += job.usage.ru_utime
+                usage['sys_sec'] += job.usage.ru_stime
+                usage['max_rss_mb'] = max(usage['max_rss_mb'], job.usage.ru_maxrss / 1024)
+            job = next((job for job in jobs if job.returncode != 0), None)
+            if job is not None:
+                self.metrics.add(kind='stage', sample=slog.sample, stage=stage.name, status='failed',
+                                 wall_sec=round(time.time() - start_time, 3), input_bytes=input_bytes,
+                                 threads=stage.threads, start=round(start_time, 3), end=round(time.time(), 3),
+                                 **{k: round(v, 3) for k, v in usage.items()})
+                slog.flush()
+                slog.echo(f"! `{job.cmd}` failed with exit code {job.returncode}. Last output: !")
+                for line in job.tail:
+                    slog.echo(f"    {line}")
+                slog.write(f"! `{job.cmd}` failed with exit code {job.returncode}. !\n")
+                slog.flush()
+                return False
+        used_time = time.time() - start_time
+        record = dict(kind='stage', sample=slog.sample, stage=stage.name, status='ok', wall_sec=round(used_time, 3),
+                      input_bytes=input_bytes, output_bytes=files_size(stage.outputs), threads=stage.threads,
+                      start=round(start_time, 3), end=round(time.time(), 3),
+                      **{k: round(v, 3) for k, v in usage.items()})
+        if stage.after is not None:
+            stage.after(record)
+        self.metrics.add(**record)
+        slog.flush()
+        slog.echo(f"\n{stage.done_msg} Used: {used_time} sec.")
+        slog.write(f"{stage.done_msg} Used: {used_time} sec.\n")
+        return True
+
+    # 依次运行需要运行的步骤，未变化的步骤直接跳过；每个步骤完成后由lifecycle处理不再需要的中间文件
+    def execute_stages(self, stages, cache, slog, lifecycle=None):
+        keys, to_run = plan_stages(stages, cache)
+        for stage in stages:
+            if slog.group is not None and slog.group.cancelled.is_set():
+                slog.write(f"! {slog.sample} is stopped before {stage.name}. !\n")
+                return False
+            if stage.name not in to_run:
+                self.metrics.add(kind='stage', sample=slog.sample, stage=stage.name, status='cached',
+                                 output_bytes=files_size(stage.outputs), threads=0)
+                slog.echo(f"{stage.name} is up to date. Jumped the process.")
+                slog.write(f"{stage.name} is up to date. Jumped the process.\n")
+            else:
+                # 先删除旧记录，运行中断时该步骤会在下次运行时重做
+                cache.forget(stage.name)
+                if not self.run_stage(stage, slog):
+                    return False
+                cache.record(stage, keys[stage.name])
+            if lifecycle is not None:
+                lifecycle.finish(stage, slog, ran=stage.name in to_run)
+        return True
+
+    # 运行全部分析，返回失败的样品和组合；无法开始分析时抛出PipelineError
+    def run(self):
+        own_log = self.log is None
+        self.open_log()
+        try:
+            with workdir(self.directory):
+                return self.run_all()
+        finally:
+            if own_log:
+                self.close_log()
+
+    def run_all(self):
+        all_start_time = time.time()
+        arguments = self.settle()
+        main_log = self.log
+        self.metrics = RunMetrics()
+        name_list = self.load_samples()
+        self.make_budget()
+        sample_list = list(name_list)
+        if sample_list:
+            self.report(f"And I will analyse {','.join(sample_list)}")
+        else:
+            print("\n! I have nothing to analyse. !")
+            main_log.write("Nothing to analyse.\n")
+        main_log.write(f"Reads are obtained by the {arguments.front_end} front end.\n")
+        if arguments.disk_budget:
+            self.report(f"Samples are started only when their estimated disk footprint fits {arguments.disk_budget}.")
+        if arguments.qc != self.options.qc:
+            self.report("! numpy is not found, quality control is done by fastqc instead of the builtin QC, "
+                        "the QC summary is made from the fastp reports. !")
+        if arguments.tracks != self.options.tracks:
+            self.report(f"! bedGraphToBigWig{' or bedtools' if arguments.blacklist else ''} is not found, "
+                        f".bw files are created by bamCoverage instead of pileup tracks. !")
+        if arguments.tracks == 'pileup' and arguments.normalize not in ('none', 'CPM'):
+            print(f"! --normalize {arguments.normalize} is not supported by pileup tracks, "
+                  f"macs2 pileups are used as they are. !")
+            main_log.write(f"! --normalize {arguments.normalize} is not supported by pileup tracks. !\n")
+        # 检查（需要时建立）bwa索引；共享内存中的索引在分析结束时释放，被调度系统终止时也会释放
+        self.reference = reference = ReferenceManager(arguments)
+        self.futures = {}
+        previous_handlers = {}
+        stopped.clear()
+        if threading.current_thread() is threading.main_thread():
+            # 命令在各自的进程组中运行，收不到终端的Ctrl-C，SIGINT也由terminate结束这些命令
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                previous_handlers[signum] = signal.signal(signum, self.terminate)
+        try:
+            if sample_list:
+                error = reference.prepare(main_log)
+                if error:
+                    print(f"! {error} !")
+                    main_log.write(f"! {error} Program stopped. !\n")
+                    raise PipelineError(error)
+                if reference.plan_shared(len(sample_list), main_log):
+                    self.report(f"bwa index of {arguments.r} will be loaded into shared memory once for all samples.")
+            if arguments.queue:
+                return self.analyse_queue(name_list, sample_list, all_start_time)
+            return self.analyse(name_list, sample_list, all_start_time)
+        finally:
+            reference.release()
+            if self.telemetry is not None:
+                self.telemetry.stop('stopped')
+                self.telemetry = None
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+    # 被调度系统终止（SIGTERM）或Ctrl-C时：取消尚未开始的样品，结束正在运行的命令，立即释放共享内存中的索引，
+    # 正在运行的样品随之失败，不等它们的后续步骤完成；其余资源按正常退出的流程释放
+    def terminate(self, signum, frame):
+        for future in self.futures:
+            future.cancel()
+        terminate_jobs()
+        if self.reference is not None:
+            self.reference.release()
+        raise SystemExit(128 + signum)
+
+    # 按对照组的顺序排列样品，使第一组对照的两个样品最先完成，尽早开始call peak
+    def ordered_samples(self, sample_list):
+        ordered = {}
+        for contrast in self.registry.contrasts:
+            ordered.setdefault(contrast['ctrl'])
+            ordered.setdefault(contrast['test'])
+        return list(ordered) + [i for i in sample_list if i not in ordered]
+
+    def analyse(self, name_list, sample_list, all_start_time):
+        arguments, main_log, registry, reference = self.argument, self.log, self.registry, self.reference
+        contrasts = registry.contrasts
+        sample_list = self.ordered_samples(sample_list)
+        pending = {contrast['label']: {contrast['ctrl'], contrast['test']} for contrast in contrasts}
+        directory = f'./result/{arguments.n}/'
+        os.makedirs(directory, exist_ok=True)
+        peak_cache = StageCache(f'{directory}.chip_cache.json')
+        # 样品级调度：最多同时分析-j个样品，线程和内存由同时运行的样品平分，再由资源规划分配给各步骤的命令
+        planner = self.make_planner()
+        jobs = planner.schedule(len(sample_list))
+        sample_threads = planner.sample_threads
+        main_log.write("Resource plan:\n")
+        for line in planner.describe():
+            self.report(line)
+        failed_list = set()
+        peak_futures = {}
+        align_start_time = time.time()
+        # call peak在两个样品都完成后立即提交，与其余样品的分析同时进行，最多同时运行--peak-jobs个组合
+        peak_engine = PeakEngine(self, peak_cache)
+        # 进度遥测：定期写出./result/<n>/status.json和Prometheus文本文件
+        self.telemetry = Telemetry(arguments, directory, main_log)
+        self.telemetry.sample_total(len(sample_list))
+        self.telemetry.start()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+            self.futures = {pool.submit(Sample(self, i).analyse, sample_threads): i for i in sample_list}
+            for future in concurrent.futures.as_completed(self.futures):
+                i = self.futures[future]
+                try:
+                    success = future.result()
+                except Exception as e:
+                    success = False
+                    echo(f"! {i} analysing raised {e!r}. !")
+                    main_log.write(f"! {i} analysing raised {e!r}. !\n")
+                self.telemetry.sample_done(success)
+                if success:
+                    echo(f"{i} analysing is completed.")
+                    main_log.write(f"{i} analysing is completed.\n")
+                else:
+                    failed_list.add(i)
+                    echo(f"! {i} analysing is failed. See ./{i}/{arguments.n}.log for details. !")
+                    main_log.write(f"! {i} analysing is failed. !\n")
+                for contrast in registry.contrasts_of.get(i, []):
+                    label = contrast['label']
+                    if label not in pending or i not in pending[label]:
+                        continue
+                    if not success:
+                        del pending[label]
+                        echo(f"! {i} analysing is failed. Jumped {label} group. !")
+                        main_log.write(f"! {i} analysing is failed. Jumped {label} group. !\n")
+                        continue
+                    pending[label].discard(i)
+                    if not pending[label]:
+                        del pending[label]
+                        echo(f"{label} group is ready. Begin to call peak.")
+                        main_log.write(f"{label} group is ready. Begin to call peak.\n")
+                        peak_futures[peak_engine.submit(contrast)] = contrast
+        align_stop_time = time.time()
+        # 比对已全部结束，尽早释放共享内存给call peak使用
+        reference.release()
+        echo("--------------------------------------------------\n")
+        echo("all analysing are completed.")
+        main_log.write("\n--------------------------------------------------\n")
+        main_log.write("all analysing are completed.\n")
+        peak_spans = []
+        peak_failed = []
+        for future in concurrent.futures.as_completed(peak_futures):
+            contrast = peak_futures[future]
+            try:
+                success, peak_start, peak_stop = future.result()
+                peak_spans.append((peak_start, peak_stop))
+            except Exception as e:
+                success = False
+                self.report(f"! {contrast['label']} calling peak raised {e!r}. !")
+            if not success:
+                peak_failed.append(contrast['label'])
+        peak_engine.shutdown()
+        self.telemetry.stop()
+        peak_used_time = sum(stop - start for start, stop in peak_spans)
+        overlapped_time = overlap_time(peak_spans, align_start_time, align_stop_time)
+        print("--------------------------------------------------\n")
+        print("all calling peak processes are completed.")
+        print(f"{len(peak_spans)} groups called peak in {peak_used_time} sec, {overlapped_time} sec of which "
+              f"overlapped with sample analysing.")
+        main_log.write("\n--------------------------------------------------\n")
+        main_log.write("all calling peak processes are completed.\n")
+        main_log.write(f"{len(peak_spans)} groups called peak in {peak_used_time} sec, {overlapped_time} sec of "
+                       f"which overlapped with sample analysing.\n")
+        qc_flagged = self.summarise(name_list, directory, sorted(failed_list), peak_failed, self.metrics,
+                                    all_start_time, planner.report())
+        all_used_time = time.time() - all_start_time
+        print(f'All missions are completed! Used: {all_used_time} sec. Welcome back!')
+        main_log.write(f'All missions are completed! Used: {all_used_time} sec. Welcome back!')
+        return {'samples': list(name_list), 'failed': sorted(failed_list), 'peak_failed': peak_failed,
+                'qc_flagged': qc_flagged, 'used_time': all_used_time}
+
+    # 队列模式：从--queue目录认领样品、filterdup和call peak任务，直到全部任务完成；最后完成的进程汇总结果
+    def analyse_queue(self, name_list, sample_list, all_start_time):
+        arguments, main_log, reference = self.argument, self.log, self.reference
+        sample_list = self.ordered_samples(sample_list)
+        queue = WorkQueue(arguments.queue, arguments.lease)
+        tasks = plan_tasks(sample_list, self.registry.contrasts)
+        try:
+            queue.open(tasks, arguments.n)
+        except (OSError, ValueError) as e:
+            print(f"! Queue {arguments.queue} can not be used: {e} !")
+            main_log.write(f"! Queue {arguments.queue} can not be used: {e} Program stopped. !\n")
+            raise PipelineError(f"Queue {arguments.queue} can not be used: {e}")
+        self.report(f"Worker {queue.worker} joined the queue {arguments.queue} of {len(tasks)} tasks.")
+        directory = f'./result/{arguments.n}/'
+        os.makedirs(directory, exist_ok=True)
+        # 各worker共用call peak的缓存文件，保存时合并其他worker的记录
+        peak_cache = StageCache(f'{directory}.chip_cache.json', shared=True)
+        planner = self.make_planner()
+        jobs = planner.schedule(len(sample_list))
+        main_log.write("Resource plan:\n")
+        for line in planner.describe():
+            self.report(line)
+        peak_engine = PeakEngine(self, peak_cache)
+        # 状态文件写入本worker的目录，同一节点上的多个worker的Prometheus文本文件不互相覆盖
+        self.telemetry = Telemetry(arguments, queue.worker_dir, main_log, name=f'{arguments.n}_{queue.worker}')
+        self.telemetry.start()
+        # 最多同时分析jobs个样品，filterdup和call peak共用--peak-jobs个位置
+        slots = {'sample': jobs, 'peak': max(1, arguments.peak_jobs)}
+        done = {'ok': [], 'failed': []}
+        state = 'stopped'
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=slots['sample'] + slots['peak']) as pool:
+                running = self.futures = {}
+                while True:
+                    busy = collections.Counter('sample' if task['kind'] == 'sample' else 'peak'
+                                               for task in running.values())
+                    # 本worker有样品在等待磁盘空间时不再认领新的样品，留给其他节点
+                    kinds = (['sample'] if busy['sample'] < slots['sample'] and not self.disk.waiting else []) + \
+                            (['filterdup', 'peak'] if busy['peak'] < slots['peak'] else [])
+                    task = queue.claim(kinds) if kinds else None
+                    if task is not None:
+                        if task['kind'] == 'sample':
+                            self.telemetry.sample_total(self.telemetry.samples['total'] + 1)
+                        running[pool.submit(self.run_task, task, queue.group(task['id']), peak_engine,
+                                            planner.sample_threads)] = task
+                        continue
+                    if not running:
+                        if queue.finished():
+                            break
+                        time.sleep(queue.poll)
+                        continue
+                    finished, _ = concurrent.futures.wait(running, timeout=queue.poll,
+                                                          return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in finished:
+                        task = running.pop(future)
+                        try:
+                            success = future.result()
+                        except Exception as e:
+                            success = False
+                            echo(f"! {task['id']} raised {e!r}. !")
+                            main_log.write(f"! {task['id']} raised {e!r}. !\n")
+                        if task['kind'] == 'sample':
+                            self.telemetry.sample_done(success)
+                        if not queue.finish(task['id'], success):
+                            echo(f"! The result of {task['id']} is not recorded, another worker has taken it over. !")
+                            main_log.write(f"! The result of {task['id']} is not recorded. !\n")
+                            continue
+                        done['ok' if success else 'failed'].append(task['id'])
+            state = 'finished'
+        finally:
+            queue.close(state)
+            reference.release()
+            peak_engine.shutdown()
+        self.telemetry.stop()
+        self.metrics.write(queue.worker_dir, arguments, all_start_time, planner.report())
+        echo("--------------------------------------------------\n")
+        self.report(f"Worker {queue.worker} completed {len(done['ok'])} tasks and failed {len(done['failed'])} tasks.")
+        if done['failed']:
+            self.report(f"! Failed tasks: {','.join(done['failed'])}. !")
+        result = {'samples': list(name_list), 'completed': done['ok'], 'task_failed': done['failed'],
+                  'gathered': False}
+        # 全部任务完成后由一个worker汇总结果，其余worker直接结束
+        if queue.claim(['gather']) is not None:
+            result.update(self.gather(queue, name_list, directory))
+            queue.finish('gather', True)
+            result['gathered'] = True
+        all_used_time = time.time() - all_start_time
+        print(f'All missions are completed! Used: {all_used_time} sec. Welcome back!')
+        main_log.write(f'All missions are completed! Used: {all_used_time} sec. Welcome back!')
+        result['used_time'] = all_used_time
+        return result
+
+    # 运行一个队列任务，返回是否成功；group为该任务的命令，失去租约时由心跳线程结束
+    def run_task(self, task, group, peak_engine, sample_threads):
+        if task['kind'] == 'sample':
+            success = Sample(self, task['sample']).analyse(sample_threads, group)
+            i = task['sample']
+            if success:
+                echo(f"{i} analysing is completed.")
+                self.log.write(f"{i} analysing is completed.\n")
+            else:
+                echo(f"! {i} analysing is failed. See ./{i}/{self.argument.n}.log for details. !")
+                self.log.write(f"! {i} analysing is failed. !\n")
+            return success
+        if task['kind'] == 'filterdup':
+            return peak_engine.filterdup(task['sample'], group)
+        success, _, _ = peak_engine.call_peak(task['contrast'], filtered=True, group=group)
+        return success
+
+    # 汇总各worker的结果：合并资源报告，生成QC汇总和任务汇总，写入./result/<n>/
+    def gather(self, queue, name_list, directory):
+        arguments, main_log = self.argument, self.log
+        echo(f"Begin to gather the results of the queue {arguments.queue}.")
+        main_log.write(f"\nBegin to gather the results of the queue {arguments.queue}.\n")
+        workers = queue.wait_workers()
+        metrics = RunMetrics()
+        start_time = time.time()
+        resources = {}
+        for worker in sorted(workers):
+            try:
+                with open(queue.path('workers', worker, 'run_metrics.json'), encoding="utf-8") as f:
+                    report = json.load(f)
+            except (OSError, ValueError):
+                continue
+            start_time = min(start_time, report['start'])
+            resources[worker] = report['resources']
+            metrics.records += report['records']
+        summary = {task_id: {'kind': queue.tasks[task_id]['kind'], **queue.results.get(task_id, {})}
+                   for task_id in queue.order if task_id != 'gather'}
+        with open(os.path.join(directory, 'queue_summary.json'), 'w', encoding="utf-8") as f:
+            json.dump(summary, f, indent=1)
+        failed = [task_id for task_id, result in summary.items() if result.get('status') != 'ok']
+        failed_samples = [task_id.split(':', 1)[1] for task_id in failed if task_id.startswith('sample:')]
+        peak_failed = [task_id.split(':', 1)[1] for task_id in failed if task_id.startswith('peak:')]
+        print("--------------------------------------------------\n")
+        self.report(f"{len(summary) - len(failed)} of {len(summary)} tasks of {len(workers)} workers are completed. "
+                    f"Results are gathered in {directory}.")
+        qc_flagged = self.summarise(name_list, directory, failed_samples, peak_failed, metrics, start_time,
+                                    {'workers': resources})
+        return {'failed': failed_samples, 'peak_failed': peak_failed, 'qc_flagged': qc_flagged}
+
+    # 分析结束时的汇总（单机运行和队列汇总共用）：报告失败的样品和组合，写出QC汇总和资源报告，
+    # 返回有质量警告的文件数
+    def summarise(self, name_list, directory, failed_samples, peak_failed, metrics, start_time, resources):
+        if failed_samples:
+            self.report(f"! Failed samples: {','.join(failed_samples)}. !")
+        if peak_failed:
+            self.report(f"! Failed groups: {','.join(peak_failed)}. !")
+        from .qc import write_qc_summary
+        qc_flagged = write_qc_summary(name_list, directory)
+        if qc_flagged:
+            self.report(f"! {qc_flagged} files have quality warnings, see {directory}qc_summary.html. !")
+        metrics.write(directory, self.argument, start_time, resources)
+        self.report(f"Compressed .fastq files saved {metrics.bytes_saved() / 1024 ** 3:.2f} GiB of disk.")
+        self.report(f"Intermediate files freed {metrics.bytes_freed() / 1024 ** 3:.2f} GiB of disk.")
+        self.report(f"Resource report is written to {directory}run_metrics.json and run_metrics.csv.")
+        return qc_flagged
+
+    # 预演：检查样品表和资源配置，列出各样品和组合将要运行和可以跳过的步骤，不运行任何命令，也不创建任何文件
+    def dry_run(self):
+        own_log = self.log is None
+        self.open_log(dry=True)
+        try:
+            with workdir(self.directory):
+                return self.dry_run_all()
+        finally:
+            if own_log:
+                self.close_log()
+
+    def dry_run_all(self):
+        arguments = self.settle()
+        name_list = self.load_samples()
+        self.make_budget()
+        print(f"Dry run of {arguments.n} in {self.directory}, nothing will be run.")
+        self.reference = ReferenceManager(arguments)
+        missing = self.reference.missing()
+        if missing and name_list:
+            print(f"! bwa index files {', '.join(missing)} are missing, they will be built from "
+                  f"{self.reference.fasta}. !")
+        planner = self.make_planner(create=False)
+        planner.schedule(len(name_list))
+        plan = {'name': arguments.n, 'directory': self.directory, 'front_end': arguments.front_end,
+                'samples': {}, 'contrasts': {}, 'resources': planner.report()}
+        for i in name_list:
+            sample = Sample(self, i).dry_run()
+            plan['samples'][i] = sample
+            layout = f"{sample['layout']}-end" if sample['layout'] else 'layout unknown until it is analysed'
+            disk = f", about {human(sample['disk'], 'B')} of disk at peak" if sample['disk'] else ''
+            print(f"{i}: {layout}, reads from {sample['source']}{disk}.")
+            for name, state in sample['stages'].items():
+                print(f"    {name}: {'will run' if state == 'run' else 'is up to date'}")
+        peak_cache = StageCache(f'./result/{arguments.n}/.chip_cache.json')
+        peak_engine = PeakEngine(self, peak_cache)
+        for contrast in self.registry.contrasts:
+            # 样品的.sort.bam或filterdup需要重新生成时，之后的步骤也按需要运行计
+            stages = {}
+            for i in (contrast['ctrl'], contrast['test']):
+                stage = peak_engine.filterdup_stage(i)
+                _, to_run = plan_stages([stage], peak_cache, probe=False)
+                rebuilt = any(f in plan['samples'][i]['rebuilt'] for f in stage.inputs)
+                stages[stage.name] = 'run' if rebuilt or stage.name in to_run else 'cached'
+            upstream = 'run' in stages.values()
+            contrast_stages = peak_engine.contrast_stages(contrast)
+            _, to_run = plan_stages(contrast_stages, peak_cache, probe=False)
+            for stage in contrast_stages:
+                stages[stage.name] = 'run' if upstream or stage.name in to_run else 'cached'
+            plan['contrasts'][contrast['label']] = stages
+            print(f"{contrast['label']}: test {contrast['test']}, ctrl {contrast['ctrl']}.")
+            for name, state in stages.items():
+                print(f"    {name}: {'will run' if state == 'run' else 'is up to date'}")
+        peak_engine.shutdown()
+        if arguments.queue and os.path.isfile(os.path.join(arguments.queue, 'queue.json')):
+            plan['queue'] = status = WorkQueue(arguments.queue, arguments.lease).status()
+            print(f"Queue {arguments.queue}: {status['done']} of {status['tasks']} tasks are done "
+                  f"({status['failed']} failed), {status['running']} are claimed, {status['waiting']} are waiting.")
+        for line in planner.describe():
+            print(line)
+        return plan
@@ -0,0 +1,285 @@
+"""去接头时同步计算的质量控制指标，以及单个样品和全部样品的QC报告。
+
+同步QC（FastqQC）依赖NumPy，只在实际去接头或汇总QC结果时才导入本模块；没有NumPy（使用fastqc）时，
+全部样品的QC汇总按fastp报告中去接头后的指标生成。
+"""
+import collections
+import html
+import json
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 碱基到2-bit编码的查找表，N等其他字符为-1
+base_codes = None
+if np is not None:
+    base_codes = np.full(256, -1, dtype=np.int8)
+    for code, base in enumerate(b'ACGT'):
+        base_codes[base] = code
+        base_codes[base + 32] = code  # 小写
+
+
+# 用于在去接头时同步计算质量控制指标的类：按大块接收.fastq数据，用NumPy向量化统计
+# 每个位置的平均质量、GC含量、长度分布、N含量和过度出现的k-mer/序列，不需要再读一遍文件
+class FastqQC:
+    kmer = 7
+    overrep_reads = 200000  # 统计过度出现的序列时只看前20万条read
+    overrep_length = 50  # 与fastqc相同，只比较read的前50个碱基
+
+    def __init__(self, name):
+        self.name = name
+        self.leftover = b''
+        self.reads = 0
+        self.bases = 0
+        self.q20 = 0
+        self.q30 = 0
+        self.gc = 0
+        self.n = 0
+        self.length_hist = np.zeros(1, dtype=np.int64)
+        self.qual_sum = np.zeros(0, dtype=np.int64)
+        self.pos_count = np.zeros(0, dtype=np.int64)
+        self.n_count = np.zeros(0, dtype=np.int64)
+        self.gc_hist = np.zeros(101, dtype=np.int64)  # 每条read的GC百分比分布
+        self.read_qual_hist = np.zeros(94, dtype=np.int64)  # 每条read的平均质量分布
+        self.kmer_counts = np.zeros(4 ** self.kmer, dtype=np.int64)
+        self.sequences = collections.Counter()
+
+    # 接收一块数据，只处理其中完整的read，剩余部分留到下一块
+    def feed(self, chunk):
+        data = self.leftover + chunk if self.leftover else chunk
+        arr = np.frombuffer(data, dtype=np.uint8)
+        newlines = np.flatnonzero(arr == 10)
+        n = len(newlines) // 4
+        if n == 0:
+            self.leftover = data
+            return
+        self.leftover = data[newlines[n * 4 - 1] + 1:]
+        self.process(data, arr, newlines[:n * 4])
+
+    def grow(self, length):
+        if length > len(self.qual_sum):
+            pad = length - len(self.qual_sum)
+            self.qual_sum = np.concatenate((self.qual_sum, np.zeros(pad, dtype=np.int64)))
+            self.pos_count = np.concatenate((self.pos_count, np.zeros(pad, dtype=np.int64)))
+            self.n_count = np.concatenate((self.n_count, np.zeros(pad, dtype=np.int64)))
+
+    def process(self, data, arr, newlines):
+        starts = np.concatenate(([0], newlines[:-1] + 1))
+        seq_start, seq_end, qual_start = starts[1::4], newlines[1::4], starts[3::4]
+        lengths = seq_end - seq_start
+        n = len(lengths)
+        max_len = int(lengths.max())
+        if max_len == 0:
+            self.reads += n
+            return
+        # 按read排成矩阵，超出read长度的位置由mask排除
+        pos = np.arange(max_len)
+        mask = pos < lengths[:, None]
+        last = len(arr) - 1
+        seq = arr[np.minimum(seq_start[:, None] + pos, last)]
+        qual = np.where(mask, arr[np.minimum(qual_start[:, None] + pos, last)].astype(np.int16) - 33, 0)
+        self.grow(max_len)
+        self.qual_sum[:max_len] += qual.sum(axis=0)
+        self.pos_count[:max_len] += mask.sum(axis=0)
+        self.q20 += int(((qual >= 20) & mask).sum())
+        self.q30 += int(((qual >= 30) & mask).sum())
+        upper = seq & 0xDF
+        is_n = (upper == ord('N')) & mask
+        self.n_count[:max_len] += is_n.sum(axis=0)
+        self.n += int(is_n.sum())
+        gc_reads = (((upper == ord('G')) | (upper == ord('C'))) & mask).sum(axis=1)
+        self.gc += int(gc_reads.sum())
+        safe_len = np.maximum(lengths, 1)
+        self.gc_hist += np.bincount(np.rint(gc_reads * 100 / safe_len).astype(np.int64), minlength=101)[:101]
+        read_qual = np.clip(np.rint(qual.sum(axis=1) / safe_len), 0, 93).astype(np.int64)
+        self.read_qual_hist += np.bincount(read_qual, minlength=94)[:94]
+        length_hist = np.bincount(lengths)
+        if len(length_hist) > len(self.length_hist):
+            self.length_hist = np.concatenate(
+                (self.length_hist, np.zeros(len(length_hist) - len(self.length_hist), dtype=np.int64)))
+        self.length_hist[:len(length_hist)] += length_hist
+        # k-mer计数：逐位累加2-bit编码，含N或超出read长度的k-mer不计
+        if max_len >= self.kmer:
+            codes = np.where(mask, base_codes[seq], -1)
+            width = max_len - self.kmer + 1
+            kmers = np.zeros((n, width), dtype=np.int64)
+            valid = np.ones((n, width), dtype=bool)
+            for j in range(self.kmer):
+                part = codes[:, j:j + width]
+                kmers = kmers * 4 + np.maximum(part, 0)
+                valid &= part >= 0
+            self.kmer_counts += np.bincount(kmers[valid], minlength=4 ** self.kmer)
+        if self.reads < self.overrep_reads:
+            take = min(n, self.overrep_reads - self.reads)
+            ends = np.minimum(seq_end[:take], seq_start[:take] + self.overrep_length)
+            self.sequences.update(data[s:e] for s, e in zip(seq_start[:take].tolist(), ends.tolist()))
+        self.reads += n
+        self.bases += int(lengths.sum())
+
+    def summary(self):
+        if self.leftover.strip():
+            self.feed(b'\n')  # 文件末尾缺少换行时补全最后一条read
+        pos_count = np.maximum(self.pos_count, 1)
+        lengths = np.flatnonzero(self.length_hist)
+        total_kmers = int(self.kmer_counts.sum())
+        kmers = []
+        if total_kmers:
+            # 以单碱基组成计算每个k-mer的期望数，报告观测/期望比值最高的k-mer
+            base_freq = self.kmer_counts.reshape(4, -1).sum(axis=1) / total_kmers
+            index = np.arange(4 ** self.kmer)
+            expected = np.full(4 ** self.kmer, float(total_kmers))
+            for j in range(self.kmer):
+                expected *= base_freq[(index >> (2 * (self.kmer - 1 - j))) & 3]
+            ratio = np.where((expected > 0) & (self.kmer_counts >= 100), self.kmer_counts / np.maximum(expected, 1e-9),
+                             0)
+            for code in np.argsort(ratio)[::-1][:10]:
+                if ratio[code] < 3:
+                    break
+                kmer = ''.join('ACGT'[(int(code) >> (2 * (self.kmer - 1 - j))) & 3] for j in range(self.kmer))
+                kmers.append({'kmer': kmer, 'count': int(self.kmer_counts[code]), 'obs_exp': round(float(ratio[code]), 2)})
+        sampled = min(self.reads, self.overrep_reads)
+        overrep = [{'sequence': seq.decode('ascii', errors='replace'), 'count': count,
+                    'percent': round(count * 100 / sampled, 3)}
+                   for seq, count in self.sequences.most_common(10) if count > 1 and count * 1000 > sampled]
+        return {
+            'name': self.name,
+            'reads': self.reads,
+            'bases': self.bases,
+            'mean_length': round(self.bases / self.reads, 2) if self.reads else 0,
+            'min_length': int(lengths[0]) if len(lengths) else 0,
+            'max_length': int(lengths[-1]) if len(lengths) else 0,
+            'mean_quality': round(float(self.qual_sum.sum()) / self.bases, 2) if self.bases else 0,
+            'q20_percent': round(self.q20 * 100 / self.bases, 2) if self.bases else 0,
+            'q30_percent': round(self.q30 * 100 / self.bases, 2) if self.bases else 0,
+            'gc_percent': round(self.gc * 100 / self.bases, 2) if self.bases else 0,
+            'n_percent': round(self.n * 100 / self.bases, 4) if self.bases else 0,
+            'per_position_quality': np.round(self.qual_sum / pos_count, 2).tolist(),
+            'per_position_n_percent': np.round(self.n_count * 100 / pos_count, 3).tolist(),
+            'length_distribution': {int(length): int(self.length_hist[length]) for length in lengths},
+            'gc_distribution': self.gc_hist.tolist(),
+            'read_quality_distribution': {int(q): int(c) for q, c in enumerate(self.read_qual_hist) if c},
+            'overrepresented_sequences': overrep,
+            'overrepresented_kmers': kmers,
+        }
+
+
+# 检查QC结果，返回需要注意的问题
+def qc_warnings(summary):
+    warnings = []
+    if summary['reads'] == 0:
+        return ['no reads']
+    if summary['q30_percent'] < 80:
+        warnings.append(f"Q30 {summary['q30_percent']}%")
+    if not 35 <= summary['gc_percent'] <= 60:
+        warnings.append(f"GC {summary['gc_percent']}%")
+    if summary.get('n_percent', 0) > 1:
+        warnings.append(f"N {summary['n_percent']}%")
+    if summary.get('overrepresented_sequences') and summary['overrepresented_sequences'][0]['percent'] >= 1:
+        warnings.append(f"overrepresented sequence {summary['overrepresented_sequences'][0]['percent']}%")
+    return warnings
+
+
+# QC汇总表的列
+qc_columns = ['sample', 'file', 'reads', 'mean_length', 'mean_quality', 'q30_percent', 'gc_percent', 'n_percent',
+              'raw_reads', 'raw_q30_percent', 'warnings']
+
+
+# 生成不含图片的HTML表格
+def html_table(title, rows, columns):
+    head = ''.join(f'<th>{html.escape(str(c))}</th>' for c in columns)
+    body = ''.join('<tr>' + ''.join(f'<td>{html.escape(str(row.get(c, "")))}</td>' for c in columns) + '</tr>'
+                   for row in rows)
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{html.escape(title)}</title>'
+            f'<style>table{{border-collapse:collapse}}td,th{{border:1px solid #999;padding:2px 6px}}</style></head>'
+            f'<body><h3>{html.escape(title)}</h3><table><tr>{head}</tr>{body}</table></body></html>')
+
+
+# 写出单个样品的QC结果：JSON保存全部指标，HTML只列出主要指标和每10个位置的平均质量
+def write_sample_qc(i, summaries, fastp_json, json_path, html_path):
+    raw = {}
+    try:
+        with open(fastp_json, encoding="utf-8") as f:
+            before = json.load(f)['summary']['before_filtering']
+        raw = {'raw_reads': before['total_reads'], 'raw_q30_percent': round(before['q30_rate'] * 100, 2)}
+    except (OSError, ValueError, KeyError):
+        pass
+    report = {'sample': i, 'raw': raw, 'files': summaries}
+    with open(json_path, 'w', encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    rows = qc_rows(report)
+    positions = [{'file': s['name'], **{str(p + 1): s['per_position_quality'][p]
+                                         for p in range(0, len(s['per_position_quality']), 10)}}
+                 for s in summaries]
+    columns = ['file'] + sorted({key for row in positions for key in row if key != 'file'}, key=int)
+    with open(html_path, 'w', encoding="utf-8") as f:
+        f.write(html_table(f'{i} quality control', rows, qc_columns).replace(
+            '</body>', html_table('mean quality by position', positions, columns).split('<body>')[1]))
+
+
+# 把一个样品的QC结果展开为汇总表的行
+def qc_rows(report):
+    return [{'sample': report['sample'], 'file': s['name'], 'reads': s['reads'], 'mean_length': s['mean_length'],
+             'mean_quality': s['mean_quality'], 'q30_percent': s['q30_percent'], 'gc_percent': s['gc_percent'],
+             'n_percent': s['n_percent'], **report.get('raw', {}), 'warnings': '; '.join(qc_warnings(s))}
+            for s in report['files']]
+
+
+# 没有同步QC的结果（--qc fastqc）时，由fastp报告生成一个样品的汇总行，没有平均质量和N含量
+def fastp_rows(i, fastp_json):
+    with open(fastp_json, encoding="utf-8") as f:
+        summary = json.load(f)['summary']
+    before, after = summary['before_filtering'], summary['after_filtering']
+    row = {'reads': after['total_reads'], 'mean_length': after['read1_mean_length'],
+           'q30_percent': round(after['q30_rate'] * 100, 2), 'gc_percent': round(after['gc_content'] * 100, 2)}
+    return [{'sample': i, 'file': f'{i} (fastp)', **row, 'raw_reads': before['total_reads'],
+             'raw_q30_percent': round(before['q30_rate'] * 100, 2), 'warnings': '; '.join(qc_warnings(row))}]
+
+
+# 汇总全部样品的QC结果，便于一眼找出有问题的文库；没有同步QC结果的样品按其fastp报告汇总
+def write_qc_summary(samples, directory):
+    rows = []
+    for i in samples:
+        try:
+            with open(f'./{i}/{i}_qc.json', encoding="utf-8") as f:
+                rows += qc_rows(json.load(f))
+            continue
+        except (OSError, ValueError):
+            pass
+        try:
+            rows += fastp_rows(i, f'./{i}/{i}_fastp.json')
+        except (OSError, ValueError, KeyError):
+            continue
+    if not rows:
+        return 0
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'qc_summary.json'), 'w', encoding="utf-8") as f:
+        json.dump(rows, f, indent=1)
+    with open(os.path.join(directory, 'qc_summary.html'), 'w', encoding="utf-8") as f:
+        f.write(html_table('quality control summary', rows, qc_columns))
+    return sum(1 for row in rows if row['warnings'])
+
+
+# 从命名管道读取去接头后的数据，边计算QC边写入最终文件
+def tee_fifo(fd, writer, qc, errors):
+    try:
+        while True:
+            chunk = os.read(fd, 1 << 22)
+            if not chunk:
+                break
+            qc.feed(chunk)
+            if writer is not None:
+                try:
+                    writer.write(chunk)
+                except OSError as e:
+                    # 写入失败后继续读空管道，避免fastp阻塞
+                    errors.append(f"writing {qc.name} failed: {e}")
+                    writer = None
+    except Exception as e:
+        errors.append(f"quality control of {qc.name} failed: {e!r}")
+        while os.read(fd, 1 << 22):
+            pass
+    finally:
+        os.close(fd)
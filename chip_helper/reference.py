@@ -0,0 +1,120 @@
+"""参考基因组bwa索引的检查、建立和共享内存载入。"""
+import fcntl
+import os
+import subprocess
+import threading
+import time
+
+from .runner import run_cmd
+from .utils import files_size, gib
+
+
+# 参考基因组索引的管理：检查bwa索引文件是否完整，缺失时在文件锁下建立（多个程序同时运行时只建立一次）；
+# 运行期间把索引载入共享内存，bwa mem按相同的前缀自动使用共享的一份，不再每个样品从磁盘读取一次
+class ReferenceManager:
+    exts = ('amb', 'ann', 'bwt', 'pac', 'sa')
+
+    def __init__(self, argument):
+        self.argument = argument
+        self.prefix = argument.r
+        self.fasta = argument.ref_fasta or argument.r
+        self.shared = False  # 是否使用共享内存中的索引
+        self.ready = False  # 索引是否已在共享内存中
+        self.loaded = False  # 索引是否由本程序载入，只释放自己载入的索引
+        self.lock = threading.RLock()  # 终止时信号处理函数可能在主线程持有锁时释放索引
+
+    def missing(self):
+        return [f'{self.prefix}.{ext}' for ext in self.exts
+                if not os.path.exists(f'{self.prefix}.{ext}') or os.path.getsize(f'{self.prefix}.{ext}') == 0]
+
+    # bwa载入内存的索引大小
+    def size(self):
+        return files_size([f'{self.prefix}.{ext}' for ext in self.exts])
+
+    # 检查索引，缺失时用参考基因组FASTA建立，返回错误信息，索引可用时返回None
+    def prepare(self, log):
+        if not self.missing():
+            if os.path.isfile(self.fasta) and os.path.getmtime(self.fasta) > os.path.getmtime(f'{self.prefix}.bwt'):
+                log.echo(f"! {self.fasta} is newer than its bwa index, the index may be out of date. !")
+                log.write(f"! {self.fasta} is newer than its bwa index, the index may be out of date. !\n")
+            return None
+        if not os.path.isfile(self.fasta):
+            return (f"bwa index files {', '.join(self.missing())} are missing and no reference FASTA is found "
+                    f"at {self.fasta} to build them (use --ref-fasta).")
+        # 在锁文件上加排他锁，同时运行的其他程序等待本程序建立完成后直接使用
+        with open(f'{self.prefix}.lock', 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                log.echo(f"bwa index of {self.prefix} is being built by another program, waiting……")
+                log.write(f"bwa index of {self.prefix} is being built by another program, waiting.\n")
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            if not self.missing():
+                return None
+            log.echo(f"Begin to build bwa index of {self.fasta}.")
+            log.write(f"Begin to build bwa index of {self.fasta}.\n")
+            start_time = time.time()
+            # 先建立到临时前缀，完成后再改名，中断时不会留下不完整的索引
+            building = f'{self.prefix}.building'
+            job = run_cmd(f"bwa index -p {building} {self.fasta}", log)
+            if job.returncode != 0:
+                return f"`{job.cmd}` failed with exit code {job.returncode}: {' / '.join(job.tail)}"
+            for ext in self.exts:
+                os.replace(f'{building}.{ext}', f'{self.prefix}.{ext}')
+            log.echo(f"bwa index is built. Used: {time.time() - start_time} sec.")
+            log.write(f"bwa index is built. Used: {time.time() - start_time} sec.\n")
+        return None
+
+    # 决定是否使用共享内存：auto时有多个样品要比对且/dev/shm放得下索引才使用
+    def plan_shared(self, samples, log):
+        mode = self.argument.ref_shm
+        if mode == 'off' or (mode == 'auto' and samples < 2):
+            return False
+        try:
+            stat = os.statvfs('/dev/shm')
+            free = stat.f_bavail * stat.f_frsize
+        except OSError:
+            free = 0
+        if free < self.size():
+            log.echo(f"! /dev/shm has {gib(free)} free but the bwa index needs {gib(self.size())}, "
+                     f"every bwa mem will load the index from disk. !")
+            log.write(f"! /dev/shm has {gib(free)} free but the bwa index needs {gib(self.size())}. !\n")
+            return False
+        self.shared = True
+        return True
+
+    def shm_names(self):
+        try:
+            out = subprocess.run(['bwa', 'shm', '-l'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                 text=True, timeout=60).stdout
+        except (OSError, subprocess.SubprocessError):
+            return []
+        return [line.split('\t')[0] for line in out.splitlines() if line.strip()]
+
+    # 比对步骤的第一条命令：第一个比对的样品把索引载入共享内存，其余样品直接使用；载入失败时退回从磁盘读取
+    def load(self, slog):
+        with self.lock:
+            if not self.shared or self.ready:
+                return []
+            if any(name in (self.prefix, os.path.basename(self.prefix)) for name in self.shm_names()):
+                # 由其他程序载入，结束时不释放
+                slog.echo(f"bwa index of {self.prefix} is already in shared memory.")
+                slog.write(f"bwa index of {self.prefix} is already in shared memory.\n")
+                self.ready = True
+                return []
+            job = run_cmd(f"bwa shm {self.prefix}", slog)
+            if job.returncode != 0:
+                self.shared = False
+                slog.echo("! Loading bwa index into shared memory failed, the index will be read from disk. !")
+                slog.write(f"! `{job.cmd}` failed with exit code {job.returncode}. !\n")
+                return []
+            self.ready = self.loaded = True
+            return [job]
+
+    # 释放本程序载入共享内存的索引；bwa shm -d会清除全部共享的索引
+    def release(self):
+        with self.lock:
+            if not self.loaded:
+                return
+            self.loaded = self.ready = False
+            subprocess.run(['bwa', 'shm', '-d'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
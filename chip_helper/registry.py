@@ -0,0 +1,105 @@
+"""样品表的读取和检查。"""
+import csv
+import glob
+import os
+
+
+# 获取当前目录下所有SRR开头文件夹的程序
+def get_srr_dirs():
+    current_dir = os.getcwd()
+    all_dirs = [d for d in os.listdir(current_dir) if
+                os.path.isdir(os.path.join(current_dir, d)) and d.startswith("SRR")]
+    return all_dirs
+
+
+# 可识别的FASTQ文件扩展名，包括用户放入SRR文件夹的压缩文件
+fastq_exts = ('.fastq', '.fastq.gz', '.fq', '.fq.gz')
+
+
+# 获取当前目录下所有FASTQ结尾文件的程序
+def get_fastq_files(current_dir):
+    all_files = []
+    for ext in fastq_exts:
+        all_files += glob.glob(os.path.join(current_dir, '*' + ext))
+    return all_files
+
+
+# 用于管理样品表的类：样品表只读取一次，按样品名和(处理, 重复)建立索引，
+# 在开始分析前检查全部样品文件夹和实验组/对照组组合，避免分析数小时后才因缺少对照报错
+class SampleRegistry:
+    columns = ('sample_name', 'treatment', 'rep')
+
+    def __init__(self, path, srr_dirs):
+        self.path = path
+        self.samples = {}  # 样品名 -> {'name', 'treatment', 'rep', 'group'}
+        self.by_group = {}  # (treatment, rep) -> 样品名
+        self.invalid = set()  # 有错误的样品名
+        self.contrasts = []
+        self.contrasts_of = {}  # 样品名 -> 用到该样品的实验组/对照组组合
+        self.errors = []
+        self.warnings = []
+        self.load(srr_dirs)
+        self.build_contrasts()
+
+    # 读取样品表：返回标题和(行号, 该行内容)，空行跳过，行号为文件中的实际行号
+    def read(self):
+        with open(self.path, encoding="utf-8-sig", newline='') as f:
+            reader = csv.DictReader(f)
+            rows = [(reader.line_num, row) for row in reader]
+            return reader.fieldnames or [], rows
+
+    def load(self, srr_dirs):
+        try:
+            header, rows = self.read()
+        except (OSError, ValueError, csv.Error) as e:
+            self.errors.append(f"The sample list {self.path} can not be read: {e}.")
+            return
+        missing = [column for column in self.columns if column not in header]
+        if missing:
+            self.errors.append(f"Column {','.join(missing)} is not found in {self.path}.")
+            return
+        for row, values in rows:
+            name, treatment, rep = ((values.get(column) or '').strip() for column in self.columns)
+            if not name or not treatment or not rep:
+                self.errors.append(f"Row {row}: sample_name, treatment and rep must not be empty.")
+                continue
+            if name in self.samples:
+                self.errors.append(f"Row {row}: {name} is listed more than once.")
+                continue
+            try:
+                rep = int(rep)
+            except ValueError:
+                self.errors.append(f"Row {row}: rep of {name} is {rep!r}, which is not an integer.")
+                self.invalid.add(name)
+                continue
+            self.samples[name] = {"name": name, "treatment": treatment, "rep": rep, "group": f"{treatment}_{rep}"}
+            other = self.by_group.setdefault((treatment, rep), name)
+            if other != name:
+                self.errors.append(f"Row {row}: {name} and {other} are both {treatment} rep {rep}.")
+                self.invalid.add(name)
+            if name not in srr_dirs:
+                self.errors.append(f"Row {row}: the folder ./{name}/ is not found.")
+                self.invalid.add(name)
+            elif not any(f.endswith(('.sra',) + fastq_exts) or f == '.chip_cache.json' for f in os.listdir(name)):
+                self.warnings.append(f"./{name}/ has no .sra or .fastq file, {name} will be downloaded by fastq-dump.")
+
+    def build_contrasts(self):
+        for (treatment, rep), test in self.by_group.items():
+            if treatment == 'input':
+                continue
+            label = f"{treatment}_{rep}_vs_input_{rep}"
+            ctrl = self.by_group.get(('input', rep))
+            if ctrl is None:
+                self.errors.append(f"{label}: no input sample of rep {rep} is found for {test}.")
+                self.invalid.add(test)
+                continue
+            if test in self.invalid or ctrl in self.invalid:
+                continue
+            contrast = {"treatment": treatment, "rep": rep, "test": test, "ctrl": ctrl, "label": label}
+            self.contrasts.append(contrast)
+            self.contrasts_of.setdefault(test, []).append(contrast)
+            self.contrasts_of.setdefault(ctrl, []).append(contrast)
+
+    # 没有错误、可以分析的样品，按样品表顺序
+    def valid_samples(self):
+        return [name for name in self.samples if name not in self.invalid]
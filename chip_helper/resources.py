@@ -0,0 +1,185 @@
+"""按可用的核数和内存为各步骤分配线程、排序内存和临时目录。"""
+import json
+import os
+
+from .utils import files_size, gib, parse_size
+
+
+# 检测可用的核数：优先使用进程可运行的CPU集合，并考虑cgroup（容器）的CPU配额
+def detect_cores():
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max', encoding="utf-8") as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cores = min(cores, max(1, -(-int(quota) // int(period))))
+    except (OSError, ValueError):
+        pass
+    return cores
+
+
+# 检测可用内存：取/proc/meminfo中的MemAvailable与cgroup（容器）内存上限的剩余量中较小的一个
+def detect_memory():
+    available = None
+    try:
+        with open('/proc/meminfo', encoding="utf-8") as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    available = int(line.split()[1]) * 1024
+                    break
+    except (OSError, ValueError):
+        pass
+    if available is None:
+        available = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    try:
+        with open('/sys/fs/cgroup/memory.max', encoding="utf-8") as f:
+            limit = f.read().strip()
+        with open('/sys/fs/cgroup/memory.current', encoding="utf-8") as f:
+            current = int(f.read())
+        if limit != 'max':
+            available = min(available, int(limit) - current)
+    except (OSError, ValueError):
+        pass
+    return max(available, 1 << 30)
+
+
+# 资源规划：按可用的核数和内存以及同时分析的样品数，为每个步骤的命令分配线程数、排序内存和临时目录
+# 配置文件（--resources）可以按步骤覆盖规划结果，如{"align": {"threads": 12, "sort_mem": "2G"}}
+class ResourcePlanner:
+    # 各步骤能有效利用的线程数上限，None为随线程数基本线性扩展
+    max_threads = {'dump': 8, 'trim': 16, 'qc': None, 'align': None, 'index': 4, 'bigwig': None}
+    sort_max_threads = 8
+    override_keys = ('threads', 'compress_threads', 'sort_threads', 'sort_mem', 'tmpdir')
+    sort_mem_min = 256 << 20  # samtools sort每个线程的内存下限和上限
+    sort_mem_max = 4 << 30
+    mem_reserve = 0.8  # 只规划可用内存的80%，其余留给系统和工具的其他开销
+
+    def __init__(self, argument, shared_index=False, create=True):
+        self.argument = argument
+        self.shared_index = shared_index  # 索引在共享内存中时所有样品共用一份
+        self.create = create  # 为False时（如试运行）不创建任何临时目录
+        self.cores = argument.cores or detect_cores()
+        self.mem = parse_size(argument.mem) if argument.mem else detect_memory()
+        self.threads = argument.t or self.cores
+        # bwa mem会把.bwt、.sa和.pac文件载入内存，以其大小估算每个比对进程的索引内存
+        self.index_mem = files_size([f'{argument.r}.{ext}' for ext in ('bwt', 'sa', 'pac')])
+        self.overrides = self.load_overrides(argument.resources) if argument.resources else {}
+        self.jobs = 1
+        self.sample_threads = self.threads
+        self.sample_mem = int(self.mem * self.mem_reserve)
+        self.notes = []
+        if self.threads > self.cores:
+            self.notes.append(f"{self.threads} threads are requested but only {self.cores} cores are available.")
+
+    def load_overrides(self, path):
+        with open(path, encoding="utf-8") as f:
+            overrides = json.load(f)
+        if not isinstance(overrides, dict):
+            raise ValueError(f"{path} should be a JSON object of stages.")
+        for stage, values in overrides.items():
+            if stage not in self.max_threads or not isinstance(values, dict):
+                raise ValueError(f"{path}: unknown stage {stage!r}, expected one of {', '.join(self.max_threads)}.")
+            for key in values:
+                if key not in self.override_keys:
+                    raise ValueError(f"{path}: unknown setting {stage}.{key}, "
+                                     f"expected one of {', '.join(self.override_keys)}.")
+        return overrides
+
+    # 按待分析的样品数确定同时运行的样品数，以及每个样品分得的线程数和内存
+    def schedule(self, samples):
+        jobs = max(1, min(self.argument.j, samples)) if samples else 1
+        budget = int(self.mem * self.mem_reserve)
+        # 每个比对进程都要载入一份参考基因组索引（共享内存时只有一份），内存不足时减少同时运行的样品数
+        if self.shared_index:
+            budget -= self.index_mem
+        need = (0 if self.shared_index else self.index_mem) + 2 * self.sort_mem_min
+        if jobs > 1 and need * jobs > budget:
+            fit = max(1, budget // need)
+            self.notes.append(f"{jobs} samples at once need about {gib(need * jobs)} memory but only "
+                              f"{gib(budget)} is planned, {fit} samples will be analysed at once.")
+            jobs = fit
+        self.jobs = jobs
+        self.sample_threads = max(1, self.threads // jobs)
+        self.sample_mem = budget // jobs
+        return jobs
+
+    # samtools sort的线程数和每线程内存：总内存不超过budget，每线程不少于sort_mem_min
+    def sort_plan(self, threads, budget):
+        threads = max(1, min(threads, self.sort_max_threads, budget // self.sort_mem_min))
+        mem = min(self.sort_mem_max, max(self.sort_mem_min, budget // threads))
+        return threads, mem
+
+    # 为样品i的一个步骤分配资源，files为该步骤同时处理的文件数；create为False时不创建临时目录；
+    # streamed为去接头时原始reads是否由fasterq-dump经管道传入，None时按--front-end判断
+    # 同时运行的命令（fasterq-dump与fastp、bwa与sort）分用样品的线程，合计不超过样品的线程数
+    def allocate(self, stage, i, files=1, create=True, streamed=None):
+        threads = self.sample_threads
+        limit = self.max_threads[stage]
+        if streamed is None:
+            streamed = self.argument.front_end == 'stream'
+        plan = {'threads': min(threads, limit) if limit else threads}
+        if stage == 'dump' and streamed:
+            # fasterq-dump与fastp同时运行且主要受I/O限制，只分四分之一的线程
+            plan['threads'] = min(limit, max(1, threads // 4))
+            plan['compress_threads'] = 0
+        elif stage == 'dump':
+            # fastq-dump是单线程的，线程用于之后的压缩
+            plan['compress_threads'] = plan['threads']
+        elif stage == 'trim':
+            if streamed:
+                # fasterq-dump同时运行，先除去其线程
+                threads = max(1, threads - self.allocate('dump', i, create=False, streamed=True)['threads'])
+            # 同步QC时每个输出文件由一个pigz压缩，压缩用去一半线程，其余给fastp；否则由fastp自己压缩
+            compress = self.argument.qc == 'builtin' and self.argument.fq_codec == 'gzip'
+            plan['compress_threads'] = max(1, threads // (2 * files)) if compress else 0
+            plan['threads'] = min(limit, max(1, threads - plan['compress_threads'] * files))
+        elif stage == 'qc':
+            # fastqc每个文件只用一个线程
+            plan['threads'] = min(threads, files)
+        elif stage == 'align':
+            # 流式比对时sort与bwa同时运行，大部分时间在等待bwa的输出，只分少量线程；内存为除去索引后的剩余
+            index_mem = 0 if self.shared_index else self.index_mem
+            plan['sort_threads'], plan['sort_mem'] = self.sort_plan(max(1, threads // 4), self.sample_mem - index_mem)
+            if self.argument.align_mode != 'legacy':
+                plan['threads'] = max(1, threads - plan['sort_threads'])
+        elif stage == 'index':
+            # legacy模式在此步骤排序，bwa已经结束，全部内存都可用于排序
+            plan['sort_threads'], plan['sort_mem'] = self.sort_plan(threads, self.sample_mem)
+        if 'sort_threads' in plan:
+            plan['tmpdir'] = os.path.join(self.argument.tmpdir, i) if self.argument.tmpdir else f'./{i}'
+        for key, value in self.overrides.get(stage, {}).items():
+            if key == 'sort_mem':
+                value = parse_size(value)
+            elif key == 'tmpdir':
+                value = os.path.join(value, i)
+            else:
+                value = max(1, int(value))
+            plan[key] = value
+        if create and self.create and 'tmpdir' in plan:
+            os.makedirs(plan['tmpdir'], exist_ok=True)
+        return plan
+
+    # 资源规划的说明，每个步骤一行，用于输出和写入日志
+    def describe(self, sample='{sample}'):
+        lines = [f"{self.cores} cores and {gib(self.mem)} memory are available, {self.threads} threads are used. "
+                 f"{self.jobs} samples will be analysed at once with {self.sample_threads} threads and "
+                 f"{gib(self.sample_mem)} memory for each sample."]
+        for stage, plan in self.summary(sample).items():
+            settings = ', '.join(f"{key} {value >> 20}M" if key == 'sort_mem' else f"{key} {value}"
+                                 for key, value in plan.items())
+            lines.append(f"  {stage}: {settings}")
+        return lines + self.notes
+
+    # 写入资源报告的规划结果
+    def report(self):
+        return {'cores': self.cores, 'mem': self.mem, 'threads': self.threads, 'jobs': self.jobs,
+                'sample_threads': self.sample_threads, 'sample_mem': self.sample_mem, 'index_mem': self.index_mem,
+                'shared_index': self.shared_index,
+                'stages': self.summary(), 'notes': self.notes}
+
+    def summary(self, sample='{sample}'):
+        # 以双端样品为例展示
+        return {stage: self.allocate(stage, sample, files=2, create=False) for stage in self.max_threads}
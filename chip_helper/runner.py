@@ -0,0 +1,186 @@
+"""外部命令的运行和输出读取。"""
+import collections
+import os
+import selectors
+import signal
+import subprocess
+import threading
+import time
+
+
+# 正在运行的命令；被终止时按进程组结束这些命令，之后启动的命令立即结束
+running_jobs = set()
+jobs_lock = threading.Lock()
+stopped = threading.Event()
+
+
+# 结束全部正在运行的命令（含管道和后代进程）
+def terminate_jobs(signum=signal.SIGTERM):
+    with jobs_lock:
+        stopped.set()
+        jobs = list(running_jobs)
+    for job in jobs:
+        try:
+            os.killpg(job.proc.pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+# 一组可以单独结束的命令，如队列中的一个任务：结束时只终止该组正在运行的命令，之后该组启动的命令立即结束
+class JobGroup:
+    def __init__(self):
+        self.jobs = set()
+        self.cancelled = threading.Event()
+
+    def cancel(self, signum=signal.SIGTERM):
+        with jobs_lock:
+            self.cancelled.set()
+            jobs = list(self.jobs)
+        for job in jobs:
+            try:
+                os.killpg(job.proc.pid, signum)
+            except ProcessLookupError:
+                pass
+
+
+# 用于运行一条shell命令的类，输出由OutputEngine统一读取，内存中只保留最后若干行用于报错
+class CmdJob:
+    def __init__(self, cmd, sample_log, tail_lines, stdin=subprocess.DEVNULL):
+        self.cmd = cmd
+        self.sample_log = sample_log
+        self.tail = collections.deque(maxlen=tail_lines)
+        self.partial = b''
+        self.eof = threading.Event()
+        self.returncode = None
+        self.wall = 0.0
+        self.usage = None
+        self.error = None  # 处理输出时出现的异常（如日志写入失败），命令结束后由wait抛出
+        self.start_time = time.time()
+        self.proc = subprocess.Popen(
+            ['/bin/bash', '-c', 'set -o pipefail; ' + cmd],  # 使用bash以支持pipefail，管道中任一命令失败都会反映在退出码上
+            stdin=stdin,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,  # 合并标准错误，工具的进度信息大多输出在标准错误
+            cwd='./',
+            start_new_session=True  # 每条命令一个进程组，终止时连同管道中的全部进程一起结束
+        )
+        self.group = sample_log.group
+        with jobs_lock:
+            running_jobs.add(self)
+            if self.group is not None:
+                self.group.jobs.add(self)
+            if stopped.is_set() or (self.group is not None and self.group.cancelled.is_set()):
+                os.killpg(self.proc.pid, signal.SIGTERM)
+        self.fd = self.proc.stdout.fileno()
+        self.progress = sample_log.progress
+        if self.progress is not None:
+            self.progress.add_job(self)
+
+    # 处理读到的一块输出，按换行或回车切分，最后不完整的一行留到下次
+    def feed(self, data):
+        lines = (self.partial + data).replace(b'\r', b'\n').split(b'\n')
+        self.partial = lines.pop()
+        if len(self.partial) > 1 << 20:
+            lines.append(self.partial)
+            self.partial = b''
+        for line in lines:
+            if line:
+                text = line.decode('utf-8', errors='replace')
+                self.tail.append(text)
+                self.sample_log.tool_line(text)
+                if self.progress is not None:
+                    self.progress.parse(text)
+
+    # 处理一块输出；出现异常时记录下来，之后的输出只读取丢弃，使命令仍能正常结束
+    def receive(self, data):
+        if self.error is not None:
+            return
+        try:
+            self.feed(data)
+        except Exception as e:
+            self.error = e
+
+    def finish(self):
+        if self.partial:
+            self.receive(b'\n')
+        self.eof.set()
+
+    # 等待命令结束，通过wait4取得子进程（含其等待过的全部后代进程）的CPU时间和内存峰值
+    def wait(self):
+        self.eof.wait()
+        # 先等待退出但不回收，移出running_jobs后再回收，避免向已被复用的进程号发送信号
+        os.waitid(os.P_PID, self.proc.pid, os.WEXITED | os.WNOWAIT)
+        with jobs_lock:
+            running_jobs.discard(self)
+            if self.group is not None:
+                self.group.jobs.discard(self)
+        _, status, self.usage = os.wait4(self.proc.pid, 0)
+        self.wall = time.time() - self.start_time
+        self.returncode = self.proc.returncode = os.waitstatus_to_exitcode(status)
+        self.proc.stdout.close()
+        if self.error is not None:
+            raise self.error
+        return self.returncode
+
+
+# 用于统一读取所有子进程输出的引擎：单个线程通过selectors同时监听所有正在运行命令的输出管道，
+# 按块读取后交给各自的日志，不再为每条命令启动一个轮询线程
+class OutputEngine(threading.Thread):
+    def __init__(self):
+        super(OutputEngine, self).__init__(daemon=True)
+        self.selector = selectors.DefaultSelector()
+        self.pending = collections.deque()
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_w, False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ, None)
+        self.start_lock = threading.Lock()
+
+    # 提交一条命令的输出，第一次提交时启动引擎线程；同一进程中依次运行的多个流程共用一个引擎
+    def submit(self, job):
+        with self.start_lock:
+            if self.ident is None:
+                self.start()
+        self.pending.append(job)
+        try:
+            os.write(self.wake_w, b'\0')
+        except BlockingIOError:
+            pass  # 唤醒管道已满，引擎线程必然会被唤醒
+
+    def run(self):
+        while True:
+            for key, _ in self.selector.select():
+                if key.data is None:
+                    os.read(self.wake_r, 4096)
+                    while self.pending:
+                        job = self.pending.popleft()
+                        try:
+                            self.selector.register(job.fd, selectors.EVENT_READ, job)
+                        except (OSError, ValueError) as e:
+                            # 无法监听时关闭管道，命令写输出时随之结束
+                            job.error = e
+                            job.proc.stdout.close()
+                            job.eof.set()
+                    continue
+                # 单条命令的输出出错只影响该命令，引擎线程继续为其他命令服务
+                job = key.data
+                try:
+                    data = os.read(key.fd, 1 << 16)
+                except OSError as e:
+                    job.error = job.error or e
+                    data = b''
+                if data:
+                    job.receive(data)
+                else:
+                    self.selector.unregister(key.fd)
+                    job.finish()
+
+
+output_engine = OutputEngine()
+
+
+# 运行一条命令，输出写入该样品的日志，返回运行结束的CmdJob
+def run_cmd(cmd, sample_log):
+    job = CmdJob(cmd, sample_log, sample_log.argument.tail)
+    output_engine.submit(job)
+    job.wait()
+    return job
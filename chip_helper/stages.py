@@ -0,0 +1,471 @@
+"""各分析步骤的描述（Stage）及生成单个样品全部步骤的函数。"""
+import concurrent.futures
+import glob
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import threading
+
+from .registry import fastq_exts
+from .runner import CmdJob, output_engine, run_cmd
+
+
+# 用于描述一个分析步骤的类：命令、输入输出文件、参数与所用工具，缓存据此判断该步骤是否需要重新运行
+class Stage:
+    def __init__(self, name, process, begin_msg, cmds, done_msg, inputs=(), outputs=(), temporary=(),
+                 params=None, tools=(), sources=(), cleanup=(), threads=1, after=None, reads=None):
+        self.name = name
+        self.process = process  # 步骤的简短说明，写入状态文件
+        self.begin_msg = begin_msg
+        self.cmds = list(cmds)
+        self.done_msg = done_msg
+        self.inputs = list(inputs)  # 该步骤读取的文件
+        self.outputs = list(outputs)  # 该步骤生成的文件
+        self.temporary = set(temporary)  # 中间文件，最后一个用到它的步骤完成后删除或压缩，缺失时不视为缓存失效
+        self.params = params or {}  # 影响结果的参数，线程数等不影响结果的参数不计入
+        self.tools = list(tools)
+        self.sources = list(sources)  # 没有对应本地文件的输入，例如直接下载的SRA登录号
+        self.cleanup = list(cleanup)  # 运行前需要清除的中断残留文件（通配符）
+        self.threads = threads  # 该步骤实际使用的线程数，记录在资源报告中
+        self.after = after  # 步骤成功后补充资源报告记录的函数
+        self.reads = reads  # 步骤开始时返回预计处理的read数的函数，用于估算剩余时间
+
+
+# 中间.fastq文件的扩展名
+def fastq_ext(argument):
+    return '.fastq.gz' if argument.fq_codec == 'gzip' else '.fastq'
+
+
+# 查找样品目录下任意扩展名的.fastq文件，不存在时返回None
+def find_fastq(i, suffix):
+    for ext in fastq_exts:
+        if os.path.exists(f'./{i}/{i}{suffix}{ext}'):
+            return f'./{i}/{i}{suffix}{ext}'
+    return None
+
+
+# 去掉.fastq文件的扩展名
+def strip_fastq_ext(f):
+    for ext in sorted(fastq_exts, key=len, reverse=True):
+        if f.endswith(ext):
+            return f[:-len(ext)]
+    return f
+
+
+# 获取单双端测序对应的原始和去接头后的.fastq文件名，已存在的原始文件（例如用户放入的.fq.gz）按原名使用
+def fastq_names(i, layout, argument):
+    path = f'./{i}/'
+    ext = fastq_ext(argument)
+    mates = ['_1', '_2'] if layout == 'paired' else ['']
+    raw = [find_fastq(i, mate) or f'{path}{i}{mate}{ext}' for mate in mates]
+    trimmed = [f'{path}{i}{mate}_n{ext}' for mate in mates]
+    return raw, trimmed
+
+
+# 根据目录下已有的.fastq文件或缓存记录判断是否为双端测序，无法判断时返回None
+def detect_layout(i, cache):
+    if find_fastq(i, '_1') or find_fastq(i, '_1_n'):
+        return 'paired'
+    if find_fastq(i, '') or find_fastq(i, '_n'):
+        return 'single'
+    return cache.data.get('layout')
+
+
+# fasterq-dump和vdb-dump读取的来源：样品目录下的.sra文件，没有时为登录号本身
+def sra_source(i):
+    sra = sorted(glob.glob(f'./{i}/*.sra'))
+    return sra[0] if sra else i
+
+
+# 从SRA元数据判断单双端：READ_TYPE中生物学read（不含barcode等技术read）的个数，读取失败时返回None
+def sra_layout(i):
+    try:
+        out = subprocess.run(['vdb-dump', '-R1', '-C', 'READ_TYPE', sra_source(i)], stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL, text=True, timeout=300).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    for line in out.splitlines():
+        if line.strip().startswith('READ_TYPE'):
+            biological = sum('BIOLOGICAL' in read for read in line.split(':', 1)[1].split(','))
+            return {1: 'single', 2: 'paired'}.get(biological)
+    return None
+
+
+# 生成压缩.fastq文件的命令，有pigz时多线程压缩
+def compress_cmd(files, argument, threads):
+    if shutil.which('pigz'):
+        return f"pigz -f -p {threads} -{argument.fq_level} {' '.join(files)}"
+    return f"gzip -f -{argument.fq_level} {' '.join(files)}"
+
+
+# 生成.sra转.fastq步骤，fastq-dump输出后按设定的格式压缩
+def dump_stage(pipeline, i, raw):
+    argument = pipeline.argument
+    path = f'./{i}/'
+    plan = pipeline.planner.allocate('dump', i, streamed=False)
+    sra = sorted(glob.glob(f'{path}*.sra'))
+    cmds = [f"fastq-dump -split-3 {i} -O {path}"]
+    if argument.fq_codec == 'gzip':
+        # 单双端未知时压缩fastq-dump实际生成的文件
+        dumped = [f[:-len('.gz')] for f in raw] or [f'{path}{i}{mate}.fastq' for mate in ('', '_1', '_2')]
+
+        def compress(slog):
+            files = [f for f in dumped if os.path.exists(f)]
+            return [run_cmd(compress_cmd(files, argument, plan['compress_threads']), slog)] if files else []
+        cmds.append(compress)
+    return Stage('dump', ".fastq files is being created……", "Begin to create .fastq files",
+                 cmds, "All .sra files are converted to .fastq files.",
+                 inputs=sra, outputs=raw, temporary=raw, tools=['fastq-dump'], sources=[] if sra else [i],
+                 params={'codec': argument.fq_codec, 'level': argument.fq_level}, threads=plan['threads'])
+
+
+# 从.fastq文件开头抽样计算平均标题行长度
+def fastq_header_length(f, records=1000):
+    header_len = []
+    try:
+        with (gzip.open if f.endswith('.gz') else open)(f, 'rt') as fq:
+            for n, line in enumerate(fq):
+                if n % 4 == 0:
+                    header_len.append(len(line))
+                if n >= records * 4:
+                    break
+    except (OSError, EOFError):
+        return None
+    return sum(header_len) / len(header_len) if header_len else None
+
+
+# 估算.fastq文件解压后的大小：每条read为标题行、序列行和质量行（碱基数加换行）以及"+"行
+def fastq_plain_size(stats, header_len):
+    return int(stats['total_bases'] * 2 + stats['total_reads'] * (header_len + 4))
+
+
+# 从fastp报告中读取去接头后的read数，作为比对步骤预计处理的read数
+def fastp_reads(fastp_json):
+    def reads():
+        try:
+            with open(fastp_json, encoding="utf-8") as f:
+                return json.load(f)['summary']['after_filtering']['total_reads']
+        except (OSError, ValueError, KeyError):
+            return None
+    return reads
+
+
+# 去接头步骤成功后，按fastp报告中的碱基数和read数估算原始和去接头后.fastq文件压缩节省的字节数
+# streamed为True时原始reads直接经管道传给fastp，从未写入磁盘，其解压后的大小全部计为节省
+def trim_compression(trimmed, fastp_json, streamed=False):
+    def after(record):
+        try:
+            with open(fastp_json, encoding="utf-8") as f:
+                summary = json.load(f)['summary']
+        except (OSError, ValueError, KeyError):
+            return
+        # 原始文件已被删除，标题行长度以去接头后的文件代替
+        header_len = fastq_header_length(trimmed[0])
+        if header_len is None:
+            return
+        plain_in = fastq_plain_size(summary['before_filtering'], header_len)
+        plain_out = fastq_plain_size(summary['after_filtering'], header_len)
+        record['uncompressed_bytes'] = plain_out
+        record['bytes_saved'] = plain_out - record['output_bytes'] + plain_in - (0 if streamed else record['input_bytes'])
+    return after
+
+
+# 生成比对阶段的步骤：stream模式下bwa输出直接经管道排序为.sort.bam，不再落地.sam和未排序的.bam
+def align_stages(pipeline, i, group, trimmed):
+    argument = pipeline.argument
+    reference = pipeline.reference
+    path = f'./{i}/'
+    plan = pipeline.planner.allocate('align', i)
+    index_plan = pipeline.planner.allocate('index', i)
+    bwa_cmd = rf'bwa mem -t {plan["threads"]} -M -R "@RG\tID:{group}\tLB:{group}\tPL:ILLUMINA\tSM:{group}" ' \
+              rf'{argument.r} {" ".join(trimmed)}'
+    params = {'ref': os.path.abspath(argument.r), 'group': group, 'mode': argument.align_mode,
+              'markdup': argument.markdup}
+    inputs = trimmed + [f'{argument.r}.bwt']
+    if argument.align_mode == 'legacy':
+        sort_tmp = os.path.join(index_plan['tmpdir'], f'{i}.sort.tmp')
+        return [
+            Stage('align', "genome mapping……", "Begin to genome map.",
+                  [reference.load, f"{bwa_cmd} > {path}{i}.sam",
+                   f"samtools view -@ {index_plan['threads']} -bS {path}{i}.sam > {path}{i}.bam"],
+                  f"Genome is mapped. {i}.bam is created.",
+                  inputs=inputs, outputs=[f'{path}{i}.sam', f'{path}{i}.bam'],
+                  temporary=[f'{path}{i}.sam', f'{path}{i}.bam'],
+                  params=params, tools=['bwa', 'samtools'], threads=plan['threads'],
+                  reads=fastp_reads(f'{path}{i}_fastp.json')),
+            Stage('index', 'indexing……', "Begin to index .bam file.",
+                  [f"samtools sort -@ {index_plan['sort_threads']} -m {index_plan['sort_mem'] >> 20}M "
+                   f"-T {sort_tmp} {path}{i}.bam -o {path}{i}.sort.bam",
+                   f"samtools index -@ {index_plan['threads']} {path}{i}.sort.bam"],
+                  f".bam file is indexed. {i}.sort.bam and {i}.sort.bam.bai are created.",
+                  inputs=[f'{path}{i}.bam'], outputs=[f'{path}{i}.sort.bam', f'{path}{i}.sort.bam.bai'],
+                  tools=['samtools'], cleanup=[f'{sort_tmp}.*'],
+                  threads=max(index_plan['sort_threads'], index_plan['threads'])),
+        ]
+    sort_tmp = os.path.join(plan['tmpdir'], f'{i}.sort.tmp')
+    sort_cmd = f"samtools sort -@ {plan['sort_threads']} -m {plan['sort_mem'] >> 20}M -T {sort_tmp}"
+    if argument.markdup:
+        # fixmate需要按read名分组的输入，bwa的输出正好满足；markdup需要fixmate -m添加的ms/MC标签
+        cmd = f"{bwa_cmd} | samtools fixmate -m -@ {plan['sort_threads']} - - | {sort_cmd} - " \
+              f"| samtools markdup -@ {plan['sort_threads']} - {path}{i}.sort.bam"
+    else:
+        cmd = f"{bwa_cmd} | {sort_cmd} -o {path}{i}.sort.bam -"
+    return [
+        Stage('align', "genome mapping……", "Begin to genome map and sort.", [reference.load, cmd],
+              f"Genome is mapped. {i}.sort.bam is created.",
+              inputs=inputs, outputs=[f'{path}{i}.sort.bam'], params=params, tools=['bwa', 'samtools'],
+              cleanup=[f'{sort_tmp}.*'], threads=plan['threads'] + plan['sort_threads'],
+              reads=fastp_reads(f'{path}{i}_fastp.json')),
+        Stage('index', 'indexing……', "Begin to index .bam file.",
+              [f"samtools index -@ {index_plan['threads']} {path}{i}.sort.bam"],
+              f".bam file is indexed. {i}.sort.bam.bai is created.",
+              inputs=[f'{path}{i}.sort.bam'], outputs=[f'{path}{i}.sort.bam.bai'], tools=['samtools'],
+              threads=index_plan['threads']),
+    ]
+
+
+# deepTools对hs使用的有效基因组大小，RPGC标准化时使用
+effective_genome_size = 2913022398
+
+
+# 读取.bam文件各染色体的长度和比对上的read数
+def bam_chromosomes(bam):
+    out = subprocess.run(['samtools', 'idxstats', bam], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                         text=True).stdout
+    chroms = []
+    for line in out.splitlines():
+        fields = line.split('\t')
+        if len(fields) >= 3 and fields[0] != '*':
+            chroms.append((fields[0], int(fields[1]), int(fields[2])))
+    return chroms
+
+
+# 写出bedGraphToBigWig需要的染色体长度文件
+def write_chrom_sizes(chroms, path):
+    with open(path, 'w', encoding="utf-8") as f:
+        for name, length, _ in chroms:
+            f.write(f"{name}\t{length}\n")
+
+
+# 把bedGraph转为bigWig的命令：去掉超出染色体末端的区间（可选去除黑名单区域），按bedGraphToBigWig要求的顺序排序
+def bedgraph_to_bigwig_cmd(bdg, sizes, bw, blacklist=None):
+    clip = "awk -v OFS='\\t' 'NR==FNR{len[$1]=$2;next} ($1 in len) && $2<len[$1] " \
+           "{if($3>len[$1])$3=len[$1]; print}' " + f"{sizes} {bdg}"
+    if blacklist:
+        clip += f" | bedtools subtract -a - -b {blacklist}"
+    return f"{clip} | LC_ALL=C sort -k1,1 -k2,2n > {bw}.sorted.bdg && bedGraphToBigWig {bw}.sorted.bdg {sizes} {bw}"
+
+
+# 生成覆盖度.bw文件的步骤函数：按染色体并行运行bamCoverage输出bedGraph，缩放系数按全部染色体统一计算，
+# 再合并转换为一个.bw文件；BPM、RPGC需要全基因组的统计，没有bedGraphToBigWig（UCSC工具，不属于deeptools）时也
+# 由单个bamCoverage多进程完成
+def coverage_tracks(bam, bw, argument, threads):
+    options = f'-bs {argument.bin_size}' + (f' -bl {argument.blacklist}' if argument.blacklist else '')
+
+    def step(slog):
+        chroms = [chrom for chrom in bam_chromosomes(bam) if chrom[2] > 0]
+        if argument.normalize in ('BPM', 'RPGC') or threads < 2 or len(chroms) < 2 or \
+                not shutil.which('bedGraphToBigWig'):
+            normalize = '' if argument.normalize == 'none' else f' --normalizeUsing {argument.normalize}'
+            if argument.normalize == 'RPGC':
+                normalize += f' --effectiveGenomeSize {effective_genome_size}'
+            return [run_cmd(f'bamCoverage -p {threads} -v -b {bam} -o {bw} {options}{normalize}', slog)]
+        mapped = sum(chrom[2] for chrom in chroms)
+        scale = {'none': 1, 'CPM': 1e6 / mapped, 'RPKM': 1e9 / (mapped * argument.bin_size)}[argument.normalize]
+        # bedGraphToBigWig要求染色体按名称的字节序排列
+        parts = [(name, f'{bw}.{n}.bdg') for n, (name, _, _) in enumerate(sorted(chroms))]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+            jobs = list(pool.map(lambda part: run_cmd(
+                f'bamCoverage -p 1 -b {bam} -r {part[0]} -of bedgraph --scaleFactor {scale:.6g} {options} '
+                f'-o {part[1]}', slog), parts))
+        if all(job.returncode == 0 for job in jobs):
+            write_chrom_sizes(chroms, f'{bw}.sizes')
+            jobs.append(run_cmd(f"cat {' '.join(part for _, part in parts)} > {bw}.bdg && "
+                                f"bedGraphToBigWig {bw}.bdg {bw}.sizes {bw}", slog))
+        for f in [part for _, part in parts] + [f'{bw}.bdg', f'{bw}.sizes']:
+            if os.path.exists(f):
+                os.remove(f)
+        return jobs
+    return step
+
+
+# 由macs2的pileup生成组合的.bw文件：处理组pileup、对照lambda，以及可选的富集倍数（FE）轨迹，几个转换同时进行
+def pileup_tracks(bam, bdgs, fe, argument):
+    def step(slog):
+        sizes = f'{os.path.dirname(bdgs[0][1])}/chrom.sizes'
+        write_chrom_sizes(bam_chromosomes(bam), sizes)
+        jobs = []
+        if fe is not None:
+            treat, control, fe_bdg = fe
+            jobs.append(run_cmd(f'macs2 bdgcmp -t {treat} -c {control} -m FE -o {fe_bdg}', slog))
+            if jobs[-1].returncode != 0:
+                return jobs
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(bdgs)) as pool:
+            jobs += list(pool.map(lambda pair: run_cmd(
+                bedgraph_to_bigwig_cmd(pair[0], sizes, pair[1], argument.blacklist), slog), bdgs))
+        for f in [f'{bw}.sorted.bdg' for _, bw in bdgs] + [sizes]:
+            if os.path.exists(f):
+                os.remove(f)
+        return jobs
+    return step
+
+
+# 生成去接头并同步QC的步骤：fastp输出到命名管道，读取线程统计QC后写入（或经pigz压缩写入）最终文件
+def trim_with_qc(i, fastp_cmd, trimmed, argument, compress_threads):
+    path = f'./{i}/'
+
+    def step(slog):
+        from .qc import FastqQC, tee_fifo, write_sample_qc
+        fifos = [strip_fastq_ext(f) + '.fifo' for f in trimmed]
+        qcs = [FastqQC(os.path.basename(strip_fastq_ext(f))) for f in trimmed]
+        if slog.progress is not None:
+            slog.progress.counters.append(lambda: sum(qc.reads for qc in qcs))
+        compressors, writers, holders, readers, errors = [], [], [], [], []
+        # 无论fastp是否正常结束（包括写日志出错、被终止时抛出异常），都关闭管道、等待压缩进程并删除命名管道
+        try:
+            for fifo, out, qc in zip(fifos, trimmed, qcs):
+                if os.path.exists(fifo):
+                    os.remove(fifo)
+                if argument.fq_codec == 'gzip':
+                    job = CmdJob(f"{compress_cmd([], argument, compress_threads)} -c > {out}", slog, argument.tail,
+                                 stdin=subprocess.PIPE)
+                    output_engine.submit(job)
+                    compressors.append(job)
+                    writer = job.proc.stdin
+                else:
+                    writer = open(out, 'wb')
+                writers.append(writer)
+                os.mkfifo(fifo)
+                # 以非阻塞方式打开读端，再自己占住一个写端，fastp打开和关闭写端前读端都不会读到结束
+                fd = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+                try:
+                    holders.append(os.open(fifo, os.O_WRONLY))
+                    os.set_blocking(fd, True)
+                except OSError:
+                    os.close(fd)
+                    raise
+                reader = threading.Thread(target=tee_fifo, args=(fd, writer, qc, errors), daemon=True)
+                reader.start()
+                readers.append(reader)
+            fastp_job = run_cmd(fastp_cmd.format(*fifos), slog)
+        finally:
+            for fd in holders:
+                os.close(fd)
+            for reader in readers:
+                reader.join()
+            for writer in writers:
+                try:
+                    writer.close()
+                except OSError as e:
+                    errors.append(f"closing {writer} failed: {e}")
+            for job in compressors:
+                try:
+                    job.wait()
+                except Exception as e:
+                    errors.append(f"`{job.cmd}` failed: {e!r}")
+            for fifo in fifos:
+                if os.path.exists(fifo):
+                    os.remove(fifo)
+        jobs = [fastp_job] + compressors
+        if errors:
+            failed = next((job for job in compressors if job.returncode != 0), fastp_job)
+            failed.tail.extend(errors)
+            failed.returncode = failed.returncode or 1
+        elif fastp_job.returncode == 0:
+            write_sample_qc(i, [qc.summary() for qc in qcs], f'{path}{i}_fastp.json', f'{path}{i}_qc.json',
+                            f'{path}{i}_qc.html')
+        return jobs
+    return step
+
+
+# fasterq-dump的临时目录：运行前清除上次中断留下的临时文件并重新创建，remove为True时（步骤成功后）只删除
+def scratch_dir(scratch, remove=False):
+    def step(slog):
+        shutil.rmtree(scratch, ignore_errors=True)
+        if not remove:
+            os.makedirs(scratch)
+        return []
+    return step
+
+
+# 生成单个样品的全部步骤。source为原始reads的来源：fastq为用户提供的.fastq文件，作为原始输入且不会被删除；
+# dump为fastq-dump先转换出.fastq文件；stream为fasterq-dump输出经管道直接传给fastp，原始reads不落地
+def sample_stages(pipeline, i, layout, source):
+    argument = pipeline.argument
+    planner = pipeline.planner
+    path = f'./{i}/'
+    group = pipeline.registry.samples[i]["group"]
+    raw, trimmed = fastq_names(i, layout, argument)
+    with_dump = source == 'dump'
+    streamed = source == 'stream'
+    sra = sorted(glob.glob(f'{path}*.sra'))
+    # builtin模式下fastp输出到命名管道（{0}、{1}），由读取线程统计QC并压缩，不再另外运行fastqc
+    builtin_qc = argument.qc == 'builtin'
+    plan = planner.allocate('trim', i, len(trimmed), streamed=streamed)
+    fastp_threads, compress_threads = plan['threads'], plan['compress_threads']
+    outputs = ['{0}', '{1}'] if builtin_qc else trimmed
+    if streamed:
+        # --split-spot与--stdout一起使用时双端的两条read依次输出，fastp按交错格式读取
+        inputs = '--stdin --interleaved_in' if layout == 'paired' else '--stdin'
+    elif layout == 'paired':
+        inputs = f'-i {raw[0]} -I {raw[1]}'
+    else:
+        inputs = f'-i {raw[0]}'
+    if layout == 'paired':
+        fastp_cmd = f'fastp {inputs} -o {outputs[0]} -O {outputs[1]}'
+    else:
+        fastp_cmd = f'fastp {inputs} -o {outputs[0]}'
+    fastp_cmd += f' -w {fastp_threads} -j {path}{i}_fastp.json -h {path}{i}_fastp.html'
+    if argument.fq_codec == 'gzip' and not builtin_qc:
+        fastp_cmd += f' -z {argument.fq_level}'
+    dump_threads = 0
+    scratch = None
+    if streamed:
+        # fasterq-dump的临时文件写入本地的--scratch目录，不经过共享文件系统
+        dump_threads = planner.allocate('dump', i, streamed=True)['threads']
+        scratch = os.path.join(argument.scratch, i)
+        fastp_cmd = f'fasterq-dump --split-spot --stdout --threads {dump_threads} -t {scratch} {sra_source(i)} ' \
+                    f'| {fastp_cmd}'
+    if builtin_qc:
+        trim_cmd = trim_with_qc(i, fastp_cmd, trimmed, argument, compress_threads)
+        trim_outputs = trimmed + [f'{path}{i}_qc.json', f'{path}{i}_qc.html']
+    else:
+        trim_cmd = fastp_cmd
+        trim_outputs = trimmed
+    stages = [dump_stage(pipeline, i, raw)] if with_dump else []
+    trim_cmds = [scratch_dir(scratch), trim_cmd, scratch_dir(scratch, remove=True)] if streamed else [trim_cmd]
+    stages.append(
+        Stage('trim', "adapter trimming……", "adapter trimming",
+              trim_cmds,
+              "All .fastq files are trimmed adapter." + (" Quality control is completed." if builtin_qc else ""),
+              inputs=sra if streamed else raw, outputs=trim_outputs, temporary=trimmed,
+              tools=['fasterq-dump', 'fastp'] if streamed else ['fastp'],
+              sources=[i] if streamed and not sra else [],
+              threads=dump_threads + fastp_threads + compress_threads * len(trimmed),
+              params={'codec': argument.fq_codec, 'level': argument.fq_level, 'qc': argument.qc, 'source': source},
+              after=trim_compression(trimmed, f'{path}{i}_fastp.json', streamed)))
+    if not builtin_qc:
+        qc_plan = planner.allocate('qc', i, len(trimmed))
+        qc_outputs = [strip_fastq_ext(f) + suffix for f in trimmed for suffix in ('_fastqc.html', '_fastqc.zip')]
+        stages.append(
+            Stage('qc', "quality controling……", "Begin to quality control.",
+                  [f"fastqc -t {qc_plan['threads']} {' '.join(trimmed)}"], "quality control is completed.",
+                  inputs=trimmed, outputs=qc_outputs, tools=['fastqc'], threads=qc_plan['threads']))
+    stages += align_stages(pipeline, i, group, trimmed)
+    if argument.tracks == 'bamcoverage':
+        # pileup模式下不再扫描.bam，轨迹在call peak后由macs2的pileup生成
+        bigwig_plan = planner.allocate('bigwig', i)
+        bw = f'{path}{group}_{i}.sort.bam.bw'
+        bigwig_tools = ['bamCoverage'] + (['bedGraphToBigWig'] if shutil.which('bedGraphToBigWig') else [])
+        stages.append(
+            Stage('bigwig', 'creating .bw files……', "Begin to create .bw files.",
+                  [coverage_tracks(f'{path}{i}.sort.bam', bw, argument, bigwig_plan['threads'])],
+                  f'.bw file is created. {group}_{i}.sort.bam.bw is created.',
+                  inputs=[f'{path}{i}.sort.bam', f'{path}{i}.sort.bam.bai'] + ([argument.blacklist]
+                                                                               if argument.blacklist else []),
+                  outputs=[bw], tools=bigwig_tools, threads=bigwig_plan['threads'],
+                  params={'bin_size': argument.bin_size, 'normalize': argument.normalize},
+                  cleanup=[f'{bw}.*.bdg']))
+    return stages
@@ -0,0 +1,309 @@
+"""运行中步骤的进度遥测：状态文件、Prometheus文本文件和终端单行进度。"""
+import collections
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+
+from .console import human, human_time, status_line
+from .utils import files_size
+
+
+# 从工具输出中识别已处理read数的规则：(正则, 是否累加)。bwa每批输出一次本批的read数，fastq-dump结束时输出总数
+progress_patterns = [
+    (re.compile(r'\[M::mem_process_seqs\] Processed (\d+) reads'), True),
+    (re.compile(r'^Read (\d+) spots for'), False),
+]
+
+
+# 读取进程的状态和父进程号，进程已结束时返回None
+def proc_stat(pid):
+    try:
+        with open(f'/proc/{pid}/stat', encoding="utf-8") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    fields = stat[stat.rindex(')') + 2:].split()
+    return fields[0], int(fields[1])
+
+
+# 读取进程累计读写的字节数（含管道），没有权限或进程已结束时返回None
+def proc_io(pid):
+    try:
+        with open(f'/proc/{pid}/io', encoding="utf-8") as f:
+            io = dict(line.split(': ') for line in f.read().splitlines())
+        return int(io['rchar']), int(io['wchar'])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+# 读取整机的CPU时间，用于计算I/O等待所占的比例
+def cpu_times():
+    try:
+        with open('/proc/stat', encoding="utf-8") as f:
+            values = [int(v) for v in f.readline().split()[1:]]
+        return sum(values), values[4]
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# 一个正在运行的步骤的进度：read数来自工具输出或QC统计，读写字节数来自其进程树的/proc/<pid>/io
+class StageProgress:
+    def __init__(self, sample, stage):
+        self.sample = sample
+        self.stage = stage.name
+        self.description = stage.process
+        self.outputs = stage.outputs
+        self.input_bytes = files_size(stage.inputs)
+        self.expected_reads = stage.reads() if stage.reads is not None else None
+        self.start = time.time()
+        self.lock = threading.Lock()
+        self.jobs = []
+        self.counters = []  # 返回已处理read数的函数，例如内置QC的统计
+        self.parsed_reads = 0
+        self.io_last = {}  # pid: (rchar, wchar)，进程结束后其读写量仍保留在累计值中
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self.output_bytes = 0
+        self.io_wait = 0
+        self.rates = {'reads': 0.0, 'read_bytes': 0.0, 'write_bytes': 0.0, 'output_bytes': 0.0}
+        self.last_sample = None
+        self.last_change = self.start
+
+    def add_job(self, job):
+        with self.lock:
+            self.jobs.append(job)
+
+    # 解析一行工具输出中的read数
+    def parse(self, text):
+        for pattern, accumulate in progress_patterns:
+            match = pattern.search(text)
+            if match:
+                with self.lock:
+                    self.parsed_reads = self.parsed_reads + int(match.group(1)) if accumulate else int(match.group(1))
+                return
+
+    def reads(self):
+        counted = sum(counter() for counter in self.counters)
+        return max(counted, self.parsed_reads)
+
+    # 采样一次：更新累计读写量并按与上次采样的差计算速率
+    def sample_once(self, tree, now):
+        with self.lock:
+            roots = [job.proc.pid for job in self.jobs if job.returncode is None]
+        pids = self.descendants(roots, tree)
+        for pid in pids:
+            io = proc_io(pid)
+            if io is None:
+                continue
+            last = self.io_last.get(pid, (0, 0))
+            self.read_bytes += max(0, io[0] - last[0])
+            self.write_bytes += max(0, io[1] - last[1])
+            self.io_last[pid] = io
+        self.io_wait = sum(1 for state in pids.values() if state == 'D')
+        self.output_bytes = files_size(self.outputs)
+        current = {'reads': self.reads(), 'read_bytes': self.read_bytes, 'write_bytes': self.write_bytes,
+                   'output_bytes': self.output_bytes}
+        if self.last_sample is not None:
+            last_time, last = self.last_sample
+            elapsed = max(now - last_time, 1e-6)
+            self.rates = {key: max(0.0, (current[key] - last[key]) / elapsed) for key in current}
+            if current != last:
+                self.last_change = now
+        self.last_sample = (now, current)
+        return current
+
+    # 从tree（{pid: (状态, 父进程号)}）中找出roots及其全部后代进程，返回{pid: 状态}
+    @staticmethod
+    def descendants(roots, tree):
+        children = collections.defaultdict(list)
+        for pid, (_, ppid) in tree.items():
+            children[ppid].append(pid)
+        found = {}
+        stack = [pid for pid in roots if pid in tree]
+        while stack:
+            pid = stack.pop()
+            if pid not in found:
+                found[pid] = tree[pid][0]
+                stack.extend(children[pid])
+        return found
+
+    # 剩余时间：已知总read数时按read速率估算，否则按读取输入文件的进度估算
+    def eta(self, reads):
+        if self.expected_reads and self.rates['reads'] > 0:
+            return max(0.0, (self.expected_reads - reads) / self.rates['reads'])
+        if self.input_bytes and self.rates['read_bytes'] > 0 and self.read_bytes < self.input_bytes:
+            return (self.input_bytes - self.read_bytes) / self.rates['read_bytes']
+        return None
+
+    def status(self, now, stall_after):
+        reads = self.last_sample[1]['reads'] if self.last_sample else 0
+        eta = self.eta(reads)
+        if self.expected_reads:
+            progress = min(1.0, reads / self.expected_reads)
+        elif self.input_bytes:
+            progress = min(1.0, self.read_bytes / self.input_bytes)
+        else:
+            progress = None
+        idle = now - self.last_change
+        return {'sample': self.sample, 'stage': self.stage, 'description': self.description,
+                'elapsed_sec': round(now - self.start, 1), 'reads': reads, 'expected_reads': self.expected_reads,
+                'reads_per_sec': round(self.rates['reads'], 1), 'read_bytes': self.read_bytes,
+                'read_bytes_per_sec': round(self.rates['read_bytes']), 'write_bytes': self.write_bytes,
+                'write_bytes_per_sec': round(self.rates['write_bytes']), 'input_bytes': self.input_bytes,
+                'output_bytes': self.output_bytes, 'output_bytes_per_sec': round(self.rates['output_bytes']),
+                'progress': None if progress is None else round(progress, 4),
+                'eta_sec': None if eta is None else round(eta), 'io_wait_processes': self.io_wait,
+                'idle_sec': round(idle, 1), 'stalled': idle >= stall_after}
+
+
+# 进度遥测：定期采样所有正在运行的步骤，写出JSON状态文件和Prometheus文本文件（供node exporter的textfile
+# collector抓取），可选在终端显示单行进度
+class Telemetry(threading.Thread):
+    metrics = [
+        ('elapsed_sec', 'chip_stage_elapsed_seconds', 'Seconds since the stage started.'),
+        ('reads', 'chip_stage_reads', 'Reads processed by the stage so far.'),
+        ('reads_per_sec', 'chip_stage_reads_per_second', 'Reads processed per second.'),
+        ('read_bytes_per_sec', 'chip_stage_read_bytes_per_second', 'Bytes read per second by the stage processes.'),
+        ('write_bytes_per_sec', 'chip_stage_write_bytes_per_second',
+         'Bytes written per second by the stage processes.'),
+        ('output_bytes', 'chip_stage_output_bytes', 'Current size of the stage output files.'),
+        ('progress', 'chip_stage_progress_ratio', 'Estimated fraction of the stage that is done.'),
+        ('eta_sec', 'chip_stage_eta_seconds', 'Estimated seconds until the stage is done.'),
+        ('io_wait_processes', 'chip_stage_io_wait_processes',
+         'Stage processes in uninterruptible (I/O) sleep.'),
+        ('idle_sec', 'chip_stage_idle_seconds', 'Seconds since the stage last made any progress.'),
+        ('stalled', 'chip_stage_stalled', 'Whether the stage made no progress for longer than --stall-after.'),
+    ]
+
+    def __init__(self, argument, directory, log, name=None):
+        super(Telemetry, self).__init__(daemon=True)
+        self.argument = argument
+        self.log = log
+        self.interval = argument.status_interval
+        self.json_path = os.path.join(directory, 'status.json')
+        self.prom_path = os.path.join(argument.metrics_dir or directory, f'chip_helper_{name or argument.n}.prom')
+        self.tty = argument.progress and sys.stdout.isatty()
+        self.host = os.uname().nodename
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+        self.active = {}
+        self.samples = {'total': 0, 'done': 0, 'failed': 0}
+        self.state = 'running'
+        self.cpu_last = cpu_times()
+        self.iowait = 0.0
+        self.stopped = threading.Event()
+
+    def begin(self, sample, stage):
+        progress = StageProgress(sample, stage)
+        with self.lock:
+            self.active[(sample, stage.name)] = progress
+        return progress
+
+    def end(self, progress):
+        with self.lock:
+            self.active.pop((progress.sample, progress.stage), None)
+
+    def sample_total(self, total):
+        self.samples['total'] = total
+
+    def sample_done(self, success):
+        with self.lock:
+            self.samples['done' if success else 'failed'] += 1
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.tick()
+
+    def stop(self, state='finished'):
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        self.state = state
+        self.tick()
+        if self.tty:
+            status_line('')
+
+    # 采样一次并写出状态文件
+    def tick(self):
+        now = time.time()
+        with self.lock:
+            active = list(self.active.values())
+        tree = {}
+        if active:
+            for entry in os.listdir('/proc'):
+                if entry.isdigit():
+                    stat = proc_stat(entry)
+                    if stat is not None:
+                        tree[int(entry)] = stat
+        stages = []
+        for progress in active:
+            progress.sample_once(tree, now)
+            stages.append(progress.status(now, self.argument.stall_after))
+        cpu = cpu_times()
+        if cpu is not None and self.cpu_last is not None and cpu[0] > self.cpu_last[0]:
+            self.iowait = (cpu[1] - self.cpu_last[1]) / (cpu[0] - self.cpu_last[0])
+        self.cpu_last = cpu
+        with self.lock:
+            samples = dict(self.samples, running=len({stage['sample'] for stage in stages}))
+        status = {'run': self.argument.n, 'host': self.host, 'pid': os.getpid(), 'state': self.state,
+                  'started': round(self.start_time, 3), 'updated': round(now, 3), 'samples': samples,
+                  'node': {'iowait_ratio': round(self.iowait, 4), 'load1': os.getloadavg()[0]}, 'stages': stages}
+        try:
+            self.write(self.json_path, json.dumps(status, indent=1))
+            self.write(self.prom_path, self.prometheus(status))
+        except OSError as e:
+            self.log.write(f"! Writing status files failed: {e} !\n")
+        if self.tty and self.state == 'running':
+            status_line(self.line(status))
+
+    @staticmethod
+    def write(path, text):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path + '.tmp', 'w', encoding="utf-8") as f:
+            f.write(text)
+        os.replace(path + '.tmp', path)
+
+    def prometheus(self, status):
+        def labels(**values):
+            escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values.values())
+            return '{' + ','.join(f'{k}="{v}"' for k, v in zip(values, escaped)) + '}'
+
+        run = dict(run=self.argument.n, host=self.host)
+        lines = ['# HELP chip_run_last_update_timestamp_seconds Time the status was last written.',
+                 '# TYPE chip_run_last_update_timestamp_seconds gauge',
+                 f'chip_run_last_update_timestamp_seconds{labels(**run)} {status["updated"]}',
+                 '# HELP chip_run_running Whether the run is still in progress.',
+                 '# TYPE chip_run_running gauge',
+                 f'chip_run_running{labels(**run)} {int(status["state"] == "running")}',
+                 '# HELP chip_run_samples Samples of the run by state.',
+                 '# TYPE chip_run_samples gauge']
+        lines += [f'chip_run_samples{labels(**run, state=state)} {count}' for state, count in status['samples'].items()]
+        lines += ['# HELP chip_node_iowait_ratio Fraction of CPU time the node spent waiting for I/O.',
+                  '# TYPE chip_node_iowait_ratio gauge',
+                  f'chip_node_iowait_ratio{labels(**run)} {status["node"]["iowait_ratio"]}']
+        for key, name, help_text in self.metrics:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+            for stage in status['stages']:
+                if stage[key] is not None:
+                    lines.append(f'{name}{labels(**run, sample=stage["sample"], stage=stage["stage"])} '
+                                 f'{int(stage[key]) if isinstance(stage[key], bool) else stage[key]}')
+        return '\n'.join(lines) + '\n'
+
+    # 单行进度：每个正在运行的步骤显示read速率或读取速率及剩余时间
+    def line(self, status):
+        parts = []
+        for stage in status['stages']:
+            rate = (human(stage['reads_per_sec'], ' reads/s') if stage['reads_per_sec']
+                    else human(stage['read_bytes_per_sec'], 'B/s'))
+            eta = f" ETA {human_time(stage['eta_sec'])}" if stage['eta_sec'] is not None else ''
+            stalled = ' STALLED' if stage['stalled'] else ''
+            parts.append(f"{stage['sample']} {stage['stage']} {rate}{eta}{stalled}")
+        samples = status['samples']
+        parts.append(f"{samples['done'] + samples['failed']}/{samples['total']} samples")
+        width = shutil.get_terminal_size().columns - 1
+        text = ' | '.join(parts)
+        return text if len(text) <= width else text[:max(0, width - 1)] + '…'
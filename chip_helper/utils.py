@@ -0,0 +1,26 @@
+"""文件大小、内存大小和时间段的工具函数。"""
+import os
+
+
+# 计算一组文件的总大小，不存在的文件不计
+def files_size(files):
+    return sum(os.path.getsize(f) for f in files if os.path.exists(f))
+
+
+# 解析"32G"、"512M"这样的内存大小，返回字节数
+def parse_size(text):
+    units = {'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30, 't': 1 << 40}
+    text = str(text).strip().lower().rstrip('b')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(float(text))
+
+
+# 以GiB表示内存大小，用于输出
+def gib(size):
+    return f"{size / (1 << 30):.1f} GiB"
+
+
+# 计算时间段列表与[begin, end]区间重叠的总时长
+def overlap_time(spans, begin, end):
+    return sum(max(0.0, min(stop, end) - max(start, begin)) for start, stop in spans)
@@ -0,0 +1,269 @@
+"""多个chip.py进程（可以在不同节点上）通过共享文件系统上的队列目录协作分析同一个样品表。
+
+队列目录的结构：
+    queue.json               任务列表，由第一个进程写入，其余进程核对是否为同一个样品表
+    claims/<任务>.<次数>      认领文件，以O_EXCL创建，持有者定期更新其修改时间作为心跳
+    done/<任务>.json          任务结果，由第一个完成者写入，之后不再改变
+    workers/<进程>.json       各进程的信息和心跳；workers/<进程>/下为该进程的日志、状态文件和资源报告
+
+认领文件超过租约时间没有心跳时，其他进程以下一个次数重新认领该任务，超过max_attempts次的任务记为失败。
+判断是否过期时比较的是文件服务器记录的修改时间，不受各节点时钟差异的影响。
+"""
+import json
+import os
+import socket
+import threading
+import time
+
+from .console import echo
+from .runner import JobGroup
+
+
+# 本进程在队列中的名称
+def worker_name():
+    return f'{socket.gethostname()}.{os.getpid()}'
+
+
+# 由样品和组合生成任务列表：样品分析、每个用到的样品的filterdup、每个组合的call peak，最后汇总结果
+def plan_tasks(samples, contrasts):
+    tasks = [{'id': f'sample:{i}', 'kind': 'sample', 'sample': i, 'deps': []} for i in samples]
+    used = {}
+    for contrast in contrasts:
+        used.setdefault(contrast['ctrl'])
+        used.setdefault(contrast['test'])
+    tasks += [{'id': f'filterdup:{i}', 'kind': 'filterdup', 'sample': i, 'deps': [f'sample:{i}']}
+              for i in used if i in samples]
+    tasks += [{'id': f"peak:{contrast['label']}", 'kind': 'peak', 'contrast': contrast,
+               'deps': [f"filterdup:{contrast['ctrl']}", f"filterdup:{contrast['test']}"]}
+              for contrast in contrasts if contrast['ctrl'] in samples and contrast['test'] in samples]
+    tasks.append({'id': 'gather', 'kind': 'gather', 'deps': [task['id'] for task in tasks]})
+    return tasks
+
+
+# 原子地写出一个文件：先写入临时文件，再以硬链接发布，目标已存在时返回False
+def publish(path, data):
+    tmp = f'{path}.{worker_name()}.tmp'
+    with open(tmp, 'w', encoding="utf-8") as f:
+        json.dump(data, f, indent=1)
+    try:
+        os.link(tmp, path)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(tmp)
+
+
+# 共享文件系统上的任务队列
+class WorkQueue:
+    max_attempts = 3  # 同一任务因租约过期被重新认领的次数上限
+
+    def __init__(self, directory, lease):
+        self.directory = directory
+        self.lease = lease
+        self.poll = max(1.0, min(10.0, lease / 6))  # 没有可认领的任务时的等待间隔，也是心跳间隔
+        self.worker = worker_name()
+        self.worker_dir = os.path.join(directory, 'workers', self.worker)
+        self.tasks = {}
+        self.order = []
+        self.results = {}  # 已完成任务的结果，done文件写出后不再改变
+        self.held = {}  # 本进程持有的任务: 认领文件
+        self.groups = {}  # 本进程持有的任务: 该任务的命令（JobGroup），失去租约时结束
+        self.lost = set()  # 租约过期后被其他进程重新认领的任务
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.heartbeat = None
+
+    def path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    # 加入队列：第一个进程写出任务列表，其余进程核对；之后开始心跳
+    def open(self, tasks, name):
+        for sub in ('claims', 'done', 'workers'):
+            os.makedirs(self.path(sub), exist_ok=True)
+        os.makedirs(self.worker_dir, exist_ok=True)
+        manifest = {'name': name, 'created': time.time(), 'tasks': tasks}
+        if not publish(self.path('queue.json'), manifest):
+            with open(self.path('queue.json'), encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest['name'] != name or [task['id'] for task in manifest['tasks']] != \
+                    [task['id'] for task in tasks]:
+                raise ValueError(f"{self.directory} is the queue of another run ({manifest['name']}), "
+                                 f"use a new queue directory.")
+        self.order = [task['id'] for task in manifest['tasks']]
+        self.tasks = {task['id']: task for task in manifest['tasks']}
+        self.write_worker('running')
+        self.heartbeat = threading.Thread(target=self.beat, daemon=True)
+        self.heartbeat.start()
+
+    def write_worker(self, state):
+        path = self.path('workers', f'{self.worker}.json')
+        with open(path + '.tmp', 'w', encoding="utf-8") as f:
+            json.dump({'host': socket.gethostname(), 'pid': os.getpid(), 'state': state}, f)
+        os.replace(path + '.tmp', path)
+
+    # 更新本进程的心跳文件，返回文件服务器的当前时间
+    def now(self):
+        path = self.path('workers', f'{self.worker}.json')
+        os.utime(path)
+        return os.stat(path).st_mtime
+
+    # 心跳线程：更新本进程和所持有任务的认领文件的修改时间，发现任务已被重新认领时放弃该任务并结束其命令，
+    # 避免两个进程在同一目录中同时生成同样的文件
+    def beat(self):
+        while not self.stopped.wait(self.poll):
+            try:
+                self.now()
+            except OSError:
+                pass
+            with self.lock:
+                held = dict(self.held)
+            for task, claim in held.items():
+                generation = int(claim.rsplit('.', 1)[1])
+                if os.path.exists(self.path('claims', f'{task}.{generation + 1}')):
+                    with self.lock:
+                        group = self.groups.pop(task, None)
+                        if task in self.held:
+                            self.lost.add(task)
+                            del self.held[task]
+                    if group is not None:
+                        group.cancel()
+                    echo(f"! The lease of {task} expired and it was claimed by another worker, it is stopped. !")
+                    continue
+                try:
+                    os.utime(claim)
+                except OSError:
+                    pass
+
+    # 读取已完成任务的结果和各任务当前的认领文件
+    def scan(self):
+        for f in os.listdir(self.path('done')):
+            task = f[:-len('.json')]
+            if f.endswith('.json') and task not in self.results:
+                try:
+                    with open(self.path('done', f), encoding="utf-8") as result:
+                        self.results[task] = json.load(result)
+                except (OSError, ValueError):
+                    continue
+        claims = {}
+        for f in os.listdir(self.path('claims')):
+            task, _, generation = f.rpartition('.')
+            if generation.isdigit() and int(generation) > claims.get(task, 0):
+                claims[task] = int(generation)
+        return claims
+
+    # 认领一个可以开始的任务（依赖的任务都已成功，汇总为都已有结果），kinds为本进程还有空位的任务种类；没有时返回None
+    def claim(self, kinds):
+        claims = self.scan()
+        now = None
+        for task_id in self.order:
+            task = self.tasks[task_id]
+            if task['kind'] not in kinds or task_id in self.results or task_id in self.held:
+                continue
+            # 汇总不因任务失败而失败，只等全部任务有结果，失败的任务在汇总时报告
+            failed = [dep for dep in task['deps'] if self.results.get(dep, {}).get('status') == 'failed']
+            if failed and task['kind'] != 'gather':
+                self.finish(task_id, False, reason=f"{', '.join(failed)} failed")
+                continue
+            if not all(dep in self.results for dep in task['deps']):
+                continue
+            generation = claims.get(task_id, 0)
+            if generation:
+                now = now or self.now()
+                try:
+                    heartbeat = os.stat(self.path('claims', f'{task_id}.{generation}')).st_mtime
+                except FileNotFoundError:
+                    continue
+                if heartbeat > now - self.lease:
+                    continue
+                if generation >= self.max_attempts:
+                    self.finish(task_id, False, reason=f"abandoned after {generation} expired leases")
+                    continue
+            claim = self.path('claims', f'{task_id}.{generation + 1}')
+            try:
+                fd = os.open(claim, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                continue
+            with os.fdopen(fd, 'w', encoding="utf-8") as f:
+                json.dump({'worker': self.worker, 'claimed': time.time()}, f)
+            with self.lock:
+                self.held[task_id] = claim
+                self.groups[task_id] = JobGroup()
+            if generation:
+                echo(f"! The lease of {task_id} expired, it is claimed again by {self.worker}. !")
+            return task
+        return None
+
+    # 本进程持有的任务的命令，没有持有时返回None
+    def group(self, task_id):
+        with self.lock:
+            return self.groups.get(task_id)
+
+    # 记录任务结果；租约已失去（任务已被其他进程重新认领）或已有结果时不记录，返回是否记录
+    def finish(self, task_id, success, **info):
+        with self.lock:
+            claim = self.held.pop(task_id, None)
+            self.groups.pop(task_id, None)
+            if task_id in self.lost:
+                return False
+        result = {'status': 'ok' if success else 'failed', 'worker': self.worker, 'time': time.time(), **info}
+        if claim is not None:
+            result['attempt'] = int(claim.rsplit('.', 1)[1])
+        if not publish(self.path('done', f'{task_id}.json'), result):
+            return False
+        self.results[task_id] = result
+        return True
+
+    # 退出时让仍持有的任务立即过期，由其他进程重新认领
+    def abandon(self):
+        with self.lock:
+            held, self.held = self.held, {}
+            self.groups = {}
+        for claim in held.values():
+            try:
+                os.utime(claim, (0, 0))
+            except OSError:
+                pass
+
+    # 除汇总外的任务是否都已完成
+    def finished(self):
+        self.scan()
+        return all(task_id in self.results for task_id in self.order if self.tasks[task_id]['kind'] != 'gather')
+
+    def close(self, state='finished'):
+        self.stopped.set()
+        self.abandon()
+        self.write_worker(state)
+
+    # 等待其他仍在运行的进程写出资源报告，返回已结束的进程名
+    def wait_workers(self):
+        while True:
+            now = self.now()
+            waiting, finished = [], []
+            for f in os.listdir(self.path('workers')):
+                if not f.endswith('.json'):
+                    continue
+                try:
+                    with open(self.path('workers', f), encoding="utf-8") as worker:
+                        state = json.load(worker)['state']
+                    heartbeat = os.stat(self.path('workers', f)).st_mtime
+                except (OSError, ValueError, KeyError):
+                    continue
+                if state == 'finished':
+                    finished.append(f[:-len('.json')])
+                elif state == 'running' and heartbeat > now - self.lease:
+                    waiting.append(f[:-len('.json')])
+            if not waiting:
+                return finished
+            time.sleep(self.poll)
+
+    # 队列的进度：已完成、失败、运行中和等待中的任务数，不创建任何文件
+    def status(self):
+        with open(self.path('queue.json'), encoding="utf-8") as f:
+            self.order = [task['id'] for task in json.load(f)['tasks']]
+        claims = self.scan()
+        done = sum(1 for task in self.order if task in self.results)
+        failed = sum(1 for task in self.order if self.results.get(task, {}).get('status') == 'failed')
+        running = sum(1 for task in self.order if task not in self.results and task in claims)
+        return {'tasks': len(self.order), 'done': done, 'failed': failed, 'running': running,
+                'waiting': len(self.order) - done - running}